@@ -1,27 +1,59 @@
+import contextvars
 import json
+import math
 import re
 import os
+import hashlib
+import importlib
+import threading
+import time
+import logging
+from collections import OrderedDict, deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime, timezone
+from functools import lru_cache
+from urllib.parse import urlsplit
 import requests
+from requests.adapters import HTTPAdapter
 
-# Import all AI provider libraries with fallbacks
-try:
-    from groq import Groq
-except ImportError:
-    Groq = None
-
-try:
-    import openai
-    from openai import OpenAI
-except ImportError:
-    openai = None
-    OpenAI = None
-
-try:
-    import anthropic
-    from anthropic import Anthropic
-except ImportError:
-    anthropic = None
-    Anthropic = None
+from metrics_util import (
+    log_sampled, metrics_labels, metrics_stage, observe_stage, record_analysis, record_completion, record_long_prompt,
+    record_structured, record_structured_rejection, record_tokens, METRICS, UPSTREAM_LATENCY
+)
+from batch_util import parse_concurrency_limits
+from resilience_util import BREAKER_ENABLED, BREAKERS, FALLBACK_CHAIN, is_provider_failure
+from heuristic_util import analyze_prompt, HEURISTIC_MODEL
+from capture_util import capture_upstream, note_upstream_result, note_upstream_text
+from schema_util import (
+    note_structured_rejection, rejects_structured_output, structured_request_params, SchemaError,
+    StructuredAnalysis
+)
+from long_prompt_util import chunk_prompt, is_long_prompt, merge_section_analyses, section_query
+from token_util import output_token_budget
+
+logger = logging.getLogger(__name__)
+
+# Provider SDKs are imported the first time their provider is used: each
+# pulls in httpx, pydantic and its own model schemas, which costs cold-start
+# time and worker RSS that a single-provider deployment never needs
+_SDK_CLASSES = {
+    "groq": ("groq", "Groq", "AsyncGroq"),
+    "openai": ("openai", "OpenAI", "AsyncOpenAI"),
+    "anthropic": ("anthropic", "Anthropic", "AsyncAnthropic"),
+}
+_sdk_class_cache = {}
+
+def get_sdk_class(provider, asynchronous=False):
+    """Client class from provider's SDK, imported on first use; None if the SDK is not installed"""
+    key = (provider, asynchronous)
+    if key not in _sdk_class_cache:
+        module_name, sync_name, async_name = _SDK_CLASSES[provider]
+        try:
+            module = importlib.import_module(module_name)
+            _sdk_class_cache[key] = getattr(module, async_name if asynchronous else sync_name)
+        except (ImportError, AttributeError):
+            _sdk_class_cache[key] = None
+    return _sdk_class_cache[key]
 
 # Provider configurations
 PROVIDER_CONFIGS = {
@@ -92,12 +124,414 @@ PROVIDER_CONFIGS = {
             "google/gemini-pro-1.5"
         ],
         "default_model": "openai/gpt-4o-mini"
+    },
+    "local": {
+        "name": "Local (heuristic)",
+        "models": [
+            HEURISTIC_MODEL
+        ],
+        "default_model": HEURISTIC_MODEL,
+        # Scored in-process from lexical features - no API key, no network call
+        "requires_api_key": False
     }
 }
 
-def get_analysis_prompt(query, style="comprehensive"):
-    """Get the analysis prompt based on the selected style"""
+# Restrict a deployment to some providers, e.g. ENABLED_PROVIDERS="groq,together";
+# the others are dropped from the catalogue and their SDKs are never loaded
+ENABLED_PROVIDERS = [name.strip().lower() for name in os.getenv("ENABLED_PROVIDERS", "").split(",") if name.strip()]
+if ENABLED_PROVIDERS:
+    PROVIDER_CONFIGS = {name: config for name, config in PROVIDER_CONFIGS.items() if name in ENABLED_PROVIDERS}
+
+# SDK client reuse - keeps warm HTTP connection pools alive between requests
+CLIENT_REGISTRY_MAX_SIZE = int(os.getenv("CLIENT_REGISTRY_MAX_SIZE", 256))
+CLIENT_REGISTRY_IDLE_TTL = float(os.getenv("CLIENT_REGISTRY_IDLE_TTL", 900))
+# An evicted client is closed this long after eviction, once no request can
+# still be running on it (the SDKs' own request timeout is 600s)
+CLIENT_REGISTRY_CLOSE_GRACE = float(os.getenv("CLIENT_REGISTRY_CLOSE_GRACE", 600))
+
+class ClientRegistry:
+    """Thread-safe LRU registry of provider SDK clients with idle expiry
+
+    Clients evicted for size or idleness are closed close_grace seconds
+    later; with close_grace None they are only dereferenced.
+    """
+
+    def __init__(self, max_size=CLIENT_REGISTRY_MAX_SIZE, idle_ttl=CLIENT_REGISTRY_IDLE_TTL,
+                 close_grace=CLIENT_REGISTRY_CLOSE_GRACE):
+        self.max_size = max(1, int(max_size))
+        self.idle_ttl = float(idle_ttl)
+        self.close_grace = close_grace
+        self._clients = OrderedDict()  # key -> [client, last_used]
+        self._retired = deque()  # (retired_at, client), oldest first
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(provider, api_key, base_url=None):
+        """Registry key - the API key is hashed so it is never held as a dict key"""
+        key_hash = hashlib.sha256(api_key.encode("utf-8")).hexdigest()
+        return (provider, key_hash, base_url or "")
+
+    def get(self, provider, api_key, factory, base_url=None):
+        """Return the cached client for this key, building it with factory() on a miss"""
+        key = self.make_key(provider, api_key, base_url)
+
+        with self._lock:
+            client = self._touch(key)
+        if client is not None:
+            self._close_retired()
+            return client
+
+        # Build outside the lock - SDK construction can take a few milliseconds
+        new_client = factory()
+
+        with self._lock:
+            client = self._touch(key)
+            if client is None:
+                client = new_client
+                self._clients[key] = [new_client, time.monotonic()]
+                while len(self._clients) > self.max_size:
+                    self._retire(self._clients.popitem(last=False)[1][0])
+            else:
+                # Another thread built one first
+                self._retire(new_client)
+        self._close_retired()
+        return client
+
+    def _touch(self, key):
+        """Expire idle clients, then mark key as most recently used (lock held)"""
+        now = time.monotonic()
+        while self._clients:
+            oldest_key, (client, last_used) = next(iter(self._clients.items()))
+            if now - last_used <= self.idle_ttl:
+                break
+            del self._clients[oldest_key]
+            self._retire(client)
+
+        entry = self._clients.get(key)
+        if entry is None:
+            return None
+        entry[1] = now
+        self._clients.move_to_end(key)
+        return entry[0]
+
+    def _retire(self, client):
+        """Queue an evicted client for closing (lock held)"""
+        if self.close_grace is not None:
+            self._retired.append((time.monotonic(), client))
+
+    def _close_retired(self):
+        """Close retired clients whose grace period has passed"""
+        closing = []
+        with self._lock:
+            deadline = time.monotonic() - (self.close_grace or 0)
+            while self._retired and self._retired[0][0] <= deadline:
+                closing.append(self._retired.popleft()[1])
+        for client in closing:
+            try:
+                client.close()
+            except Exception as e:
+                logger.debug("Closing an evicted client failed: %s", e)
+
+    def clear(self):
+        """Drop all cached clients; they are closed after the grace period"""
+        with self._lock:
+            for client, _ in self._clients.values():
+                self._retire(client)
+            self._clients.clear()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._clients)
+
+CLIENT_REGISTRY = ClientRegistry()
+
+# Per-provider base URL overrides, e.g. OPENAI_BASE_URL=http://127.0.0.1:8900/v1
+# for a proxy or the benchmark mock (benchmarks/mock_provider.py). SDK
+# providers take the SDK's base URL; REST providers take the URL that
+# "/chat/completions" is appended to.
+PROVIDER_BASE_URLS = {
+    provider: os.getenv(f"{provider.upper()}_BASE_URL", "").rstrip("/")
+    for provider in ("groq", "openai", "anthropic", "mistral", "together", "openrouter")
+    if os.getenv(f"{provider.upper()}_BASE_URL")
+}
+
+def _get_sdk_client(provider, api_key, base_url=None):
+    """Get a shared SDK client for groq, openai or anthropic"""
+    sdk_class = get_sdk_class(provider)
+    kwargs = {"api_key": api_key}
+    base_url = base_url or PROVIDER_BASE_URLS.get(provider)
+    if base_url:
+        kwargs["base_url"] = base_url
+    return CLIENT_REGISTRY.get(provider, api_key, lambda: sdk_class(**kwargs), base_url)
+
+# OpenAI-compatible REST providers, served over pooled keep-alive sessions
+HTTP_PROVIDER_ENDPOINTS = {
+    "mistral": {
+        "label": "Mistral",
+        "url": "https://api.mistral.ai/v1/chat/completions",
+        "headers": {}
+    },
+    "together": {
+        "label": "Together AI",
+        "url": "https://api.together.xyz/v1/chat/completions",
+        "headers": {}
+    },
+    "openrouter": {
+        "label": "OpenRouter",
+        "url": "https://openrouter.ai/api/v1/chat/completions",
+        "headers": {
+            "HTTP-Referer": "https://github.com/prompt-analysis-tool",
+            "X-Title": "Prompt Analysis Tool"
+        }
+    }
+}
+for _provider, _base_url in PROVIDER_BASE_URLS.items():
+    if _provider in HTTP_PROVIDER_ENDPOINTS:
+        HTTP_PROVIDER_ENDPOINTS[_provider]["url"] = f"{_base_url}/chat/completions"
+
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", 32))
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", 30))
+
+_http_sessions = {}
+_http_sessions_lock = threading.Lock()
+
+def _get_http_session(url):
+    """Get the shared keep-alive session for the host of url"""
+    host = urlsplit(url).netloc
+    session = _http_sessions.get(host)
+    if session is not None:
+        return session
     
+    with _http_sessions_lock:
+        session = _http_sessions.get(host)
+        if session is None:
+            session = requests.Session()
+            # One pool per host, sized for concurrent worker threads; extra
+            # connections above the pool size are opened and then discarded.
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=HTTP_POOL_SIZE, max_retries=0)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            session.headers["Connection"] = "keep-alive"
+            _http_sessions[host] = session
+    return session
+
+def prewarm_http_transport(providers=None):
+    """Open a pooled connection to each REST provider so the first request skips TLS setup"""
+    for provider in providers or HTTP_PROVIDER_ENDPOINTS.keys():
+        endpoint = HTTP_PROVIDER_ENDPOINTS.get(provider)
+        if not endpoint or provider not in PROVIDER_CONFIGS:
+            continue
+        parts = urlsplit(endpoint["url"])
+        try:
+            # Any response (usually 401/404) leaves the connection in the pool
+            _get_http_session(endpoint["url"]).head(f"{parts.scheme}://{parts.netloc}/", timeout=5)
+        except Exception:
+            pass
+
+# Client-side rate limiting - token buckets per (provider, api_key) for
+# requests and estimated tokens per minute, so a call that would be refused
+# upstream is refused here before it burns quota. Only limits configured
+# below (or per provider in RATE_LIMIT_RPM / RATE_LIMIT_TPM) or reported in
+# the provider's rate-limit headers are enforced; until then a key's calls
+# pass straight through
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "1") == "1"
+RATE_LIMIT_MAX_WAIT = float(os.getenv("RATE_LIMIT_MAX_WAIT", 2.0))
+RATE_LIMIT_DEFAULT_RPM = int(os.getenv("RATE_LIMIT_DEFAULT_RPM", 0)) or None
+RATE_LIMIT_DEFAULT_TPM = int(os.getenv("RATE_LIMIT_DEFAULT_TPM", 0)) or None
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", 4096))
+
+class TokenBucket:
+    """Bucket refilled continuously to capacity once per minute
+
+    The level may go negative: a caller that is allowed to wait takes its
+    tokens up front, so later callers queue behind the reservation.
+    """
+
+    def __init__(self, capacity, per_seconds=60.0):
+        self.per_seconds = per_seconds
+        self.capacity = float(max(1, capacity))
+        self.rate = self.capacity / per_seconds
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount):
+        """Seconds until amount is available (requests larger than capacity wait for a full bucket)"""
+        amount = min(amount, self.capacity)
+        return 0.0 if self.level >= amount else (amount - self.level) / self.rate
+
+    def take(self, amount):
+        self.level -= min(amount, self.capacity)
+
+    def resize(self, capacity):
+        self.capacity = float(max(1, capacity))
+        self.rate = self.capacity / self.per_seconds
+        self.level = min(self.level, self.capacity)
+
+class RateLimiter:
+    """Request and token buckets per (provider, api_key), learning from rate-limit headers
+
+    A bucket exists only once its limit is known - configured, or learned
+    from a response - so an unknown limit never throttles.
+    """
+
+    def __init__(self, rpm_limits=None, tpm_limits=None, default_rpm=RATE_LIMIT_DEFAULT_RPM,
+                 default_tpm=RATE_LIMIT_DEFAULT_TPM, max_keys=RATE_LIMIT_MAX_KEYS):
+        self.rpm_limits = dict(rpm_limits or {})
+        self.tpm_limits = dict(tpm_limits or {})
+        self.default_rpm = default_rpm
+        self.default_tpm = default_tpm
+        self.max_keys = max(1, int(max_keys))
+        self._states = OrderedDict()  # registry key -> {"requests", "tokens", "blocked_until"}
+        self._lock = threading.Lock()
+
+    def _state(self, provider, api_key):
+        """Buckets for this provider and key, created on first use (lock held)"""
+        key = ClientRegistry.make_key(provider, api_key)
+        state = self._states.get(key)
+        if state is None:
+            rpm = self.rpm_limits.get(provider, self.default_rpm)
+            tpm = self.tpm_limits.get(provider, self.default_tpm)
+            state = self._states[key] = {
+                "requests": TokenBucket(rpm) if rpm else None,
+                "tokens": TokenBucket(tpm) if tpm else None,
+                "blocked_until": 0.0
+            }
+            while len(self._states) > self.max_keys:
+                self._states.popitem(last=False)
+        else:
+            self._states.move_to_end(key)
+        return state
+
+    def reserve(self, provider, api_key, tokens, max_wait=RATE_LIMIT_MAX_WAIT):
+        """Reserve one request and tokens without waiting
+
+        Returns (admitted, seconds): when admitted the caller must wait
+        seconds before calling upstream; otherwise seconds is how long until
+        the call could fit and nothing was reserved.
+        """
+        with self._lock:
+            state = self._state(provider, api_key)
+            now = time.monotonic()
+            buckets = [(bucket, amount) for bucket, amount in ((state["requests"], 1), (state["tokens"], tokens))
+                       if bucket is not None]
+            for bucket, _ in buckets:
+                bucket.refill(now)
+            wait = max([0.0, state["blocked_until"] - now] + [bucket.wait_time(amount) for bucket, amount in buckets])
+            if wait > max_wait:
+                return False, wait
+            for bucket, amount in buckets:
+                bucket.take(amount)
+            return True, wait
+
+    def acquire(self, provider, api_key, tokens, max_wait=RATE_LIMIT_MAX_WAIT):
+        """Reserve one request and tokens, sleeping up to max_wait for them
+
+        Returns None once admitted, or the seconds until the call could fit
+        when that is longer than max_wait.
+        """
+        admitted, wait = self.reserve(provider, api_key, tokens, max_wait)
+        if not admitted:
+            return wait
+        if wait > 0:
+            time.sleep(wait)
+        observe_stage("rate_limit", wait)
+        return None
+
+    def observe_headers(self, provider, api_key, headers):
+        """Tighten the buckets from x-ratelimit-* / anthropic-ratelimit-* / retry-after headers
+
+        A reported limit is adopted as the per-minute capacity only when its
+        window resets within a minute - some providers report per-day request
+        limits in the same header. An exhausted limit of any window blocks
+        the key until it resets.
+        """
+        if not headers:
+            return
+        with self._lock:
+            state = self._state(provider, api_key)
+            now = time.monotonic()
+            for kind in ("requests", "tokens"):
+                bucket = state[kind]
+                limit = _header_number(headers, f"x-ratelimit-limit-{kind}", f"anthropic-ratelimit-{kind}-limit")
+                remaining = _header_number(headers, f"x-ratelimit-remaining-{kind}", f"anthropic-ratelimit-{kind}-remaining")
+                reset = _parse_reset(headers.get(f"x-ratelimit-reset-{kind}") or headers.get(f"anthropic-ratelimit-{kind}-reset"))
+                if limit and reset is not None and reset <= 60:
+                    if bucket is None:
+                        bucket = state[kind] = TokenBucket(limit)
+                    else:
+                        bucket.refill(now)
+                        bucket.resize(limit)
+                    if remaining is not None:
+                        bucket.level = min(bucket.level, remaining)
+                if remaining is not None and remaining < 1 and reset:
+                    state["blocked_until"] = max(state["blocked_until"], now + reset)
+            retry_after = _parse_reset(headers.get("retry-after"))
+            if retry_after:
+                state["blocked_until"] = max(state["blocked_until"], now + retry_after)
+
+    def clear(self):
+        with self._lock:
+            self._states.clear()
+
+_RESET_PART = re.compile(r'(\d+(?:\.\d+)?)(ms|h|m|s)')
+
+def _parse_reset(value):
+    """Seconds from a reset/retry-after header: "12", "7.66s", "6m0s", "120ms" or an RFC 3339 time"""
+    if not value:
+        return None
+    value = str(value).strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    parts = _RESET_PART.findall(value)
+    if parts and "".join(number + unit for number, unit in parts) == value:
+        scale = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+        return sum(float(number) * scale[unit] for number, unit in parts)
+    try:
+        reset_at = datetime.fromisoformat(value.replace("Z", "+00:00"))
+        return max(0.0, (reset_at - datetime.now(timezone.utc)).total_seconds())
+    except ValueError:
+        return None
+
+def _header_number(headers, *names):
+    """First of names present in headers, as a number"""
+    for name in names:
+        value = headers.get(name)
+        if value is not None:
+            try:
+                return float(value)
+            except ValueError:
+                return None
+    return None
+
+def error_headers(error):
+    """Response headers carried by an SDK API error, if any"""
+    return getattr(getattr(error, "response", None), "headers", None)
+
+RATE_LIMITER = RateLimiter(parse_concurrency_limits(os.getenv("RATE_LIMIT_RPM", "")),
+                           parse_concurrency_limits(os.getenv("RATE_LIMIT_TPM", "")))
+
+@lru_cache(maxsize=8)
+def _prompt_overhead(style):
+    """Characters the analysis template adds around the query"""
+    system_prompt, user_prompt = get_analysis_messages("", style)
+    return len(system_prompt) + len(user_prompt)
+
+def estimate_tokens(query, style, max_token):
+    """Rough token cost of one analysis: about 4 characters per prompt token, plus the completion budget"""
+    return (len(query) + _prompt_overhead(style)) // 4 + int(max_token)
+
+def get_analysis_messages(query, style="comprehensive"):
+    """Get (system_prompt, user_prompt) for the selected style
+
+    The system prompt is the static, per-style instructions; only the short
+    user prompt carries the query.
+    """
     if style == "quick":
         return _get_quick_analysis_prompt(query)
     elif style == "detailed":
@@ -105,361 +539,1268 @@ def get_analysis_prompt(query, style="comprehensive"):
     else:  # comprehensive (default)
         return _get_comprehensive_analysis_prompt(query)
 
-def _get_comprehensive_analysis_prompt(query):
-    """Comprehensive analysis - simplified for better API reliability"""
-    return f"""You are an expert prompt engineer. Analyze this prompt and provide a comprehensive evaluation with an enhanced version.
+def get_analysis_prompt(query, style="comprehensive"):
+    """Get the analysis prompt based on the selected style, as one string"""
+    system_prompt, user_prompt = get_analysis_messages(query, style)
+    return f"{system_prompt}\n\n{user_prompt}"
 
-PROMPT TO ANALYZE: "{query}"
+def get_chat_messages(query, style="comprehensive"):
+    """Chat-completions messages: the cacheable instructions first, then the query"""
+    system_prompt, user_prompt = get_analysis_messages(query, style)
+    return [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": user_prompt}
+    ]
 
-Evaluate the prompt on these criteria (1-100 total points):
-- Clarity & Precision (25 points): How clear and specific are the instructions?
-- Context & Background (20 points): Does it provide sufficient context and background?
-- Structure & Organization (20 points): Is it well-organized with clear structure?
-- Role & Persona (15 points): Does it define a clear role or persona?
-- Constraints & Guidelines (10 points): Are there clear constraints and guidelines?
-- Advanced Techniques (10 points): Does it use advanced prompting techniques?
+def get_anthropic_system(style="comprehensive"):
+    """Anthropic system blocks with a cache breakpoint after the static instructions"""
+    system_prompt, _ = get_analysis_messages("", style)
+    return [{"type": "text", "text": system_prompt, "cache_control": {"type": "ephemeral"}}]
 
-Create an enhanced version that:
-1. Defines a clear expert role
-2. Provides specific, detailed instructions
-3. Includes context and background
-4. Has clear structure and formatting
-5. Specifies desired output format
-6. Includes relevant constraints
+def openai_cache_params(style="comprehensive"):
+    """Extra OpenAI request fields that route same-style requests to the same prefix cache"""
+    return {"prompt_cache_key": f"prompt-analysis-{style}"}
 
-RESPOND WITH ONLY THIS JSON FORMAT:
-{{
-    "score": [total score from 1-100],
-    "clarity_score": [1-25],
-    "context_score": [1-20], 
-    "structure_score": [1-20],
-    "role_score": [1-15],
-    "constraints_score": [1-10],
-    "advanced_score": [1-10],
-    "strengths": ["strength1", "strength2", "strength3"],
-    "weaknesses": ["weakness1", "weakness2", "weakness3"],
-    "improvements": ["improvement1", "improvement2", "improvement3"],
-    "new_prompt": "Complete enhanced version of the prompt with professional structure and specific instructions",
-    "reasoning": "Brief explanation of the analysis and enhancements made"
-}}
+def _usage_field(usage, name):
+    """Read one usage field from an SDK object or a decoded JSON dict"""
+    if usage is None:
+        return None
+    if isinstance(usage, dict):
+        return usage.get(name)
+    return getattr(usage, name, None)
 
-Make sure the total score equals the sum of individual scores. The enhanced prompt should be significantly more detailed and professional than the original."""
+def extract_usage(usage):
+    """Normalize a provider usage block to input/output/cached token counts
 
-def prompt_analysis(query, api_key, temp, max_token, provider="groq", model=None, style="comprehensive"):
-    """Main prompt analysis function supporting multiple AI providers"""
-    try:
-        # Validate inputs
-        if not query or not isinstance(query, str) or not query.strip():
-            return "Error", "Please provide a valid prompt to analyze."
-        
-        if not api_key or not isinstance(api_key, str) or not api_key.strip():
-            return "Error", "Please provide a valid API key."
-        
-        # Normalize provider name
-        provider = provider.lower().strip()
-        
-        # Validate provider
-        if provider not in PROVIDER_CONFIGS:
-            return "Error", f"Unsupported provider: {provider}. Supported providers: {', '.join(PROVIDER_CONFIGS.keys())}"
+    OpenAI-compatible APIs report cache hits as prompt_tokens_details.cached_tokens
+    inside prompt_tokens; Anthropic reports cache reads and writes next to
+    input_tokens, which then only counts the uncached remainder.
+    """
+    if usage is None:
+        return None
+    if isinstance(usage, dict) and "cache_write_tokens" in usage:
+        # Already normalized, e.g. summed over a truncation continuation
+        return usage
+    input_tokens = _usage_field(usage, "prompt_tokens")
+    output_tokens = _usage_field(usage, "completion_tokens")
+    cached_tokens = _usage_field(_usage_field(usage, "prompt_tokens_details"), "cached_tokens") or 0
+    cache_write_tokens = 0
+    if input_tokens is None:
+        cached_tokens = _usage_field(usage, "cache_read_input_tokens") or 0
+        cache_write_tokens = _usage_field(usage, "cache_creation_input_tokens") or 0
+        input_tokens = (_usage_field(usage, "input_tokens") or 0) + cached_tokens + cache_write_tokens
+        output_tokens = _usage_field(usage, "output_tokens")
+    return {
+        "input_tokens": int(input_tokens or 0),
+        "output_tokens": int(output_tokens or 0),
+        "cached_tokens": int(cached_tokens),
+        "cache_write_tokens": int(cache_write_tokens)
+    }
+
+def _with_usage(result, usage):
+    """Attach normalized token usage to a successful analysis and count it"""
+    usage = extract_usage(usage)
+    if usage is None:
+        return result
+    record_tokens(usage)
+    score, analysis_result = result
+    if score == "Error" or not isinstance(analysis_result, dict):
+        return result
+    return score, dict(analysis_result, usage=usage)
+
+# Truncated completions - output cut off at max_tokens is repaired when the
+# fields that matter came through whole, otherwise resumed with one
+# continuation call rather than leaving the user to retry from scratch
+TRUNCATION_CONTINUE = os.getenv("TRUNCATION_CONTINUE", "1") == "1"
+CONTINUE_INSTRUCTION = ("Your previous reply was cut off. Continue it exactly where it stopped, "
+                        "without repeating anything or adding commentary.")
+# finish_reason (OpenAI-compatible) and stop_reason (Anthropic) of a cut-off completion
+TRUNCATED_FINISH_REASONS = {"length", "max_tokens"}
+# A repaired analysis is only kept if these fields parsed complete
+ESSENTIAL_FIELDS = ["score", "new_prompt"]
+
+def _complete_analysis(query, style, text, usage, finish_reason, continuation=None, structured=False):
+    """Parse a provider completion, recovering it first if it was cut off at max_tokens
+
+    continuation(partial) -> (text, usage) resumes the completion; the
+    analysis of a truncated completion carries "truncation" with how it was
+    recovered (repaired, continued or unrecovered). structured marks a
+    schema-constrained reply, which is validated rather than searched.
+    """
+    truncated = finish_reason in TRUNCATED_FINISH_REASONS
+    recovery = truncation_recovery(text, continuation) if truncated else None
+    if recovery is None and truncated:
+        try:
+            with metrics_stage("continuation"):
+                text, more_usage = continuation(text or "")
+            usage, recovery = sum_usage(usage, more_usage), "continued"
+        except Exception as e:
+            logger.warning("Truncation continuation failed: %s", e)
+            recovery = "unrecovered"
+    return finish_analysis(query, style, text, usage, truncated, recovery, structured)
+
+def truncation_recovery(text, continuation):
+    """How a cut-off completion is recovered without a call: "repaired" or "unrecovered", or None to continue it"""
+    if {name for name, _ in StreamingFieldParser(ESSENTIAL_FIELDS).feed(text or "")} >= set(ESSENTIAL_FIELDS):
+        # Only trailing fields were lost; _parse_response closes the JSON
+        return "repaired"
+    return None if TRUNCATION_CONTINUE and continuation else "unrecovered"
+
+def finish_analysis(query, style, text, usage, truncated, recovery, structured=False):
+    """Count the completion and parse it, tagging a truncated one with its recovery"""
+    record_completion(style, truncated, recovery)
+    parse = _parse_structured_response if structured else _parse_response
+    score, analysis_result = _with_usage(parse(text, query), usage)
+    if truncated and isinstance(analysis_result, dict):
+        analysis_result = dict(analysis_result, truncation=recovery)
+    return score, analysis_result
+
+def sum_usage(first, second):
+    """Normalized usage of two calls together"""
+    first, second = extract_usage(first), extract_usage(second)
+    if first is None or second is None:
+        return first or second
+    return {field: first[field] + second[field] for field in first}
+
+def continuation_messages(messages, partial):
+    """Chat messages asking the model to resume its cut-off reply"""
+    return messages + [
+        {"role": "assistant", "content": partial},
+        {"role": "user", "content": CONTINUE_INSTRUCTION}
+    ]
+
+def join_continuation(partial, more):
+    """The partial reply with its continuation; a model that started over replaces it"""
+    more = more or ""
+    if more.lstrip().startswith(("{", "```")):
+        return more
+    return partial + more
+
+def _continuation(provider, query, api_key, temp, max_token, model, style):
+    """continue(partial) -> (text, usage) resuming a cut-off analysis on provider
+
+    Anthropic continues a prefilled assistant turn natively; chat completions
+    APIs get the partial reply back with an instruction to carry on.
+    """
+    def continue_analysis(partial):
+        if provider == "anthropic":
+            _, user_prompt = get_analysis_messages(query, style)
+            # Anthropic rejects a final assistant turn ending in whitespace
+            prefix = partial.rstrip()
+            message = _get_sdk_client(provider, api_key).messages.create(
+                model=model,
+                max_tokens=max_token,
+                temperature=temp,
+                system=get_anthropic_system(style),
+                messages=[
+                    {"role": "user", "content": user_prompt},
+                    {"role": "assistant", "content": prefix}
+                ]
+            )
+            return prefix + message.content[0].text, message.usage
         
-        # Set default model if not provided
-        if not model:
-            model = PROVIDER_CONFIGS[provider]["default_model"]
+        messages = continuation_messages(get_chat_messages(query, style), partial)
+        if provider in ("groq", "openai"):
+            extra = {"extra_body": openai_cache_params(style)} if provider == "openai" else {}
+            completion = _get_sdk_client(provider, api_key).chat.completions.create(
+                model=model, messages=messages, temperature=temp, max_tokens=max_token, **extra
+            )
+            return join_continuation(partial, completion.choices[0].message.content), completion.usage
         
-        # Validate parameters
-        try:
-            temp = float(temp)
-            if temp < 0 or temp > 2:
-                temp = 0.7
-        except (ValueError, TypeError):
+        endpoint = HTTP_PROVIDER_ENDPOINTS[provider]
+        response = _get_http_session(endpoint["url"]).post(
+            endpoint["url"],
+            headers={"Content-Type": "application/json", "Authorization": f"Bearer {api_key}", **endpoint["headers"]},
+            json={"model": model, "messages": messages, "temperature": temp, "max_tokens": max_token},
+            timeout=HTTP_TIMEOUT
+        )
+        if response.status_code != 200:
+            raise RuntimeError(f"{endpoint['label']} API error: {response.status_code} - {response.text}")
+        result = response.json()
+        return join_continuation(partial, result["choices"][0]["message"]["content"]), result.get("usage")
+    return continue_analysis
+
+def _get_comprehensive_analysis_prompt(query):
+    """Comprehensive analysis - simplified for better API reliability"""
+    return COMPREHENSIVE_SYSTEM_PROMPT, f'PROMPT TO ANALYZE: "{query}"'
+
+def normalize_analysis_args(query, api_key, temp, max_token, provider, model):
+    """Validate and normalize prompt analysis arguments
+
+    Returns (error_message, provider, model, temp, max_token); error_message
+    is None when the arguments are usable.
+    """
+    # Validate inputs
+    if not query or not isinstance(query, str) or not query.strip():
+        return "Please provide a valid prompt to analyze.", provider, model, temp, max_token
+    
+    if (not api_key or not isinstance(api_key, str) or not api_key.strip()) and provider_requires_api_key(provider):
+        return "Please provide a valid API key.", provider, model, temp, max_token
+    
+    # Normalize provider name
+    provider = provider.lower().strip()
+    
+    # Validate provider
+    if provider not in PROVIDER_CONFIGS:
+        return f"Unsupported provider: {provider}. Supported providers: {', '.join(PROVIDER_CONFIGS.keys())}", provider, model, temp, max_token
+    
+    # Set default model if not provided
+    if not model:
+        model = PROVIDER_CONFIGS[provider]["default_model"]
+    
+    # Validate parameters
+    try:
+        temp = float(temp)
+        if temp < 0 or temp > 2:
             temp = 0.7
-        
-        try:
-            max_token = int(max_token)
-            if max_token < 1 or max_token > 32768:
-                max_token = 1000
-        except (ValueError, TypeError):
+    except (ValueError, TypeError):
+        temp = 0.7
+    
+    try:
+        max_token = int(max_token)
+        if max_token < 1 or max_token > 32768:
             max_token = 1000
-        
-        # Route to appropriate provider
-        if provider == "groq":
-            return _analyze_with_groq(query, api_key, temp, max_token, model, style)
-        elif provider == "openai":
-            return _analyze_with_openai(query, api_key, temp, max_token, model, style)
-        elif provider == "anthropic":
-            return _analyze_with_anthropic(query, api_key, temp, max_token, model, style)
-        elif provider == "mistral":
-            return _analyze_with_mistral(query, api_key, temp, max_token, model, style)
-        elif provider == "together":
-            return _analyze_with_together(query, api_key, temp, max_token, model, style)
-        elif provider == "openrouter":
-            return _analyze_with_openrouter(query, api_key, temp, max_token, model, style)
-        else:
-            return "Error", f"Provider implementation not found: {provider}"
+    except (ValueError, TypeError):
+        max_token = 1000
+    
+    return None, provider, model, temp, max_token
+
+def prompt_analysis(query, api_key, temp, max_token, provider="groq", model=None, style="comprehensive", hedge=None,
+                    fallback=True):
+    """Main prompt analysis function supporting multiple AI providers
+
+    hedge, when given, is {"provider", "model", "api_key"} for a secondary
+    leg that is started if the primary has not answered within the hedge
+    delay; see _hedged_analysis.
+
+    With fallback, a provider-side failure (or a tripped circuit breaker)
+    moves on to the next entry of PROVIDER_FALLBACK_CHAIN; see
+    fallback_chain.
+
+    A prompt over LONG_PROMPT_TOKENS is analyzed section by section; see
+    _long_prompt_analysis.
+    """
+    if splits_long_prompt(query, provider):
+        return _long_prompt_analysis(query, api_key, temp, provider, model, style, hedge, fallback)
+    
+    if hedge:
+        return _hedged_analysis(query, api_key, temp, max_token, provider, model, style, hedge)
+    
+    try:
+        legs = fallback_chain(provider, model, api_key) if fallback else [(provider, model, api_key)]
+        result = None
+        for position, (leg_provider, leg_model, leg_key) in enumerate(legs):
+            leg_result = _analyze_once(query, leg_key, temp, max_token, leg_provider, leg_model, style)
+            result, done = merge_fallback_leg(result, leg_result, position, leg_provider, leg_model)
+            if done:
+                break
+        return result
+    
+    except Exception as e:
+        return "Error", f"Error in prompt analysis: {str(e)}"
+
+# Long prompts - sections are analyzed on their own pool, so a long prompt in
+# a batch or hedge worker never waits on a pool it is occupying
+LONG_PROMPT_MAX_WORKERS = int(os.getenv("LONG_PROMPT_MAX_WORKERS", 32))
+
+_long_prompt_executor = None
+_long_prompt_executor_lock = threading.Lock()
+# Set while analyzing one section of a long prompt
+analyzing_section = contextvars.ContextVar("analyzing_section", default=False)
+
+def _get_long_prompt_executor():
+    """Shared pool for long-prompt sections, created on first use"""
+    global _long_prompt_executor
+    if _long_prompt_executor is None:
+        with _long_prompt_executor_lock:
+            if _long_prompt_executor is None:
+                _long_prompt_executor = ThreadPoolExecutor(max_workers=LONG_PROMPT_MAX_WORKERS,
+                                                           thread_name_prefix="long-prompt")
+    return _long_prompt_executor
+
+def splits_long_prompt(query, provider):
+    """Whether query is analyzed section by section (never a section itself, nor locally)"""
+    return not analyzing_section.get() and provider_requires_api_key(provider) and is_long_prompt(query, provider)
+
+def _long_prompt_analysis(query, api_key, temp, provider, model, style, hedge, fallback):
+    """Map-reduce analysis of a long prompt
+
+    The prompt is split at section boundaries (long_prompt_util.chunk_prompt),
+    the sections are analyzed in parallel - each with its own output budget,
+    fallback and hedge - and merge_section_analyses combines them, so
+    latency follows the slowest section rather than the prompt's length.
+    """
+    try:
+        chunks = chunk_prompt(query, provider)
+        executor = _get_long_prompt_executor()
+        futures = [executor.submit(contextvars.copy_context().run, _analyze_section, section_query(chunks, index),
+                                   api_key, temp, provider, model, style, hedge, fallback)
+                   for index in range(len(chunks))]
+        results = []
+        for future in futures:
+            try:
+                results.append(future.result())
+            except Exception as e:
+                results.append(e)
+        result = merge_section_analyses(chunks, results, provider)
+        record_long_prompt(result[1])
+        return result
     
     except Exception as e:
         return "Error", f"Error in prompt analysis: {str(e)}"
 
+def _analyze_section(query, api_key, temp, provider, model, style, hedge, fallback):
+    """One section of a long prompt, analyzed as a prompt of its own (in a copied context)"""
+    analyzing_section.set(True)
+    return prompt_analysis(query, api_key, temp, output_token_budget(query, style, provider, model), provider, model,
+                           style, hedge=hedge, fallback=fallback)
+
+def merge_fallback_leg(result, leg_result, position, provider, model):
+    """Fold one fallback-chain leg into the result so far
+
+    Returns (result, done). The primary's error is kept unless a later leg
+    does better, and a fallback success is tagged with served_by.
+    """
+    if position > 0:
+        METRICS.inc("prompt_analysis_fallback_total", provider=metric_labels(provider, model)[0],
+                    outcome="error" if leg_result[0] == "Error" else "ok")
+    if leg_result[0] == "Error":
+        return result or leg_result, not is_provider_failure(leg_result[1])
+    if position > 0 and isinstance(leg_result[1], dict):
+        leg_result = (leg_result[0], dict(leg_result[1], served_by={
+            "provider": provider,
+            "model": model or PROVIDER_CONFIGS[provider]["default_model"],
+            "fallback": True
+        }))
+    return leg_result, True
+
+def _analyze_once(query, api_key, temp, max_token, provider, model, style):
+    """One provider call, guarded by that provider/model's circuit breaker"""
+    started = time.perf_counter()
+    error, provider, model, temp, max_token = normalize_analysis_args(query, api_key, temp, max_token, provider, model)
+    provider_label, model_label = metric_labels(provider, model)
+    observe_stage("validation", time.perf_counter() - started, provider_label, model_label)
+    breaker = BREAKERS.get(provider_label, model_label) if BREAKER_ENABLED and not error else None
+    if error:
+        result = ("Error", error)
+    elif breaker and not breaker.allow():
+        # Open circuit - fail fast rather than waiting out another timeout
+        result = circuit_open_result(provider, breaker, provider_label, model_label)
+    else:
+        result = _rate_limit(provider, api_key, query, style, max_token, provider_label, model_label)
+        if result:
+            if breaker:
+                breaker.release()
+        else:
+            called = time.perf_counter()
+            with metrics_labels(provider_label, model_label), capture_upstream(provider, model):
+                result = _route_analysis(provider, query, api_key, temp, max_token, model, style)
+                note_upstream_result(result)
+            if breaker:
+                breaker.record(result[0] == "Error" and is_provider_failure(result[1]), time.perf_counter() - called)
+    record_analysis(provider_label, model_label, result[0], result[1], time.perf_counter() - started)
+    return result
+
+def _rate_limit(provider, api_key, query, style, max_token, provider_label, model_label):
+    """Wait for the client-side rate limiter; returns an error result if the call cannot fit in time"""
+    if not RATE_LIMIT_ENABLED or not provider_requires_api_key(provider):
+        return None
+    with metrics_labels(provider_label, model_label):
+        retry_after = RATE_LIMITER.acquire(provider, api_key, estimate_tokens(query, style, max_token))
+    if retry_after is None:
+        return None
+    return rate_limited_result(provider, retry_after, provider_label, model_label)
+
+def rate_limited_result(provider, retry_after, provider_label, model_label):
+    """Error result for a call the rate limiter refused"""
+    METRICS.inc("rate_limit_rejections_total", provider=provider_label, model=model_label)
+    return ("Error", f"{PROVIDER_CONFIGS[provider]['name']} rate limit reached (client-side); "
+                     f"retry in {max(1, math.ceil(retry_after))}s")
+
+def circuit_open_result(provider, breaker, provider_label, model_label):
+    """Error result for a call an open circuit breaker refused"""
+    METRICS.inc("circuit_breaker_rejections_total", provider=provider_label, model=model_label)
+    return ("Error", f"{PROVIDER_CONFIGS[provider]['name']} is temporarily unavailable (circuit open); "
+                     f"retry in {max(1, round(breaker.retry_after()))}s")
+
+def fallback_chain(provider, model, api_key):
+    """Ordered (provider, model, api_key) legs: the request, then PROVIDER_FALLBACK_CHAIN
+
+    A chain entry for another provider runs on the deployment's key from
+    <PROVIDER>_API_KEY and is skipped when that is unset; an entry for the
+    requested provider reuses the caller's key. The keyless "local" provider
+    makes an offline last resort.
+    """
+    provider = str(provider or "groq").lower().strip()
+    legs = [(provider, model, api_key)]
+    seen = {(provider, model or PROVIDER_CONFIGS.get(provider, {}).get("default_model"))}
+    for leg_provider, leg_model in FALLBACK_CHAIN:
+        if leg_provider not in PROVIDER_CONFIGS:
+            continue
+        if leg_provider == provider:
+            leg_key = api_key
+        elif not provider_requires_api_key(leg_provider):
+            leg_key = "local"
+        else:
+            leg_key = os.getenv(f"{leg_provider.upper()}_API_KEY")
+        resolved = (leg_provider, leg_model or PROVIDER_CONFIGS[leg_provider]["default_model"])
+        if not leg_key or resolved in seen:
+            continue
+        seen.add(resolved)
+        legs.append((leg_provider, leg_model, leg_key))
+    return legs
+
+def get_breaker_states():
+    """Circuit breaker state per provider/model, for the status endpoint"""
+    return BREAKERS.snapshot()
+
+# Hedged requests - a second leg is sent once the primary is slower than usual
+HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", 95))
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", 20))
+HEDGE_MIN_DELAY = float(os.getenv("HEDGE_MIN_DELAY", 1.0))
+HEDGE_DEFAULT_DELAY = float(os.getenv("HEDGE_DEFAULT_DELAY", 8.0))
+HEDGE_MAX_WORKERS = int(os.getenv("HEDGE_MAX_WORKERS", 64))
+
+_hedge_executor = None
+_hedge_executor_lock = threading.Lock()
+
+def _get_hedge_executor():
+    """Shared pool for hedge legs, created on first use"""
+    global _hedge_executor
+    if _hedge_executor is None:
+        with _hedge_executor_lock:
+            if _hedge_executor is None:
+                _hedge_executor = ThreadPoolExecutor(max_workers=HEDGE_MAX_WORKERS, thread_name_prefix="hedge")
+    return _hedge_executor
+
+def get_hedge_delay(provider, model):
+    """Seconds to wait on the primary before hedging
+
+    The HEDGE_PERCENTILE of recent successful latencies for provider/model,
+    floored at HEDGE_MIN_DELAY; HEDGE_DEFAULT_DELAY until enough samples exist.
+    """
+    provider = str(provider or "groq").lower().strip()
+    model = model or PROVIDER_CONFIGS.get(provider, {}).get("default_model")
+    provider_label, model_label = metric_labels(provider, model)
+    observed = UPSTREAM_LATENCY.percentile(provider_label, model_label, HEDGE_PERCENTILE, HEDGE_MIN_SAMPLES)
+    if observed is None:
+        return HEDGE_DEFAULT_DELAY
+    return max(HEDGE_MIN_DELAY, observed)
+
+def is_usable_result(result):
+    """A leg wins only with a fully parsed analysis"""
+    score, analysis_result = result
+    return score != "Error" and isinstance(analysis_result, dict) and not analysis_result.get("parse_fallback")
+
+def _hedged_analysis(query, api_key, temp, max_token, provider, model, style, hedge):
+    """Race the primary against a delayed secondary leg; the first usable result wins
+
+    Python threads cannot be interrupted, so the losing leg is left to finish
+    in the background and its result is discarded.
+    """
+    hedge_provider = hedge.get("provider") or provider
+    hedge_model = hedge.get("model")
+    hedge_key = hedge.get("api_key") or api_key
+    delay = get_hedge_delay(provider, model)
+    started = time.perf_counter()
+    
+    executor = _get_hedge_executor()
+    # Legs run in this request's context, so a traffic capture sees their calls
+    legs = {executor.submit(contextvars.copy_context().run, prompt_analysis, query, api_key, temp, max_token,
+                            provider, model, style, fallback=False): "primary"}
+    done, _ = wait(legs, timeout=delay)
+    primary = next(iter(legs))
+    if done and is_usable_result(primary.result()):
+        return tag_hedge(primary.result(), "primary", False, delay, started)
+    
+    legs[executor.submit(contextvars.copy_context().run, prompt_analysis, query, hedge_key, temp, max_token,
+                         hedge_provider, hedge_model, style, fallback=False)] = "secondary"
+    served_by = hedge_served_by(provider, model, hedge_provider, hedge_model)
+    pending = set(legs)
+    fallback = None
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            result = future.result()
+            if is_usable_result(result):
+                for loser in pending:
+                    loser.cancel()
+                return tag_hedge(result, legs[future], True, delay, started, served_by)
+            # Prefer the primary's error if neither leg succeeds
+            if fallback is None or legs[future] == "primary":
+                fallback = (result, legs[future])
+    return tag_hedge(fallback[0], fallback[1], True, delay, started, served_by)
+
+def hedge_served_by(provider, model, hedge_provider, hedge_model):
+    """served_by for the secondary leg, or None when it runs the primary's provider and model"""
+    def resolve(name, model_name):
+        name = str(name or "groq").lower().strip()
+        return name, model_name or PROVIDER_CONFIGS.get(name, {}).get("default_model")
+
+    primary, secondary = resolve(provider, model), resolve(hedge_provider, hedge_model)
+    if secondary == primary:
+        return None
+    return {"provider": secondary[0], "model": secondary[1], "hedge": True}
+
+def tag_hedge(result, winner, hedged, delay, started, served_by=None):
+    """Record which leg won, on the result and in metrics
+
+    A secondary win is tagged with served_by (see hedge_served_by), which
+    keeps another model's answer out of the primary's cache entry.
+    """
+    score, analysis_result = result
+    METRICS.inc("prompt_analysis_hedge_total", winner=winner if hedged else "unhedged")
+    if isinstance(analysis_result, dict):
+        analysis_result = dict(analysis_result, hedge={
+            "winner": winner,
+            "hedged": hedged,
+            "delay": round(delay, 3),
+            "elapsed": round(time.perf_counter() - started, 3)
+        })
+        if winner == "secondary" and served_by:
+            analysis_result["served_by"] = served_by
+    return score, analysis_result
+
+def _route_analysis(provider, query, api_key, temp, max_token, model, style):
+    """Route to appropriate provider"""
+    if provider == "groq":
+        return _analyze_with_groq(query, api_key, temp, max_token, model, style)
+    elif provider == "openai":
+        return _analyze_with_openai(query, api_key, temp, max_token, model, style)
+    elif provider == "anthropic":
+        return _analyze_with_anthropic(query, api_key, temp, max_token, model, style)
+    elif provider == "mistral":
+        return _analyze_with_mistral(query, api_key, temp, max_token, model, style)
+    elif provider == "together":
+        return _analyze_with_together(query, api_key, temp, max_token, model, style)
+    elif provider == "openrouter":
+        return _analyze_with_openrouter(query, api_key, temp, max_token, model, style)
+    elif provider == "local":
+        return analyze_with_local(query, style)
+    else:
+        return "Error", f"Provider implementation not found: {provider}"
+
+def metric_labels(provider, model):
+    """Provider/model metric labels, bounded to the configured catalogue"""
+    config = PROVIDER_CONFIGS.get(provider) if isinstance(provider, str) else None
+    if config is None:
+        return "invalid", "none"
+    return provider, model if model in config["models"] else "other"
+
+def refuses_structured(provider, model, structured, failure):
+    """Whether failure - an SDK error or a non-200 response - is provider/model refusing the structured params
+
+    A refusing model is noted, so later requests for it go out as free text.
+    """
+    status = getattr(failure, "status_code", None)
+    if not structured or status != 400:
+        return False
+    message = failure.text if hasattr(failure, "text") else str(failure)
+    if not rejects_structured_output(status, message):
+        return False
+    note_structured_rejection(provider, model)
+    logger.warning("%s model %s refused structured output, using free text: %.200s", provider, model, message)
+    record_structured_rejection(*metric_labels(provider, model))
+    return True
+
+def structured_call(provider, model, call, stream=False):
+    """(call(**params), params) with provider/model's structured-output request params
+
+    A 400 refusing those params is retried once without them, so a model
+    that lacks structured output neither fails the analysis nor counts
+    against its circuit breaker.
+    """
+    structured = structured_request_params(provider, model, stream)
+    try:
+        response = call(**structured)
+    except Exception as e:
+        if not refuses_structured(provider, model, structured, e):
+            raise
+    else:
+        if not refuses_structured(provider, model, structured, response):
+            return response, structured
+    return call(), {}
+
 def _analyze_with_groq(query, api_key, temp, max_token, model, style):
     """Analyze prompt using Groq"""
-    if not Groq:
+    if not get_sdk_class("groq"):
         return "Error", "Groq library not installed. Run: pip install groq"
     
     try:
-        client = Groq(api_key=api_key)
+        client = _get_sdk_client("groq", api_key)
         
-        completion = client.chat.completions.create(
-            model=model,
-            messages=[
-                {"role": "user", "content": get_analysis_prompt(query, style)}
-            ],
-            temperature=temp,
-            max_tokens=max_token,
-            top_p=1,
-            stream=False,
-            stop=None,
-        )
+        with metrics_stage("prompt"):
+            messages = get_chat_messages(query, style)
+        
+        def create(**structured):
+            return client.chat.completions.with_raw_response.create(
+                model=model,
+                messages=messages,
+                temperature=temp,
+                max_tokens=max_token,
+                top_p=1,
+                stream=False,
+                stop=None,
+                **structured
+            )
+        
+        with metrics_stage("upstream"):
+            raw, structured = structured_call("groq", model, create)
+            completion = raw.parse()
+        RATE_LIMITER.observe_headers("groq", api_key, raw.headers)
         
-        # Debug: Print the actual response
         response_content = completion.choices[0].message.content
-        print(f"DEBUG: Groq API Response: {response_content[:500]}...")  # Print first 500 chars
+        log_sampled(logger, "Groq API response: %.500s", response_content)
         
-        return _parse_response(response_content, query)
+        return _complete_analysis(query, style, response_content, completion.usage, completion.choices[0].finish_reason,
+                                  _continuation("groq", query, api_key, temp, max_token, model, style),
+                                  structured=bool(structured))
     
     except Exception as e:
-        print(f"DEBUG: Groq API Error: {str(e)}")  # Debug error
+        logger.warning("Groq API error: %s", e)
+        RATE_LIMITER.observe_headers("groq", api_key, error_headers(e))
         return "Error", f"Groq API error: {str(e)}"
 
 def _analyze_with_openai(query, api_key, temp, max_token, model, style):
     """Analyze prompt using OpenAI"""
-    if not OpenAI:
+    if not get_sdk_class("openai"):
         return "Error", "OpenAI library not installed. Run: pip install openai"
     
     try:
-        client = OpenAI(api_key=api_key)
+        client = _get_sdk_client("openai", api_key)
         
-        completion = client.chat.completions.create(
-            model=model,
-            messages=[
-                {"role": "user", "content": get_analysis_prompt(query, style)}
-            ],
-            temperature=temp,
-            max_tokens=max_token,
-            top_p=1,
-        )
+        with metrics_stage("prompt"):
+            messages = get_chat_messages(query, style)
+        
+        def create(**structured):
+            return client.chat.completions.with_raw_response.create(
+                model=model,
+                messages=messages,
+                temperature=temp,
+                max_tokens=max_token,
+                top_p=1,
+                extra_body=openai_cache_params(style),
+                **structured
+            )
+        
+        with metrics_stage("upstream"):
+            raw, structured = structured_call("openai", model, create)
+            completion = raw.parse()
+        RATE_LIMITER.observe_headers("openai", api_key, raw.headers)
         
-        return _parse_response(completion.choices[0].message.content, query)
+        choice = completion.choices[0]
+        return _complete_analysis(query, style, choice.message.content, completion.usage, choice.finish_reason,
+                                  _continuation("openai", query, api_key, temp, max_token, model, style),
+                                  structured=bool(structured))
     
     except Exception as e:
+        logger.warning("OpenAI API error: %s", e)
+        RATE_LIMITER.observe_headers("openai", api_key, error_headers(e))
         return "Error", f"OpenAI API error: {str(e)}"
 
 def _analyze_with_anthropic(query, api_key, temp, max_token, model, style):
     """Analyze prompt using Anthropic Claude"""
-    if not Anthropic:
+    if not get_sdk_class("anthropic"):
         return "Error", "Anthropic library not installed. Run: pip install anthropic"
     
     try:
-        client = Anthropic(api_key=api_key)
+        client = _get_sdk_client("anthropic", api_key)
         
-        message = client.messages.create(
-            model=model,
-            max_tokens=max_token,
-            temperature=temp,
-            messages=[
-                {"role": "user", "content": get_analysis_prompt(query, style)}
-            ]
-        )
+        with metrics_stage("prompt"):
+            _, user_prompt = get_analysis_messages(query, style)
+        
+        def create(**structured):
+            return client.messages.with_raw_response.create(
+                model=model,
+                max_tokens=max_token,
+                temperature=temp,
+                system=get_anthropic_system(style),
+                messages=[
+                    {"role": "user", "content": user_prompt}
+                ],
+                **structured
+            )
+        
+        with metrics_stage("upstream"):
+            raw, structured = structured_call("anthropic", model, create)
+            message = raw.parse()
+        RATE_LIMITER.observe_headers("anthropic", api_key, raw.headers)
         
-        return _parse_response(message.content[0].text, query)
+        # A cut-off tool call cannot be resumed as text
+        return _complete_analysis(query, style, anthropic_reply_text(message), message.usage, message.stop_reason,
+                                  None if structured else _continuation("anthropic", query, api_key, temp, max_token,
+                                                                        model, style),
+                                  structured=bool(structured))
     
     except Exception as e:
+        logger.warning("Anthropic API error: %s", e)
+        RATE_LIMITER.observe_headers("anthropic", api_key, error_headers(e))
         return "Error", f"Anthropic API error: {str(e)}"
 
 def _analyze_with_mistral(query, api_key, temp, max_token, model, style):
     """Analyze prompt using Mistral AI"""
+    return _analyze_with_openai_compatible("mistral", query, api_key, temp, max_token, model, style)
+
+def _analyze_with_together(query, api_key, temp, max_token, model, style):
+    """Analyze prompt using Together AI"""
+    return _analyze_with_openai_compatible("together", query, api_key, temp, max_token, model, style)
+
+def _analyze_with_openrouter(query, api_key, temp, max_token, model, style):
+    """Analyze prompt using OpenRouter"""
+    return _analyze_with_openai_compatible("openrouter", query, api_key, temp, max_token, model, style)
+
+def analyze_with_local(query, style):
+    """Analyze prompt with the in-process heuristic scorer"""
+    with metrics_stage("parse"):
+        return analyze_prompt(query, style)
+
+def _analyze_with_openai_compatible(provider, query, api_key, temp, max_token, model, style):
+    """Analyze prompt through an OpenAI-compatible chat completions REST API"""
+    endpoint = HTTP_PROVIDER_ENDPOINTS[provider]
+    label = endpoint["label"]
     try:
         headers = {
             "Content-Type": "application/json",
-            "Authorization": f"Bearer {api_key}"
+            "Authorization": f"Bearer {api_key}",
+            **endpoint["headers"]
         }
         
+        with metrics_stage("prompt"):
+            messages = get_chat_messages(query, style)
+        
         data = {
             "model": model,
-            "messages": [
-                {"role": "user", "content": get_analysis_prompt(query, style)}
-            ],
+            "messages": messages,
             "temperature": temp,
             "max_tokens": max_token
         }
         
-        response = requests.post(
-            "https://api.mistral.ai/v1/chat/completions",
-            headers=headers,
-            json=data,
-            timeout=30
-        )
+        def post(**structured):
+            return _get_http_session(endpoint["url"]).post(
+                endpoint["url"],
+                headers=headers,
+                json={**data, **structured},
+                timeout=HTTP_TIMEOUT
+            )
+        
+        with metrics_stage("upstream"):
+            response, structured = structured_call(provider, model, post)
+            result = response.json() if response.status_code == 200 else None
+        RATE_LIMITER.observe_headers(provider, api_key, response.headers)
         
         if response.status_code != 200:
-            return "Error", f"Mistral API error: {response.status_code} - {response.text}"
+            logger.warning("%s API error: %s", label, response.status_code)
+            return "Error", f"{label} API error: {response.status_code} - {response.text}"
         
-        result = response.json()
-        return _parse_response(result["choices"][0]["message"]["content"], query)
+        choice = result["choices"][0]
+        return _complete_analysis(query, style, choice["message"]["content"], result.get("usage"),
+                                  choice.get("finish_reason"),
+                                  _continuation(provider, query, api_key, temp, max_token, model, style),
+                                  structured=bool(structured))
     
     except Exception as e:
-        return "Error", f"Mistral API error: {str(e)}"
+        logger.warning("%s API error: %s", label, e)
+        return "Error", f"{label} API error: {str(e)}"
 
-def _analyze_with_together(query, api_key, temp, max_token, model, style):
-    """Analyze prompt using Together AI"""
+# Top-level analysis fields worth sending to the client as soon as they parse
+STREAMED_FIELDS = [
+    "score", "clarity_score", "context_score", "structure_score", "role_score",
+    "constraints_score", "advanced_score", "strengths", "weaknesses",
+    "improvements", "new_prompt", "reasoning"
+]
+
+class StreamingFieldParser:
+    """Pull completed top-level JSON fields out of a partially streamed response"""
+
+    def __init__(self, fields=STREAMED_FIELDS):
+        self.pending = list(fields)
+        self.text = ""
+        self._decoder = json.JSONDecoder()
+        self._patterns = {field: re.compile(r'"%s"\s*:\s*' % re.escape(field)) for field in fields}
+
+    def feed(self, delta):
+        """Add streamed text; return a list of (field, value) pairs that just completed"""
+        self.text += delta
+        completed = []
+        for field in list(self.pending):
+            match = self._patterns[field].search(self.text)
+            if not match:
+                continue
+            try:
+                value, _ = self._decoder.raw_decode(self.text, match.end())
+            except json.JSONDecodeError:
+                continue
+            # A bare number is only final once something follows it
+            if isinstance(value, (int, float)) and not re.match(r'-?[\d.eE+-]+\s*[,}\n]', self.text[match.end():]):
+                continue
+            completed.append((field, value))
+            self.pending.remove(field)
+        return completed
+
+def stream_prompt_analysis(query, api_key, temp, max_token, provider="groq", model=None, style="comprehensive"):
+    """Streaming variant of prompt_analysis
+
+    Yields ("delta", text) as the provider streams, ("field", (name, value))
+    whenever a top-level field becomes parseable, and finally ("result",
+    (score, analysis_result)) with exactly what prompt_analysis would return.
+    """
+    started = time.perf_counter()
     try:
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {api_key}"
-        }
+        error, provider, model, temp, max_token = normalize_analysis_args(query, api_key, temp, max_token, provider, model)
+        provider_label, model_label = metric_labels(provider, model)
+        observe_stage("validation", time.perf_counter() - started, provider_label, model_label)
+        if error:
+            yield "result", ("Error", error)
+            return
         
-        data = {
-            "model": model,
-            "messages": [
-                {"role": "user", "content": get_analysis_prompt(query, style)}
-            ],
-            "temperature": temp,
-            "max_tokens": max_token
-        }
+        if splits_long_prompt(query, provider):
+            # Sections are analyzed in parallel, so there is no single stream to relay
+            yield "result", prompt_analysis(query, api_key, temp, max_token, provider, model, style)
+            return
         
-        response = requests.post(
-            "https://api.together.xyz/v1/chat/completions",
-            headers=headers,
-            json=data,
-            timeout=30
-        )
+        if not provider_requires_api_key(provider):
+            # Local scoring has nothing to stream - the result is immediate
+            with metrics_labels(provider_label, model_label):
+                result = _route_analysis(provider, query, api_key, temp, max_token, model, style)
+            record_analysis(provider_label, model_label, result[0], result[1], time.perf_counter() - started)
+            yield "result", result
+            return
         
-        if response.status_code != 200:
-            return "Error", f"Together AI API error: {response.status_code} - {response.text}"
+        breaker = BREAKERS.get(provider_label, model_label) if BREAKER_ENABLED else None
+        if breaker and not breaker.allow():
+            yield "result", circuit_open_result(provider, breaker, provider_label, model_label)
+            return
         
-        result = response.json()
-        return _parse_response(result["choices"][0]["message"]["content"], query)
+        limited = _rate_limit(provider, api_key, query, style, max_token, provider_label, model_label)
+        if limited:
+            if breaker:
+                breaker.release()
+            yield "result", limited
+            return
+        
+        usage = {}
+        if provider in ("groq", "openai", "anthropic"):
+            chunks = _stream_with_sdk(provider, query, api_key, temp, max_token, model, style, usage)
+            label = PROVIDER_CONFIGS[provider]["name"]
+        else:
+            chunks = _stream_with_openai_compatible(provider, query, api_key, temp, max_token, model, style, usage)
+            label = HTTP_PROVIDER_ENDPOINTS[provider]["label"]
+        
+        parser = StreamingFieldParser()
+        upstream_started = time.perf_counter()
+        first_token = True
+        result = None
+        try:
+            for delta in chunks:
+                if not delta:
+                    continue
+                if first_token:
+                    first_token = False
+                    observe_stage("first_token", time.perf_counter() - upstream_started, provider_label, model_label)
+                yield "delta", delta
+                for field in parser.feed(delta):
+                    yield "field", field
+        except Exception as e:
+            logger.warning("%s API stream error: %s", label, e)
+            RATE_LIMITER.observe_headers(provider, api_key, error_headers(e))
+            result = ("Error", f"{label} API error: {str(e)}")
+        else:
+            observe_stage("upstream", time.perf_counter() - upstream_started, provider_label, model_label)
+            with metrics_labels(provider_label, model_label):
+                result = _complete_analysis(query, style, parser.text, usage.get("usage"), usage.get("finish_reason"),
+                                            _continuation(provider, query, api_key, temp, max_token, model, style),
+                                            structured=bool(structured_request_params(provider, model, stream=True)))
+        finally:
+            if breaker:
+                # A stream the client abandoned says nothing about the provider
+                if result is None:
+                    breaker.release()
+                else:
+                    breaker.record(result[0] == "Error" and is_provider_failure(result[1]),
+                                   time.perf_counter() - upstream_started)
+        
+        record_analysis(provider_label, model_label, result[0], result[1], time.perf_counter() - started)
+        yield "result", result
     
     except Exception as e:
-        return "Error", f"Together AI API error: {str(e)}"
+        yield "result", ("Error", f"Error in prompt analysis: {str(e)}")
 
-def _analyze_with_openrouter(query, api_key, temp, max_token, model, style):
-    """Analyze prompt using OpenRouter"""
-    try:
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {api_key}",
-            "HTTP-Referer": "https://github.com/prompt-analysis-tool",
-            "X-Title": "Prompt Analysis Tool"
-        }
-        
-        data = {
-            "model": model,
-            "messages": [
-                {"role": "user", "content": get_analysis_prompt(query, style)}
-            ],
-            "temperature": temp,
-            "max_tokens": max_token
-        }
-        
-        response = requests.post(
-            "https://openrouter.ai/api/v1/chat/completions",
-            headers=headers,
-            json=data,
-            timeout=30
+def _stream_with_sdk(provider, query, api_key, temp, max_token, model, style, usage):
+    """Yield text deltas from the Groq, OpenAI or Anthropic SDK in stream mode
+
+    The provider's token usage, when it reports one, is left in usage["usage"]
+    and its finish (or stop) reason in usage["finish_reason"].
+    """
+    if not get_sdk_class(provider):
+        raise RuntimeError(f"{PROVIDER_CONFIGS[provider]['name']} library not installed. Run: pip install {provider}")
+    client = _get_sdk_client(provider, api_key)
+    
+    if provider == "anthropic":
+        _, user_prompt = get_analysis_messages(query, style)
+        with client.messages.stream(model=model, max_tokens=max_token, temperature=temp,
+                                    system=get_anthropic_system(style),
+                                    messages=[{"role": "user", "content": user_prompt}]) as stream:
+            for text in stream.text_stream:
+                yield text
+            final = stream.get_final_message()
+            usage["usage"], usage["finish_reason"] = final.usage, final.stop_reason
+        return
+    
+    extra = {"stream_options": {"include_usage": True}, "extra_body": openai_cache_params(style)} if provider == "openai" else {}
+    
+    def create(**structured):
+        return client.chat.completions.create(
+            model=model,
+            messages=get_chat_messages(query, style),
+            temperature=temp,
+            max_tokens=max_token,
+            top_p=1,
+            stream=True,
+            **extra,
+            **structured
         )
-        
+    
+    stream, _ = structured_call(provider, model, create, stream=True)
+    for chunk in stream:
+        if getattr(chunk, "usage", None) is not None:
+            usage["usage"] = chunk.usage
+        if chunk.choices:
+            if chunk.choices[0].finish_reason:
+                usage["finish_reason"] = chunk.choices[0].finish_reason
+            yield chunk.choices[0].delta.content or ""
+
+def _stream_with_openai_compatible(provider, query, api_key, temp, max_token, model, style, usage):
+    """Yield text deltas from an OpenAI-compatible REST API over server-sent events"""
+    endpoint = HTTP_PROVIDER_ENDPOINTS[provider]
+    headers = {
+        "Content-Type": "application/json",
+        "Accept": "text/event-stream",
+        "Authorization": f"Bearer {api_key}",
+        **endpoint["headers"]
+    }
+    data = {
+        "model": model,
+        "messages": get_chat_messages(query, style),
+        "temperature": temp,
+        "max_tokens": max_token,
+        "stream": True
+    }
+    
+    def post(**structured):
+        return _get_http_session(endpoint["url"]).post(
+            endpoint["url"], headers=headers, json={**data, **structured}, timeout=HTTP_TIMEOUT, stream=True
+        )
+    
+    response, _ = structured_call(provider, model, post, stream=True)
+    with response:
+        RATE_LIMITER.observe_headers(provider, api_key, response.headers)
         if response.status_code != 200:
-            return "Error", f"OpenRouter API error: {response.status_code} - {response.text}"
-        
-        result = response.json()
-        return _parse_response(result["choices"][0]["message"]["content"], query)
+            raise RuntimeError(f"{response.status_code} - {response.text}")
+        for line in response.iter_lines(decode_unicode=True):
+            if not line or not line.startswith("data:"):
+                continue
+            payload = line[len("data:"):].strip()
+            if payload == "[DONE]":
+                break
+            event = json.loads(payload)
+            if event.get("usage"):
+                usage["usage"] = event["usage"]
+            choices = event.get("choices") or []
+            if choices:
+                if choices[0].get("finish_reason"):
+                    usage["finish_reason"] = choices[0]["finish_reason"]
+                yield (choices[0].get("delta") or {}).get("content") or ""
+
+# JSON extraction - one forward bracket scan (one regex hop per structural
+# character, escape-aware) finds the balanced objects, and the C decoder only
+# runs on those, so every byte is scanned once however hostile the output
+_JSON_DECODER = json.JSONDecoder()
+_JSON_STRUCTURAL = re.compile(r'[{}\[\]"]')
+_JSON_STRING_REST = re.compile(r'[^"\\]*(?:\\.[^"\\]*)*"', re.DOTALL)
+_JSON_OBJECT_START = re.compile(r'\{\s*["}]')
+_JSON_CLOSERS = {"{": "}", "[": "]"}
+# A failed decode costs O(offset) (JSONDecodeError counts the lines before
+# it), so output with more bad candidates than this gets the text fallback
+_JSON_MAX_DECODE_FAILURES = 32
+
+# Cleanups for output cut off mid-object, tried in order until it parses
+_TRUNCATION_CLEANUPS = [
+    re.compile(r'\s*,\s*$'),                                   # trailing comma
+    re.compile(r'(?<=[:\[,])\s*(?:-|t|tr|tru|f|fa|fal|fals|n|nu|nul)$'),  # partial literal
+    re.compile(r'\s*:\s*$'),                                   # key with no value
+    re.compile(r'(?<=[{,])\s*"[^"\\]*(?:\\.[^"\\]*)*"\s*$'),  # dangling key
+    re.compile(r'\s*,\s*$'),
+]
+
+def extract_json_object(text):
+    """Find the first top-level JSON object in model output
+
+    Each balanced object is decoded in place, so parsing stops at the end of
+    the object instead of at the last brace in the text, and stray braces in
+    prose or code fences cannot widen the match the way a greedy regex does.
+    Output cut off mid-object is closed and repaired.
+    Returns (parsed_object, repaired), or (None, False) if nothing parses.
+    """
+    if not text:
+        return None, False
     
-    except Exception as e:
-        return "Error", f"OpenRouter API error: {str(e)}"
+    fence = text.find("```json")
+    origins = [fence, 0] if fence > 0 else [0]
+    scanner = _JsonObjectScanner(text)
+    for origin in origins:
+        parsed, repaired = scanner.scan(origin)
+        if parsed is not None:
+            return parsed, repaired
+    return None, False
+
+class _JsonObjectScanner:
+    """One forward scan of model output for an object that decodes
+
+    Each top-level "{" is decoded in place first, which settles well-formed
+    output without scanning it. Otherwise the scan records the objects that
+    close inside it, to be decoded in turn, and a mismatched closer discards
+    everything open, since no object containing it can be valid.
+    """
+
+    def __init__(self, text):
+        self.text = text
+        self.failures_left = _JSON_MAX_DECODE_FAILURES
+
+    def scan(self, pos):
+        """(parsed_object, repaired) for the first object from pos, or (None, False)"""
+        text = self.text
+        stack = []  # (bracket, position) of each open bracket
+        spans = []  # (start, end) of the objects closed inside the open one
+        failed_at = None
+        while True:
+            if not stack:
+                # Between objects only an opening brace matters; quotes in prose are not strings
+                pos = text.find("{", pos)
+                if pos == -1:
+                    return None, False
+                parsed, failed_at = self._decode(pos)
+                if parsed is not None:
+                    return parsed, False
+                stack.append(("{", pos))
+                pos += 1
+                continue
+            match = _JSON_STRUCTURAL.search(text, pos)
+            if not match:
+                return self._close_truncated(stack, spans, False, failed_at)
+            char = match.group()
+            pos = match.end()
+            if char == '"':
+                string_end = _JSON_STRING_REST.match(text, pos)
+                if not string_end:
+                    return self._close_truncated(stack, spans, True, failed_at)
+                pos = string_end.end()
+            elif char in _JSON_CLOSERS:
+                stack.append((char, match.start()))
+            elif _JSON_CLOSERS[stack[-1][0]] != char:
+                parsed = self._decode_spans(spans, failed_at)
+                if parsed is not None:
+                    return parsed, False
+                stack, spans = [], []
+            else:
+                opener, start = stack.pop()
+                if opener == "{" and stack:
+                    spans.append((start, pos))
+                if not stack:
+                    parsed = self._decode_spans(spans, failed_at)
+                    if parsed is not None:
+                        return parsed, False
+                    spans = []
+
+    def _decode(self, start):
+        """(object, None) if the text at start decodes, else (None, where it failed - None if unknown)"""
+        if not _JSON_OBJECT_START.match(self.text, start):
+            return None, start + 1
+        if self.failures_left <= 0:
+            return None, None
+        try:
+            return _JSON_DECODER.raw_decode(self.text, start)[0], None
+        except json.JSONDecodeError as e:
+            self.failures_left -= 1
+            return None, e.pos
+        except RecursionError:
+            self.failures_left -= 1
+            return None, None
+
+    def _decode_spans(self, spans, failed_at):
+        """The first balanced (start, end) span, in text order, that decodes
+
+        failed_at is where decoding the enclosing object failed. A span
+        containing the point where an enclosing one failed fails the same
+        way, so it is skipped rather than decoded again.
+        """
+        failures = [(math.inf, failed_at)]  # (end, error position) of failed enclosing spans; None fails all inside
+        for start, end in sorted(spans):
+            while failures[-1][0] <= start:
+                failures.pop()
+            if failures[-1][1] is None or start < failures[-1][1] < end:
+                continue
+            parsed, error_at = self._decode(start)
+            if parsed is not None:
+                return parsed
+            failures.append((end, error_at))
+        return None
+
+    def _close_truncated(self, stack, spans, in_string, failed_at):
+        """Text ran out inside an object: repair the outermost one, else use an object that did close"""
+        repaired = _repair_truncated_json(self.text[stack[0][1]:], [opener for opener, _ in stack], in_string)
+        if repaired is not None:
+            return repaired, True
+        parsed = self._decode_spans(spans, failed_at)
+        return (parsed, False) if parsed is not None else (None, False)
+
+def _repair_truncated_json(fragment, stack, in_string):
+    """Close an object that was cut off mid-stream; returns the parsed dict or None"""
+    if in_string:
+        # Drop a dangling escape, then terminate the string
+        trailing_backslashes = len(fragment) - len(fragment.rstrip("\\"))
+        if trailing_backslashes % 2:
+            fragment = fragment[:-1]
+        fragment += '"'
+    
+    closers = "".join(_JSON_CLOSERS[opener] for opener in reversed(stack))
+    # Cleanups only ever touch the last few tokens
+    head, tail = fragment[:-256], fragment[-256:].rstrip()
+    for cleanup in [None] + _TRUNCATION_CLEANUPS:
+        if cleanup is not None:
+            cleaned = cleanup.sub("", tail)
+            if cleaned == tail:
+                continue
+            tail = cleaned
+        try:
+            parsed = json.loads(head + tail + closers)
+        except (ValueError, RecursionError):
+            continue
+        return parsed if isinstance(parsed, dict) else None
+    return None
 
 def _parse_response(response_content, original_query):
     """Parse the AI response and extract analysis data"""
+    note_upstream_text(response_content)
+    with metrics_stage("parse"):
+        return _parse_response_content(response_content, original_query)
+
+def _parse_response_content(response_content, original_query):
+    """Extract analysis data from the raw response text"""
     try:
-        print(f"DEBUG: Parsing response, length: {len(response_content)}")
-        print(f"DEBUG: Response content (first 200 chars): {response_content[:200]}")
+        log_sampled(logger, "Parsing response, length %d: %.200s", len(response_content), response_content)
         
-        # Clean up the response to extract JSON
-        json_match = re.search(r'\{.*\}', response_content, re.DOTALL)
-        if json_match:
-            json_str = json_match.group(0)
-            print(f"DEBUG: Found JSON, length: {len(json_str)}")
-            parsed_response = json.loads(json_str)
-            
-            # Extract comprehensive analysis data with validation
-            clarity = parsed_response.get("clarity_score", 5)
-            context = parsed_response.get("context_score", 5)
-            structure = parsed_response.get("structure_score", 5)
-            role = parsed_response.get("role_score", 5)
-            constraints = parsed_response.get("constraints_score", 3)
-            advanced = parsed_response.get("advanced_score", 2)
-            
-            # Validate math and fix if needed
-            calculated_total = clarity + context + structure + role + constraints + advanced
-            reported_total = parsed_response.get("score", calculated_total)
+        # Find the first complete (or repairable) top-level JSON object
+        parsed_response, repaired = extract_json_object(response_content)
+        if parsed_response is not None:
+            if repaired:
+                logger.debug("Repaired truncated JSON response")
             
-            # Use calculated total if there's a math error
-            if abs(calculated_total - reported_total) > 2:
-                final_score = calculated_total
-            else:
-                final_score = reported_total
-            
-            result = {
-                "overall_score": final_score,
-                "detailed_scores": {
-                    "clarity": clarity,
-                    "context": context,
-                    "structure": structure,
-                    "role": role,
-                    "constraints": constraints,
-                    "advanced": advanced
-                },
-                "strengths": parsed_response.get("strengths", ["Basic functionality"]),
-                "weaknesses": parsed_response.get("weaknesses", ["Needs improvement"]),
-                "improvements": parsed_response.get("improvements", ["Add more detail"]),
-                "new_prompt": _validate_enhanced_prompt(parsed_response.get("new_prompt", ""), original_query),
-                "reasoning": parsed_response.get("reasoning", "Analysis completed"),
-                "math_corrected": abs(calculated_total - reported_total) > 2
-            }
+            result = _analysis_result(parsed_response, original_query)
+            if repaired:
+                result["truncation_repaired"] = True
             
             return result["overall_score"], result
+        elif "{" in response_content:
+            # JSON-like but unrecoverable - salvage what the regexes can find
+            logger.info("JSON found but not parseable, using partial fallback")
+            return _parse_partial_response(response_content, original_query)
         else:
             # Fallback if JSON parsing fails
-            print("DEBUG: No JSON found in response, using fallback")
-            fallback_result = {
-                "overall_score": 25,
-                "detailed_scores": {"clarity": 8, "context": 4, "structure": 5, "role": 3, "constraints": 3, "advanced": 2},
-                "strengths": ["Basic request provided"],
-                "weaknesses": ["Analysis parsing failed", "Very basic prompt structure"],
-                "improvements": ["Add specific context", "Define target audience", "Specify requirements"],
-                "new_prompt": _create_basic_enhancement(original_query),
-                "reasoning": "JSON parsing failed, using fallback analysis"
-            }
-            return 25, fallback_result
+            logger.info("No JSON found in response, using fallback")
+            with metrics_stage("fallback"):
+                return _heuristic_fallback(original_query)
             
     except json.JSONDecodeError as e:
-        # If parsing fails, try to extract score and prompt manually
-        print(f"DEBUG: JSON decode error: {str(e)}")
-        score_match = re.search(r'"score":\s*(\d+)', response_content)
-        prompt_match = re.search(r'"new_prompt":\s*"([^"]*)"', response_content)
-        
-        score = int(score_match.group(1)) if score_match else 75
-        new_prompt = prompt_match.group(1) if prompt_match else f"Enhanced version: {original_query}"
-        
-        fallback_result = {
-            "overall_score": score if score < 50 else 25,
-            "detailed_scores": {"clarity": 6, "context": 3, "structure": 4, "role": 3, "constraints": 2, "advanced": 2},
-            "strengths": ["Basic request provided"],
-            "weaknesses": ["Analysis parsing issues", "Very basic prompt"],
-            "improvements": ["Add specific context", "Define requirements", "Specify format"],
-            "new_prompt": _validate_enhanced_prompt(new_prompt, original_query),
-            "reasoning": "Partial parsing successful, scores adjusted for basic prompt"
-        }
-        
-        return score, fallback_result
+        logger.info("JSON decode error: %s", e)
+        return _parse_partial_response(response_content, original_query)
+
+def _analysis_result(parsed_response, original_query):
+    """Build the analysis result from a decoded reply, checking its math"""
+    # Extract comprehensive analysis data with validation
+    clarity = parsed_response.get("clarity_score", 5)
+    context = parsed_response.get("context_score", 5)
+    structure = parsed_response.get("structure_score", 5)
+    role = parsed_response.get("role_score", 5)
+    constraints = parsed_response.get("constraints_score", 3)
+    advanced = parsed_response.get("advanced_score", 2)
+    
+    # Validate math and fix if needed
+    calculated_total = clarity + context + structure + role + constraints + advanced
+    reported_total = parsed_response.get("score", calculated_total)
+    
+    # Use calculated total if there's a math error
+    if abs(calculated_total - reported_total) > 2:
+        final_score = calculated_total
+    else:
+        final_score = reported_total
+    
+    return {
+        "overall_score": final_score,
+        "detailed_scores": {
+            "clarity": clarity,
+            "context": context,
+            "structure": structure,
+            "role": role,
+            "constraints": constraints,
+            "advanced": advanced
+        },
+        "strengths": parsed_response.get("strengths") or ["Basic functionality"],
+        "weaknesses": parsed_response.get("weaknesses") or ["Needs improvement"],
+        "improvements": parsed_response.get("improvements") or ["Add more detail"],
+        "new_prompt": _validate_enhanced_prompt(parsed_response.get("new_prompt", ""), original_query),
+        "reasoning": parsed_response.get("reasoning", "Analysis completed"),
+        "math_corrected": abs(calculated_total - reported_total) > 2
+    }
+
+def _parse_structured_response(response_content, original_query):
+    """Validate a schema-constrained reply into the analysis result
+
+    A reply that fails validation (cut off, or a provider that ignored the
+    schema) is parsed as free text instead.
+    """
+    note_upstream_text(response_content)
+    with metrics_stage("parse"):
+        try:
+            analysis = StructuredAnalysis.from_json(response_content)
+        except SchemaError as e:
+            record_structured(False)
+            logger.info("Structured reply failed validation, parsing as text: %s", e)
+            return _parse_response_content(response_content or "", original_query)
+        record_structured(True)
+        result = _analysis_result(analysis.as_dict(), original_query)
+        result["structured"] = True
+        return result["overall_score"], result
+
+def anthropic_reply_text(message):
+    """Text of an Anthropic reply; a tool call's input comes back as JSON"""
+    for block in message.content:
+        if getattr(block, "type", None) == "tool_use":
+            return json.dumps(block.input)
+    return "".join(getattr(block, "text", "") for block in message.content)
+
+def _parse_partial_response(response_content, original_query):
+    """Extract score and prompt manually when no JSON object can be parsed"""
+    with metrics_stage("fallback"):
+        return _build_partial_result(response_content, original_query)
+
+def _build_partial_result(response_content, original_query):
+    """Score locally, keeping the model's rewrite if a targeted regex can salvage it"""
+    prompt_match = re.search(r'"new_prompt":\s*"((?:[^"\\]|\\.)*)"', response_content)
+    score, fallback_result = _heuristic_fallback(original_query)
+    if prompt_match:
+        try:
+            new_prompt = json.loads(f'"{prompt_match.group(1)}"')
+        except ValueError:
+            new_prompt = prompt_match.group(1)
+        fallback_result["new_prompt"] = _validate_enhanced_prompt(new_prompt, original_query)
+    return score, fallback_result
+
+def _heuristic_fallback(original_query):
+    """The local heuristic analysis of the prompt, for a reply that could not be parsed"""
+    score, analysis_result = analyze_prompt(original_query)
+    analysis_result = dict(analysis_result, parse_fallback=True,
+                           reasoning="The model's reply could not be parsed. " + analysis_result["reasoning"])
+    return score, analysis_result
 
 def get_provider_models(provider):
     """Get available models for a provider"""
@@ -469,21 +1810,57 @@ def get_supported_providers():
     """Get list of supported providers"""
     return list(PROVIDER_CONFIGS.keys())
 
-def _get_quick_analysis_prompt(query):
-    """Quick analysis - fast and focused"""
-    return f"""# ROLE: Senior Prompt Engineer
+def provider_requires_api_key(provider):
+    """Whether calls to provider need the caller's API key (unknown providers do)"""
+    return PROVIDER_CONFIGS.get(str(provider or "").lower().strip(), {}).get("requires_api_key", True)
+
+# Static instructions for each analysis style. They go first, as the system
+# message, and never contain the query, so every request with the same
+# style shares one byte-identical prefix that providers can cache.
+COMPREHENSIVE_SYSTEM_PROMPT = """You are an expert prompt engineer. Analyze the prompt in the user message and provide a comprehensive evaluation with an enhanced version.
+
+Evaluate the prompt on these criteria (1-100 total points):
+- Clarity & Precision (25 points): How clear and specific are the instructions?
+- Context & Background (20 points): Does it provide sufficient context and background?
+- Structure & Organization (20 points): Is it well-organized with clear structure?
+- Role & Persona (15 points): Does it define a clear role or persona?
+- Constraints & Guidelines (10 points): Are there clear constraints and guidelines?
+- Advanced Techniques (10 points): Does it use advanced prompting techniques?
+
+Create an enhanced version that:
+1. Defines a clear expert role
+2. Provides specific, detailed instructions
+3. Includes context and background
+4. Has clear structure and formatting
+5. Specifies desired output format
+6. Includes relevant constraints
+
+RESPOND WITH ONLY THIS JSON FORMAT:
+{
+    "score": [total score from 1-100],
+    "clarity_score": [1-25],
+    "context_score": [1-20], 
+    "structure_score": [1-20],
+    "role_score": [1-15],
+    "constraints_score": [1-10],
+    "advanced_score": [1-10],
+    "strengths": ["strength1", "strength2", "strength3"],
+    "weaknesses": ["weakness1", "weakness2", "weakness3"],
+    "improvements": ["improvement1", "improvement2", "improvement3"],
+    "new_prompt": "Complete enhanced version of the prompt with professional structure and specific instructions",
+    "reasoning": "Brief explanation of the analysis and enhancements made"
+}
+
+Make sure the total score equals the sum of individual scores. The enhanced prompt should be significantly more detailed and professional than the original."""
+
+QUICK_SYSTEM_PROMPT = """# ROLE: Senior Prompt Engineer
 
 You are a senior prompt engineer focused on rapid assessment and immediate improvements.
 
 # TASK: Quick Prompt Analysis
 
-## INPUT PROMPT:
-```
-{query}
-```
-
 ## QUICK EVALUATION:
-Analyze this prompt quickly and provide immediate feedback focusing on the most critical issues.
+Analyze the prompt in the user message quickly and provide immediate feedback focusing on the most critical issues.
 
 ### SCORING CRITERIA (Total: 100 points):
 1. **Clarity** (30 points) - Is it clear what's being asked?
@@ -495,7 +1872,7 @@ Analyze this prompt quickly and provide immediate feedback focusing on the most
 ## OUTPUT FORMAT:
 Return ONLY this JSON (no other text):
 
-{{
+{
     "score": [sum of all scores below],
     "clarity_score": [1-25],
     "context_score": [1-20], 
@@ -508,16 +1885,14 @@ Return ONLY this JSON (no other text):
     "improvements": ["quick fix 1", "quick fix 2", "quick fix 3"],
     "new_prompt": "[completely rewritten and enhanced version - must be significantly different from original]",
     "reasoning": "Brief 1-sentence explanation of the main issue and improvement"
-}}
+}
 
 SCORING RULES:
 - Total = clarity_score + context_score + structure_score + role_score + constraints_score + advanced_score
 - Basic prompts typically score 15-35 total
 - Focus on the most impactful improvements that can be made quickly."""
 
-def _get_detailed_analysis_prompt(query):
-    """Detailed analysis - thorough and comprehensive"""
-    return f"""# ROLE: Master Prompt Engineering Consultant & AI Optimization Expert
+DETAILED_SYSTEM_PROMPT = """# ROLE: Master Prompt Engineering Consultant & AI Optimization Expert
 
 You are a world-renowned prompt engineering consultant with 10+ years of experience optimizing AI interactions across industries. Your expertise includes:
 - Advanced LLM behavioral psychology and cognitive architectures
@@ -529,11 +1904,6 @@ You are a world-renowned prompt engineering consultant with 10+ years of experie
 
 # TASK: Deep Comprehensive Prompt Analysis & Strategic Enhancement
 
-## INPUT PROMPT FOR DETAILED ANALYSIS:
-```
-{query}
-```
-
 ## COMPREHENSIVE EVALUATION FRAMEWORK:
 
 ### PRIMARY ASSESSMENT DIMENSIONS (100 points total):
@@ -600,7 +1970,7 @@ You are a world-renowned prompt engineering consultant with 10+ years of experie
 ## REQUIRED DETAILED OUTPUT:
 Provide comprehensive analysis in this exact JSON format:
 
-{{
+{
     "score": [integer 1-100],
     "clarity_score": [integer 1-25],
     "context_score": [integer 1-20],
@@ -616,7 +1986,7 @@ Provide comprehensive analysis in this exact JSON format:
     "methodology_notes": "Advanced techniques used in the enhancement (CoT, few-shot, etc.)",
     "use_case_analysis": "Assessment of the prompt's intended use case and optimization for that specific context",
     "scalability_assessment": "Evaluation of how this prompt will perform across different AI models and use cases"
-}}
+}
 
 ## CONSTRAINTS:
 - Provide thorough, expert-level analysis
@@ -625,69 +1995,34 @@ Provide comprehensive analysis in this exact JSON format:
 - Consider enterprise-grade implementation requirements
 - Focus on maximum effectiveness and professional deployment readiness"""
 
+def _get_quick_analysis_prompt(query):
+    """Quick analysis - fast and focused"""
+    return QUICK_SYSTEM_PROMPT, f"## INPUT PROMPT:\n```\n{query}\n```"
+
+def _get_detailed_analysis_prompt(query):
+    """Detailed analysis - thorough and comprehensive"""
+    return DETAILED_SYSTEM_PROMPT, f"## INPUT PROMPT FOR DETAILED ANALYSIS:\n```\n{query}\n```"
+
 def _validate_enhanced_prompt(enhanced_prompt, original_query):
     """Validate that the enhanced prompt is actually enhanced, not just the original"""
     if not enhanced_prompt or enhanced_prompt.strip() == "":
-        # Create a basic enhanced version if none provided
-        return _create_basic_enhancement(original_query)
+        # Use the local rewrite if none provided
+        return _local_enhancement(original_query)
+    
+    if analyzing_section.get():
+        # A section's rewrite stands in for the section alone - it need not outgrow it
+        return enhanced_prompt
     
     # Check if enhanced prompt is too similar to original (similarity check)
     original_clean = original_query.lower().strip()
     enhanced_clean = enhanced_prompt.lower().strip()
     
-    # If enhanced prompt is identical or too similar, create a better one
+    # If enhanced prompt is identical or too similar, use the local rewrite
     if enhanced_clean == original_clean or len(enhanced_prompt) < len(original_query) * 2:
-        return _create_basic_enhancement(original_query)
+        return _local_enhancement(original_query)
     
     return enhanced_prompt
 
-def _create_basic_enhancement(original_query):
-    """Create a basic enhanced version when AI fails to provide one"""
-    original_clean = original_query.strip().lower()
-    
-    # Handle common patterns
-    if "write" in original_clean and "blog" in original_clean:
-        if "virat" in original_clean:
-            return """You are a professional sports journalist. Write a comprehensive 1000-word blog post about Virat Kohli for cricket enthusiasts. 
-
-Structure your post with:
-1. Introduction to Virat's significance in cricket
-2. Career highlights and achievements
-3. Playing style and techniques
-4. Leadership journey as captain
-5. Impact on Indian cricket
-6. Recent performances and statistics
-7. Conclusion about his legacy
-
-Requirements:
-- Use engaging, informative tone
-- Include specific statistics and examples
-- Target audience: cricket fans aged 20-50
-- Add subheadings for better readability
-- End with a thought-provoking conclusion"""
-    
-    # Generic enhancement for other prompts
-    elif "write" in original_clean:
-        return f"""You are a professional content writer. Create a well-structured, comprehensive piece based on: "{original_query}"
-
-Requirements:
-- Define your target audience
-- Include specific examples and details
-- Use clear structure with headings
-- Specify word count (800-1200 words)
-- Choose appropriate tone and style
-- Add relevant context and background
-- Include actionable insights or conclusions"""
-    
-    # Fallback enhancement
-    return f"""Enhanced version of: "{original_query}"
-
-You are an expert in the relevant field. Please provide a detailed, well-structured response that includes:
-- Clear context and background
-- Specific examples and evidence
-- Target audience consideration
-- Appropriate length and format
-- Professional tone and style
-- Actionable insights or recommendations
-
-Structure your response with clear sections and provide comprehensive coverage of the topic."""
\ No newline at end of file
+def _local_enhancement(original_query):
+    """The heuristic engine's rewrite, for when the model does not provide a usable one"""
+    return analyze_prompt(original_query)[1]["new_prompt"]
@@ -0,0 +1,137 @@
+"""ASGI entry point for the async serving mode
+
+    uvicorn asgi:app --host 0.0.0.0 --port 5000     (or SERVER_MODE=async python main.py)
+
+POST /api/prompt/analyze and /api/prompt/analyze/batch run natively on the
+event loop through async_util, so one process keeps hundreds of upstream
+calls in flight without a thread per call. Every other route - static
+files, streaming, metrics, CORS preflights - is served by the Flask app
+through a2wsgi's thread-pooled WSGI adapter.
+"""
+import asyncio
+import json
+import logging
+import os
+
+from a2wsgi import WSGIMiddleware
+
+from batch_util import PROVIDER_POOLS
+from capture_util import TRAFFIC_CAPTURE
+from main import (
+    app as flask_app, start_background_work, _analyze_request_async, _batch_items, _batch_provider, _batch_response
+)
+
+logger = logging.getLogger(__name__)
+
+# Threads for the Flask routes; SSE streams hold one for their whole length
+WSGI_BRIDGE_THREADS = int(os.getenv("WSGI_BRIDGE_THREADS", 32))
+
+_flask = WSGIMiddleware(flask_app, workers=WSGI_BRIDGE_THREADS)
+
+# Per-provider in-flight limits for batch items, shared with the sync fan-out config
+_batch_semaphores = {}
+
+async def app(scope, receive, send):
+    """ASGI application"""
+    if scope["type"] == "lifespan":
+        await _lifespan(receive, send)
+        return
+    if scope["type"] != "http":
+        return
+
+    route = _NATIVE_ROUTES.get((scope["method"], scope["path"]))
+    if route is None:
+        await _flask(scope, receive, send)
+        return
+
+    body = await _read_body(receive)
+    try:
+        data = json.loads(body) if body else None
+    except ValueError:
+        data = None
+    headers = _header_map(scope)
+    try:
+        if not isinstance(data, dict):
+            result, status, extra = {'error': 'No JSON data provided'}, 400, {}
+        else:
+            result, status, extra = await route(data, headers.get("cache-control", ""))
+    except Exception as e:
+        logger.exception("Error in %s", scope["path"])
+        result, status, extra = {'error': f'Internal server error: {str(e)}'}, 500, {}
+    await _send_json(send, status, result, extra)
+
+async def _analyze(data, cache_control):
+    """Native POST /api/prompt/analyze - same payloads as the Flask route"""
+    use_cache = data.get('cache', True) is not False and 'no-cache' not in cache_control.lower()
+    with TRAFFIC_CAPTURE.request(data) as capture:
+        result, status, cache_status = await _analyze_request_async(data, use_cache)
+        if capture is not None:
+            capture.update(status=status, cache=cache_status)
+    extra = {}
+    if cache_status:
+        extra['X-Cache'] = cache_status
+    if result.get('retry_after'):
+        extra['Retry-After'] = str(result['retry_after'])
+    return result, status, extra
+
+async def _analyze_batch(data, cache_control):
+    """Native POST /api/prompt/analyze/batch - items run concurrently under per-provider limits"""
+    items, error = _batch_items(data, cache_control)
+    if error:
+        return error[0], error[1], {}
+
+    async def run_item(item):
+        provider = _batch_provider(item)
+        semaphore = _batch_semaphores.get(provider)
+        if semaphore is None:
+            semaphore = _batch_semaphores.setdefault(provider, asyncio.Semaphore(PROVIDER_POOLS.limit(provider)))
+        async with semaphore:
+            return await _analyze_request_async(item, use_cache=item['cache'])
+
+    outcomes = await asyncio.gather(*(run_item(item) for item in items), return_exceptions=True)
+    return _batch_response(outcomes), 200, {}
+
+_NATIVE_ROUTES = {
+    ("POST", "/api/prompt/analyze"): _analyze,
+    ("POST", "/api/prompt/analyze/batch"): _analyze_batch,
+}
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            start_background_work()
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            _flask.executor.shutdown(wait=False)
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+async def _read_body(receive):
+    chunks = []
+    while True:
+        message = await receive()
+        chunks.append(message.get("body", b""))
+        if not message.get("more_body"):
+            return b"".join(chunks)
+
+def _header_map(scope):
+    """Request headers as a lower-cased dict, repeated headers joined with commas"""
+    headers = {}
+    for name, value in scope.get("headers", []):
+        name = name.decode("latin-1").lower()
+        value = value.decode("latin-1")
+        headers[name] = f"{headers[name]},{value}" if name in headers else value
+    return headers
+
+async def _send_json(send, status, body, extra_headers):
+    payload = json.dumps(body).encode("utf-8")
+    headers = [
+        (b"content-type", b"application/json"),
+        (b"content-length", str(len(payload)).encode()),
+        # Mirrors flask_cors' default for the Flask routes
+        (b"access-control-allow-origin", b"*"),
+    ]
+    headers.extend((name.lower().encode("latin-1"), value.encode("latin-1")) for name, value in extra_headers.items())
+    await send({"type": "http.response.start", "status": status, "headers": headers})
+    await send({"type": "http.response.body", "body": payload})
@@ -0,0 +1,248 @@
+import gzip
+import hashlib
+import importlib
+import logging
+import mimetypes
+import os
+import re
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Static assets - pages are served from memory, minified and precompressed,
+# with their inline <style> and <script> blocks moved out to content-hashed
+# files that browsers may cache forever
+ASSET_ROOT = os.path.dirname(os.path.abspath(__file__))
+ASSET_PAGES = ("index.html",)
+# Other files in ASSET_ROOT that may be served as they are, e.g. "favicon.ico,robots.txt"
+ASSET_ALLOW_LIST = tuple(name.strip() for name in os.getenv("ASSET_ALLOW_LIST", "").split(",") if name.strip())
+# Rebuild when a source file changes - for editing index.html during development
+ASSET_RELOAD = os.getenv("ASSET_RELOAD", "1" if os.getenv("FLASK_ENV") == "development" else "0") == "1"
+ASSET_MINIFY = os.getenv("ASSET_MINIFY", "1") == "1"
+# Smaller bodies are not worth a Content-Encoding
+ASSET_MIN_COMPRESS_BYTES = int(os.getenv("ASSET_MIN_COMPRESS_BYTES", 512))
+ASSET_PREFIX = "/assets/"
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+# Pages keep a stable URL, so browsers revalidate them - a 304 costs a few hundred bytes
+REVALIDATE = "no-cache"
+
+COMPRESSIBLE_TYPES = ("text/", "application/javascript", "application/json", "image/svg+xml")
+
+_INLINE_STYLE = re.compile(r"<style>(.*?)</style>", re.S)
+_INLINE_SCRIPT = re.compile(r"<script>(.*?)</script>", re.S)
+_CSS_COMMENT = re.compile(r"/\*.*?\*/", re.S)
+_CSS_SPACE = re.compile(r"\s*([{};,])\s*")
+_WHITESPACE = re.compile(r"\s+")
+_PREFORMATTED = re.compile(r"<(pre|textarea)\b", re.I)
+
+def _brotli():
+    """The brotli module, if installed (pip install brotli); gzip is always available"""
+    try:
+        return importlib.import_module("brotli")
+    except ImportError:
+        return None
+
+def minify_css(css):
+    """Drop comments and insignificant whitespace"""
+    css = _WHITESPACE.sub(" ", _CSS_COMMENT.sub("", css))
+    return _CSS_SPACE.sub(r"\1", css).replace(";}", "}").strip()
+
+def minify_js(js):
+    """Conservative: trims indentation, blank lines and whole-line // comments
+
+    Lines inside a multi-line template literal are kept exactly, since
+    their whitespace is part of a string.
+    """
+    lines, in_template = [], False
+    for line in js.splitlines():
+        stripped = line.strip()
+        if in_template:
+            lines.append(line)
+        elif stripped and not stripped.startswith("//"):
+            lines.append(stripped)
+        if len(re.findall(r"(?<!\\)`", line)) % 2:
+            in_template = not in_template
+    return "\n".join(lines)
+
+def minify_html(html):
+    """Trims indentation and blank lines, leaving <pre> and <textarea> contents alone"""
+    lines, preformatted = [], False
+    for line in html.splitlines():
+        if preformatted:
+            lines.append(line)
+        elif line.strip():
+            lines.append(line.strip())
+        opened = len(_PREFORMATTED.findall(line))
+        closed = len(re.findall(r"</(pre|textarea)>", line, re.I))
+        if opened != closed:
+            preformatted = opened > closed
+    return "\n".join(lines)
+
+class Asset:
+    """One servable file: its identity bytes and precompressed variants"""
+
+    __slots__ = ("path", "content_type", "cache_control", "digest", "variants")
+
+    def __init__(self, path, body, content_type, cache_control, compress=True):
+        self.path = path
+        self.content_type = content_type
+        self.cache_control = cache_control
+        self.digest = hashlib.sha256(body).hexdigest()[:16]
+        self.variants = {"identity": body}
+        if compress and len(body) >= ASSET_MIN_COMPRESS_BYTES and content_type.startswith(COMPRESSIBLE_TYPES):
+            self.variants["gzip"] = gzip.compress(body, compresslevel=9, mtime=0)
+            brotli = _brotli()
+            if brotli is not None:
+                self.variants["br"] = brotli.compress(body, quality=11)
+
+    def etag(self, encoding):
+        return f'"{self.digest}"' if encoding == "identity" else f'"{self.digest}-{encoding}"'
+
+def _accepted_encodings(accept_encoding):
+    """Encodings the client accepts, from an Accept-Encoding header (q=0 excluded)"""
+    accepted = set()
+    for part in (accept_encoding or "").lower().split(","):
+        name, _, params = part.strip().partition(";")
+        quality = params.strip()
+        if quality.startswith("q=") and quality[2:].strip() in ("0", "0.0", "0.00", "0.000"):
+            continue
+        if name:
+            accepted.add(name.strip())
+    return accepted
+
+def _etag_matches(if_none_match, etag):
+    """Whether an If-None-Match header covers etag (weak comparison, as for GET)"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+    return etag in tags
+
+class AssetPipeline:
+    """Builds the served assets once, in memory, and answers requests for them
+
+    Each page is minified and its inline <style>/<script> blocks become
+    /assets/<page>.<hash>.css and .js, so the page itself shrinks to a
+    small revalidated document while the bulk is cached immutably.
+    """
+
+    def __init__(self, root=ASSET_ROOT, pages=ASSET_PAGES, allow_list=ASSET_ALLOW_LIST, reload=ASSET_RELOAD):
+        self.root = root
+        self.pages = tuple(pages)
+        self.allow_list = tuple(allow_list)
+        self.reload = reload
+        self._assets = None
+        self._mtimes = None
+        self._lock = threading.Lock()
+
+    def build(self):
+        """(Re)build every asset from the source files
+
+        A source file that cannot be read is logged and left unserved, and a
+        page that fails to build is served as it is - unminified and
+        uncompressed - so one bad file never takes down the others.
+        """
+        assets = {}
+        for page in self.pages:
+            try:
+                source = self._read(page)
+            except OSError as e:
+                logger.error("Static page %s cannot be read, not serving it: %s", page, e)
+                continue
+            try:
+                body, page_assets = self._build_page(page, source)
+                compress = True
+            except Exception:
+                logger.exception("Static page %s failed to build, serving it unprocessed", page)
+                body, page_assets, compress = source, {}, False
+            assets.update(page_assets)
+            for path in ("/" + page, "/") if page == "index.html" else ("/" + page,):
+                assets[path] = Asset(path, body, "text/html; charset=utf-8", REVALIDATE, compress)
+
+        for name in self.allow_list:
+            try:
+                body = self._read(name)
+            except OSError as e:
+                logger.warning("Allow-listed file %s cannot be read, not serving it: %s", name, e)
+                continue
+            content_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+            if content_type.startswith("text/"):
+                content_type += "; charset=utf-8"
+            path = "/" + name
+            assets[path] = Asset(path, body, content_type, REVALIDATE)
+
+        self._mtimes = self._source_mtimes()
+        self._assets = assets
+        logger.info("Built %d static assets", len(assets))
+        return assets
+
+    def get(self, path):
+        """The Asset served at path, or None - nothing outside the built set is ever served"""
+        assets = self._assets
+        if assets is None or (self.reload and self._source_mtimes() != self._mtimes):
+            with self._lock:
+                if self._assets is None or (self.reload and self._source_mtimes() != self._mtimes):
+                    self.build()
+                assets = self._assets
+        return assets.get(path)
+
+    def respond(self, path, accept_encoding=None, if_none_match=None):
+        """(body, status, headers) for a GET of path, or None when it is not an asset"""
+        asset = self.get(path)
+        if asset is None:
+            return None
+        accepted = _accepted_encodings(accept_encoding)
+        encoding = next((name for name in ("br", "gzip") if name in asset.variants and name in accepted), "identity")
+        headers = {
+            "Cache-Control": asset.cache_control,
+            "ETag": asset.etag(encoding),
+            "Content-Type": asset.content_type
+        }
+        if len(asset.variants) > 1:
+            headers["Vary"] = "Accept-Encoding"
+        if _etag_matches(if_none_match, asset.etag(encoding)):
+            return b"", 304, headers
+        if encoding != "identity":
+            headers["Content-Encoding"] = encoding
+        return asset.variants[encoding], 200, headers
+
+    def _build_page(self, page, source):
+        """(page body, {path: Asset}) for page, with its inline blocks extracted and everything minified"""
+        assets = {}
+        html = source.decode("utf-8")
+        name = os.path.splitext(page)[0]
+
+        def extract(match, kind):
+            body = match.group(1)
+            if ASSET_MINIFY:
+                body = minify_css(body) if kind == "css" else minify_js(body)
+            body = body.encode("utf-8")
+            path = f"{ASSET_PREFIX}{name}.{hashlib.sha256(body).hexdigest()[:12]}.{kind}"
+            content_type = "text/css; charset=utf-8" if kind == "css" else "application/javascript; charset=utf-8"
+            assets[path] = Asset(path, body, content_type, IMMUTABLE)
+            if kind == "css":
+                return f'<link rel="stylesheet" href="{path}">'
+            return f'<script src="{path}"></script>'
+
+        html = _INLINE_STYLE.sub(lambda match: extract(match, "css"), html)
+        html = _INLINE_SCRIPT.sub(lambda match: extract(match, "js"), html)
+        if ASSET_MINIFY:
+            html = minify_html(html)
+        return html.encode("utf-8"), assets
+
+    def _read(self, name):
+        with open(os.path.join(self.root, name), "rb") as f:
+            return f.read()
+
+    def _source_mtimes(self):
+        mtimes = []
+        for name in self.pages + self.allow_list:
+            try:
+                mtimes.append(os.stat(os.path.join(self.root, name)).st_mtime_ns)
+            except OSError:
+                mtimes.append(None)
+        return mtimes
+
+STATIC_ASSETS = AssetPipeline()
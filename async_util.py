@@ -0,0 +1,472 @@
+import asyncio
+import itertools
+import logging
+import os
+import ssl
+import threading
+import time
+import weakref
+
+import certifi
+import httpx
+
+# The provider-independent steps of an analysis are shared with the sync path
+from app_util import (
+    analyze_with_local, analyzing_section, anthropic_reply_text, circuit_open_result, continuation_messages,
+    error_headers, estimate_tokens, fallback_chain, finish_analysis, get_analysis_messages, get_anthropic_system,
+    get_chat_messages, get_hedge_delay, get_sdk_class, hedge_served_by, is_usable_result, join_continuation,
+    merge_fallback_leg, metric_labels, normalize_analysis_args, openai_cache_params, provider_requires_api_key,
+    rate_limited_result, refuses_structured, splits_long_prompt, sum_usage, tag_hedge, truncation_recovery,
+    ClientRegistry, BREAKER_ENABLED, BREAKERS, HTTP_PROVIDER_ENDPOINTS, HTTP_TIMEOUT, PROVIDER_BASE_URLS, RATE_LIMIT_ENABLED,
+    RATE_LIMITER, TRUNCATED_FINISH_REASONS
+)
+from capture_util import capture_upstream, note_upstream_result
+from long_prompt_util import chunk_prompt, merge_section_analyses, section_query
+from metrics_util import log_sampled, metrics_labels, metrics_stage, observe_stage, record_analysis, record_long_prompt
+from resilience_util import is_provider_failure
+from schema_util import structured_request_params
+from token_util import output_token_budget
+
+logger = logging.getLogger(__name__)
+# httpx logs every request at INFO
+logging.getLogger("httpx").setLevel(logging.WARNING)
+
+# Connections, not threads, bound concurrency. httpcore scans its whole pool
+# on every request/response, which goes quadratic with hundreds of in-flight
+# calls, so the pool is split over ASYNC_HTTP_SHARDS clients used round-robin.
+ASYNC_HTTP_POOL_SIZE = int(os.getenv("ASYNC_HTTP_POOL_SIZE", 512))
+ASYNC_HTTP_SHARDS = max(1, int(os.getenv("ASYNC_HTTP_SHARDS", 16)))
+
+# Async clients hold connection pools bound to the loop that created them
+_loop_state = weakref.WeakKeyDictionary()
+_loop_state_lock = threading.Lock()
+
+def _get_loop_state():
+    """SDK client registry and sharded HTTP clients for the running event loop"""
+    loop = asyncio.get_running_loop()
+    state = _loop_state.get(loop)
+    if state is None:
+        with _loop_state_lock:
+            state = _loop_state.get(loop)
+            if state is None:
+                # Never closed on eviction: the SDK clients share the loop's HTTP shards
+                state = _loop_state[loop] = {"registry": ClientRegistry(close_grace=None), "http": [],
+                                             "next": itertools.count()}
+    return state
+
+def _get_async_http_client(state=None):
+    """Next keep-alive httpx client for this loop, round-robin over the shards"""
+    state = state or _get_loop_state()
+    if not state["http"]:
+        per_shard = max(1, ASYNC_HTTP_POOL_SIZE // ASYNC_HTTP_SHARDS)
+        # Loading the CA bundle is the slow part of building a client - do it once
+        ssl_context = ssl.create_default_context(cafile=certifi.where())
+        state["http"] = [
+            httpx.AsyncClient(timeout=HTTP_TIMEOUT, verify=ssl_context,
+                              limits=httpx.Limits(max_connections=per_shard, max_keepalive_connections=per_shard))
+            for _ in range(ASYNC_HTTP_SHARDS)
+        ]
+    return state["http"][next(state["next"]) % ASYNC_HTTP_SHARDS]
+
+def _get_async_sdk_client(provider, api_key, base_url=None):
+    """Get a shared async SDK client for groq, openai or anthropic on this loop
+
+    Each client rides on one of the loop's HTTP shards, so there is one
+    cached SDK client per key and shard.
+    """
+    sdk_class = get_sdk_class(provider, asynchronous=True)
+    state = _get_loop_state()
+    http_client = _get_async_http_client(state)
+    kwargs = {"api_key": api_key, "http_client": http_client}
+    base_url = base_url or PROVIDER_BASE_URLS.get(provider)
+    if base_url:
+        kwargs["base_url"] = base_url
+    shard = f"{base_url or ''}#{state['http'].index(http_client)}"
+    return state["registry"].get(provider, api_key, lambda: sdk_class(**kwargs), shard)
+
+async def async_prompt_analysis(query, api_key, temp, max_token, provider="groq", model=None, style="comprehensive",
+                                hedge=None, fallback=True):
+    """asyncio counterpart of prompt_analysis, with the same arguments and results
+
+    Validation, circuit breakers, rate limiting, fallback and hedging behave
+    as in the sync path; a losing hedge leg is cancelled rather than left to
+    finish.
+    """
+    if splits_long_prompt(query, provider):
+        return await _async_long_prompt_analysis(query, api_key, temp, provider, model, style, hedge, fallback)
+
+    if hedge:
+        return await _async_hedged_analysis(query, api_key, temp, max_token, provider, model, style, hedge)
+
+    try:
+        legs = fallback_chain(provider, model, api_key) if fallback else [(provider, model, api_key)]
+        result = None
+        for position, (leg_provider, leg_model, leg_key) in enumerate(legs):
+            leg_result = await _async_analyze_once(query, leg_key, temp, max_token, leg_provider, leg_model, style)
+            result, done = merge_fallback_leg(result, leg_result, position, leg_provider, leg_model)
+            if done:
+                break
+        return result
+
+    except Exception as e:
+        return "Error", f"Error in prompt analysis: {str(e)}"
+
+async def _async_long_prompt_analysis(query, api_key, temp, provider, model, style, hedge, fallback):
+    """app_util._long_prompt_analysis with the sections analyzed as concurrent tasks"""
+    try:
+        chunks = chunk_prompt(query, provider)
+        results = await asyncio.gather(*(
+            _async_analyze_section(section_query(chunks, index), api_key, temp, provider, model, style, hedge, fallback)
+            for index in range(len(chunks))
+        ), return_exceptions=True)
+        result = merge_section_analyses(chunks, results, provider)
+        record_long_prompt(result[1])
+        return result
+
+    except Exception as e:
+        return "Error", f"Error in prompt analysis: {str(e)}"
+
+async def _async_analyze_section(query, api_key, temp, provider, model, style, hedge, fallback):
+    """One section of a long prompt; a task of its own, so the flag stays in its context"""
+    analyzing_section.set(True)
+    return await async_prompt_analysis(query, api_key, temp, output_token_budget(query, style, provider, model),
+                                       provider, model, style, hedge=hedge, fallback=fallback)
+
+async def _async_analyze_once(query, api_key, temp, max_token, provider, model, style):
+    """One provider call, guarded by that provider/model's circuit breaker"""
+    started = time.perf_counter()
+    error, provider, model, temp, max_token = normalize_analysis_args(query, api_key, temp, max_token, provider, model)
+    provider_label, model_label = metric_labels(provider, model)
+    observe_stage("validation", time.perf_counter() - started, provider_label, model_label)
+    breaker = BREAKERS.get(provider_label, model_label) if BREAKER_ENABLED and not error else None
+    if error:
+        result = ("Error", error)
+    elif breaker and not breaker.allow():
+        result = circuit_open_result(provider, breaker, provider_label, model_label)
+    else:
+        try:
+            result = await _async_rate_limit(provider, api_key, query, style, max_token, provider_label, model_label)
+            if result:
+                if breaker:
+                    breaker.release()
+            else:
+                called = time.perf_counter()
+                with metrics_labels(provider_label, model_label), capture_upstream(provider, model):
+                    result = await _async_route_analysis(provider, query, api_key, temp, max_token, model, style)
+                    note_upstream_result(result)
+                if breaker:
+                    breaker.record(result[0] == "Error" and is_provider_failure(result[1]), time.perf_counter() - called)
+        except asyncio.CancelledError:
+            # A cancelled hedge leg says nothing about the provider
+            if breaker:
+                breaker.release()
+            raise
+    record_analysis(provider_label, model_label, result[0], result[1], time.perf_counter() - started)
+    return result
+
+async def _async_rate_limit(provider, api_key, query, style, max_token, provider_label, model_label):
+    """Wait for the client-side rate limiter without blocking the loop"""
+    if not RATE_LIMIT_ENABLED or not provider_requires_api_key(provider):
+        return None
+    admitted, wait = RATE_LIMITER.reserve(provider, api_key, estimate_tokens(query, style, max_token))
+    if not admitted:
+        return rate_limited_result(provider, wait, provider_label, model_label)
+    if wait > 0:
+        await asyncio.sleep(wait)
+    observe_stage("rate_limit", wait, provider_label, model_label)
+    return None
+
+async def _async_hedged_analysis(query, api_key, temp, max_token, provider, model, style, hedge):
+    """Race the primary against a delayed secondary leg; the first usable result wins"""
+    hedge_provider = hedge.get("provider") or provider
+    hedge_model = hedge.get("model")
+    hedge_key = hedge.get("api_key") or api_key
+    delay = get_hedge_delay(provider, model)
+    started = time.perf_counter()
+
+    primary = asyncio.ensure_future(async_prompt_analysis(query, api_key, temp, max_token, provider, model, style,
+                                                          fallback=False))
+    done, _ = await asyncio.wait({primary}, timeout=delay)
+    if done and is_usable_result(primary.result()):
+        return tag_hedge(primary.result(), "primary", False, delay, started)
+
+    secondary = asyncio.ensure_future(async_prompt_analysis(query, hedge_key, temp, max_token, hedge_provider,
+                                                            hedge_model, style, fallback=False))
+    legs = {primary: "primary", secondary: "secondary"}
+    served_by = hedge_served_by(provider, model, hedge_provider, hedge_model)
+    pending = set(legs)
+    fallback = None
+    while pending:
+        done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            result = task.result()
+            if is_usable_result(result):
+                for loser in pending:
+                    loser.cancel()
+                return tag_hedge(result, legs[task], True, delay, started, served_by)
+            # Prefer the primary's error if neither leg succeeds
+            if fallback is None or legs[task] == "primary":
+                fallback = (result, legs[task])
+    return tag_hedge(fallback[0], fallback[1], True, delay, started, served_by)
+
+async def _async_route_analysis(provider, query, api_key, temp, max_token, model, style):
+    """Route to appropriate provider"""
+    if provider == "groq":
+        return await _async_analyze_with_groq(query, api_key, temp, max_token, model, style)
+    elif provider == "openai":
+        return await _async_analyze_with_openai(query, api_key, temp, max_token, model, style)
+    elif provider == "anthropic":
+        return await _async_analyze_with_anthropic(query, api_key, temp, max_token, model, style)
+    elif provider == "mistral":
+        return await _async_analyze_with_mistral(query, api_key, temp, max_token, model, style)
+    elif provider == "together":
+        return await _async_analyze_with_together(query, api_key, temp, max_token, model, style)
+    elif provider == "openrouter":
+        return await _async_analyze_with_openrouter(query, api_key, temp, max_token, model, style)
+    elif provider == "local":
+        # Microseconds of CPU - not worth a thread hop
+        return analyze_with_local(query, style)
+    else:
+        return "Error", f"Provider {provider} not implemented"
+
+async def _structured_call(provider, model, call):
+    """Awaitable app_util.structured_call: a 400 refusing the structured params is retried once without them"""
+    structured = structured_request_params(provider, model)
+    try:
+        response = await call(**structured)
+    except Exception as e:
+        if not refuses_structured(provider, model, structured, e):
+            raise
+    else:
+        if not refuses_structured(provider, model, structured, response):
+            return response, structured
+    return await call(), {}
+
+async def _async_analyze_with_groq(query, api_key, temp, max_token, model, style):
+    """Analyze prompt using Groq"""
+    if not get_sdk_class("groq", asynchronous=True):
+        return "Error", "Groq library not installed. Run: pip install groq"
+
+    try:
+        client = _get_async_sdk_client("groq", api_key)
+
+        with metrics_stage("prompt"):
+            messages = get_chat_messages(query, style)
+
+        async def create(**structured):
+            return await client.chat.completions.with_raw_response.create(
+                model=model,
+                messages=messages,
+                temperature=temp,
+                max_tokens=max_token,
+                top_p=1,
+                stream=False,
+                stop=None,
+                **structured
+            )
+
+        with metrics_stage("upstream"):
+            raw, structured = await _structured_call("groq", model, create)
+            completion = raw.parse()
+        RATE_LIMITER.observe_headers("groq", api_key, raw.headers)
+
+        response_content = completion.choices[0].message.content
+        log_sampled(logger, "Groq API response: %.500s", response_content)
+
+        return await _async_complete_analysis(query, style, response_content, completion.usage,
+                                              completion.choices[0].finish_reason,
+                                              _async_continuation("groq", query, api_key, temp, max_token, model,
+                                                                  style),
+                                              structured=bool(structured))
+
+    except Exception as e:
+        logger.warning("Groq API error: %s", e)
+        RATE_LIMITER.observe_headers("groq", api_key, error_headers(e))
+        return "Error", f"Groq API error: {str(e)}"
+
+async def _async_analyze_with_openai(query, api_key, temp, max_token, model, style):
+    """Analyze prompt using OpenAI"""
+    if not get_sdk_class("openai", asynchronous=True):
+        return "Error", "OpenAI library not installed. Run: pip install openai"
+
+    try:
+        client = _get_async_sdk_client("openai", api_key)
+
+        with metrics_stage("prompt"):
+            messages = get_chat_messages(query, style)
+
+        async def create(**structured):
+            return await client.chat.completions.with_raw_response.create(
+                model=model,
+                messages=messages,
+                temperature=temp,
+                max_tokens=max_token,
+                top_p=1,
+                extra_body=openai_cache_params(style),
+                **structured
+            )
+
+        with metrics_stage("upstream"):
+            raw, structured = await _structured_call("openai", model, create)
+            completion = raw.parse()
+        RATE_LIMITER.observe_headers("openai", api_key, raw.headers)
+
+        choice = completion.choices[0]
+        return await _async_complete_analysis(query, style, choice.message.content, completion.usage,
+                                              choice.finish_reason,
+                                              _async_continuation("openai", query, api_key, temp, max_token, model,
+                                                                  style),
+                                              structured=bool(structured))
+
+    except Exception as e:
+        logger.warning("OpenAI API error: %s", e)
+        RATE_LIMITER.observe_headers("openai", api_key, error_headers(e))
+        return "Error", f"OpenAI API error: {str(e)}"
+
+async def _async_analyze_with_anthropic(query, api_key, temp, max_token, model, style):
+    """Analyze prompt using Anthropic Claude"""
+    if not get_sdk_class("anthropic", asynchronous=True):
+        return "Error", "Anthropic library not installed. Run: pip install anthropic"
+
+    try:
+        client = _get_async_sdk_client("anthropic", api_key)
+
+        with metrics_stage("prompt"):
+            _, user_prompt = get_analysis_messages(query, style)
+
+        async def create(**structured):
+            return await client.messages.with_raw_response.create(
+                model=model,
+                max_tokens=max_token,
+                temperature=temp,
+                system=get_anthropic_system(style),
+                messages=[
+                    {"role": "user", "content": user_prompt}
+                ],
+                **structured
+            )
+
+        with metrics_stage("upstream"):
+            raw, structured = await _structured_call("anthropic", model, create)
+            message = raw.parse()
+        RATE_LIMITER.observe_headers("anthropic", api_key, raw.headers)
+
+        # A cut-off tool call cannot be resumed as text
+        return await _async_complete_analysis(query, style, anthropic_reply_text(message), message.usage,
+                                              message.stop_reason,
+                                              None if structured else _async_continuation(
+                                                  "anthropic", query, api_key, temp, max_token, model, style),
+                                              structured=bool(structured))
+
+    except Exception as e:
+        logger.warning("Anthropic API error: %s", e)
+        RATE_LIMITER.observe_headers("anthropic", api_key, error_headers(e))
+        return "Error", f"Anthropic API error: {str(e)}"
+
+async def _async_analyze_with_mistral(query, api_key, temp, max_token, model, style):
+    """Analyze prompt using Mistral AI"""
+    return await _async_analyze_with_openai_compatible("mistral", query, api_key, temp, max_token, model, style)
+
+async def _async_analyze_with_together(query, api_key, temp, max_token, model, style):
+    """Analyze prompt using Together AI"""
+    return await _async_analyze_with_openai_compatible("together", query, api_key, temp, max_token, model, style)
+
+async def _async_analyze_with_openrouter(query, api_key, temp, max_token, model, style):
+    """Analyze prompt using OpenRouter"""
+    return await _async_analyze_with_openai_compatible("openrouter", query, api_key, temp, max_token, model, style)
+
+async def _async_analyze_with_openai_compatible(provider, query, api_key, temp, max_token, model, style):
+    """Analyze prompt through an OpenAI-compatible chat completions REST API"""
+    endpoint = HTTP_PROVIDER_ENDPOINTS[provider]
+    label = endpoint["label"]
+    try:
+        headers = {
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {api_key}",
+            **endpoint["headers"]
+        }
+
+        with metrics_stage("prompt"):
+            messages = get_chat_messages(query, style)
+
+        data = {
+            "model": model,
+            "messages": messages,
+            "temperature": temp,
+            "max_tokens": max_token
+        }
+
+        async def post(**structured):
+            return await _get_async_http_client().post(endpoint["url"], headers=headers, json={**data, **structured})
+
+        with metrics_stage("upstream"):
+            response, structured = await _structured_call(provider, model, post)
+            result = response.json() if response.status_code == 200 else None
+        RATE_LIMITER.observe_headers(provider, api_key, response.headers)
+
+        if response.status_code != 200:
+            logger.warning("%s API error: %s", label, response.status_code)
+            return "Error", f"{label} API error: {response.status_code} - {response.text}"
+
+        choice = result["choices"][0]
+        return await _async_complete_analysis(query, style, choice["message"]["content"], result.get("usage"),
+                                              choice.get("finish_reason"),
+                                              _async_continuation(provider, query, api_key, temp, max_token, model,
+                                                                  style),
+                                              structured=bool(structured))
+
+    except Exception as e:
+        logger.warning("%s API error: %s", label, e)
+        return "Error", f"{label} API error: {str(e)}"
+
+async def _async_complete_analysis(query, style, text, usage, finish_reason, continuation, structured=False):
+    """app_util._complete_analysis with the continuation call made on the event loop"""
+    truncated = finish_reason in TRUNCATED_FINISH_REASONS
+    recovery = truncation_recovery(text, continuation) if truncated else None
+    if recovery is None and truncated:
+        try:
+            with metrics_stage("continuation"):
+                text, more_usage = await continuation(text or "")
+            usage, recovery = sum_usage(usage, more_usage), "continued"
+        except Exception as e:
+            logger.warning("Truncation continuation failed: %s", e)
+            recovery = "unrecovered"
+    return finish_analysis(query, style, text, usage, truncated, recovery, structured)
+
+def _async_continuation(provider, query, api_key, temp, max_token, model, style):
+    """Async app_util._continuation: resume a cut-off analysis on provider"""
+    async def continue_analysis(partial):
+        if provider == "anthropic":
+            _, user_prompt = get_analysis_messages(query, style)
+            prefix = partial.rstrip()
+            message = await _get_async_sdk_client(provider, api_key).messages.create(
+                model=model,
+                max_tokens=max_token,
+                temperature=temp,
+                system=get_anthropic_system(style),
+                messages=[
+                    {"role": "user", "content": user_prompt},
+                    {"role": "assistant", "content": prefix}
+                ]
+            )
+            return prefix + message.content[0].text, message.usage
+
+        messages = continuation_messages(get_chat_messages(query, style), partial)
+        if provider in ("groq", "openai"):
+            extra = {"extra_body": openai_cache_params(style)} if provider == "openai" else {}
+            completion = await _get_async_sdk_client(provider, api_key).chat.completions.create(
+                model=model, messages=messages, temperature=temp, max_tokens=max_token, **extra
+            )
+            return join_continuation(partial, completion.choices[0].message.content), completion.usage
+
+        endpoint = HTTP_PROVIDER_ENDPOINTS[provider]
+        response = await _get_async_http_client().post(
+            endpoint["url"],
+            headers={"Content-Type": "application/json", "Authorization": f"Bearer {api_key}", **endpoint["headers"]},
+            json={"model": model, "messages": messages, "temperature": temp, "max_tokens": max_token}
+        )
+        if response.status_code != 200:
+            raise RuntimeError(f"{endpoint['label']} API error: {response.status_code} - {response.text}")
+        result = response.json()
+        return join_continuation(partial, result["choices"][0]["message"]["content"]), result.get("usage")
+    return continue_analysis
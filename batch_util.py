@@ -0,0 +1,65 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Fan-out configuration
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", 500))
+BATCH_DEFAULT_CONCURRENCY = int(os.getenv("BATCH_DEFAULT_CONCURRENCY", 8))
+
+def parse_concurrency_limits(spec):
+    """Parse "groq=8,openai=16" into {"groq": 8, "openai": 16}"""
+    limits = {}
+    for part in (spec or "").split(","):
+        if "=" not in part:
+            continue
+        provider, _, value = part.partition("=")
+        try:
+            limits[provider.strip().lower()] = max(1, int(value))
+        except ValueError:
+            continue
+    return limits
+
+class ProviderPools:
+    """One bounded worker pool per provider, shared by every batch in the process
+
+    Sizing each pool to the provider's limit caps in-flight calls without
+    parking threads on a semaphore, so a slow provider cannot starve the
+    others of workers.
+    """
+
+    def __init__(self, limits=None, default=BATCH_DEFAULT_CONCURRENCY):
+        self.limits = dict(limits or {})
+        self.default = max(1, int(default))
+        self._pools = {}
+        self._lock = threading.Lock()
+
+    def limit(self, provider):
+        """Concurrency limit for provider"""
+        return self.limits.get(str(provider or "").lower(), self.default)
+
+    def executor(self, provider):
+        """Worker pool for provider, created on first use so each forked worker gets its own"""
+        provider = str(provider or "").lower()
+        with self._lock:
+            pool = self._pools.get(provider)
+            if pool is None:
+                pool = ThreadPoolExecutor(max_workers=self.limit(provider), thread_name_prefix=f"batch-{provider or 'default'}")
+                self._pools[provider] = pool
+        return pool
+
+PROVIDER_POOLS = ProviderPools(parse_concurrency_limits(os.getenv("BATCH_PROVIDER_CONCURRENCY", "")))
+
+def fan_out(items, worker, provider_of, pools=PROVIDER_POOLS):
+    """Run worker(item) for every item on its provider's pool, preserving order
+
+    A worker that raises yields its exception in place of a result, so one
+    failure never sinks the rest of the batch.
+    """
+    futures = [pools.executor(provider_of(item)).submit(worker, item) for item in items]
+    results = []
+    for future in futures:
+        try:
+            results.append(future.result())
+        except Exception as e:
+            results.append(e)
+    return results
@@ -0,0 +1,174 @@
+"""Load test for /api/prompt/analyze against the local mock provider
+
+Starts benchmarks/mock_provider.py in-process, points the chosen provider
+at it through its <PROVIDER>_BASE_URL override and drives concurrent
+analyze (or analyze/stream) requests through the real app: validation,
+routing, provider client, parsing and metrics. Reports throughput, latency
+percentiles, status counts and the parse-fallback rate from the app's own
+prompt_analysis_requests_total counters.
+
+    python benchmarks/bench_analyze.py [--provider openai] [--requests 500] [--concurrency 32] \\
+        [--latency lognormal:0.5:0.3] [--error-rate 0.02] [--malformed-rate 0.05] [--stream] [--json out.json]
+
+With --target the requests go to an already running server instead (start
+it with the base URL overrides and a mock_provider.py of its own); the
+fallback rate then comes from its /api/metrics.
+"""
+import argparse
+import json
+import os
+import re
+import sys
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mock_provider import point_providers_at, MockProvider, BASE_URL_PATHS  # noqa: E402
+
+# Measure the provider path, not the cache, limiter or background warm-up
+os.environ.setdefault("ANALYSIS_CACHE_ENABLED", "0")
+os.environ.setdefault("ANALYSIS_STORE_ENABLED", "0")
+os.environ.setdefault("NEAR_DUP_ENABLED", "0")
+os.environ.setdefault("RATE_LIMIT_ENABLED", "0")
+os.environ.setdefault("HTTP_PREWARM", "0")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+DEFAULT_MODELS = {
+    "groq": "llama-3.3-70b-versatile",
+    "openai": "gpt-4o-mini",
+    "anthropic": "claude-3-5-haiku-20241022",
+    "mistral": "mistral-small-latest",
+    "together": "meta-llama/Meta-Llama-3.1-8B-Instruct-Turbo",
+    "openrouter": "openai/gpt-4o-mini",
+}
+_OUTCOME_LINE = re.compile(r'^prompt_analysis_requests_total\{(.*)\} ([0-9.e+]+)$', re.M)
+
+def request_body(args, index):
+    return {
+        "prompt": f"Write a poem about the sea, variant {index}",
+        "api_key": "load-test-key-0000",
+        "provider": args.provider,
+        "model": args.model or DEFAULT_MODELS[args.provider],
+        "style": args.style,
+        "cache": False
+    }
+
+def outcome_counts(metrics_text):
+    """prompt_analysis_requests_total summed by outcome, from Prometheus text"""
+    counts = {}
+    for labels, value in _OUTCOME_LINE.findall(metrics_text):
+        outcome = re.search(r'outcome="([^"]*)"', labels)
+        if outcome:
+            counts[outcome.group(1)] = counts.get(outcome.group(1), 0) + float(value)
+    return counts
+
+def make_client(args):
+    """post(path, body) -> (status, text) and get(path) -> text, in-process or over HTTP"""
+    if args.target:
+        target = args.target.rstrip("/")
+
+        def post(path, body):
+            request = urllib.request.Request(f"{target}{path}", json.dumps(body).encode(),
+                                             {"Content-Type": "application/json"})
+            try:
+                with urllib.request.urlopen(request, timeout=args.timeout) as response:
+                    return response.status, response.read().decode()
+            except urllib.error.HTTPError as e:
+                return e.code, e.read().decode()
+
+        def get(path):
+            with urllib.request.urlopen(f"{target}{path}", timeout=args.timeout) as response:
+                return response.read().decode()
+        return post, get
+
+    from main import app
+    client = app.test_client()
+
+    def post(path, body):
+        response = client.post(path, json=body)
+        return response.status_code, response.get_data(as_text=True)
+
+    def get(path):
+        return client.get(path).get_data(as_text=True)
+    return post, get
+
+def percentile(values, q):
+    return values[min(len(values) - 1, int(len(values) * q))] if values else None
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--provider", default="openai", choices=sorted(BASE_URL_PATHS))
+    parser.add_argument("--model")
+    parser.add_argument("--style", default="comprehensive")
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--stream", action="store_true", help="use /api/prompt/analyze/stream")
+    parser.add_argument("--latency", default="lognormal:0.5:0.3", help="mock latency distribution (see mock_provider.py)")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--error-statuses", default="500,503")
+    parser.add_argument("--malformed-rate", type=float, default=0.05)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--target", help="base URL of a running server instead of the in-process app")
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--json", dest="json_path", help="also write results to this file")
+    args = parser.parse_args()
+
+    mock = None
+    if not args.target:
+        mock = MockProvider(args.latency, args.error_rate, [int(status) for status in args.error_statuses.split(",")],
+                            args.malformed_rate, seed=args.seed)
+        root = mock.start()
+        point_providers_at(root, [args.provider])
+        os.environ.setdefault("HTTP_POOL_SIZE", str(args.concurrency))
+
+    post, get = make_client(args)
+    path = "/api/prompt/analyze/stream" if args.stream else "/api/prompt/analyze"
+    before = outcome_counts(get("/api/metrics"))
+
+    def one(index):
+        started = time.perf_counter()
+        status, text = post(path, request_body(args, index))
+        if args.stream and status == 200 and "event: error" in text:
+            status = "stream_error"
+        return status, time.perf_counter() - started
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        outcomes = list(pool.map(one, range(args.requests)))
+    elapsed = time.perf_counter() - started
+
+    after = outcome_counts(get("/api/metrics"))
+    analyses = {outcome: int(after.get(outcome, 0) - before.get(outcome, 0)) for outcome in after}
+    analyzed = sum(analyses.values())
+    statuses = {}
+    for status, _ in outcomes:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    latencies = sorted(seconds for _, seconds in outcomes)
+
+    summary = {
+        "provider": args.provider,
+        "endpoint": path,
+        "requests": len(outcomes),
+        "concurrency": args.concurrency,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(len(outcomes) / elapsed, 1),
+        "p50_s": round(percentile(latencies, 0.5), 3),
+        "p95_s": round(percentile(latencies, 0.95), 3),
+        "p99_s": round(percentile(latencies, 0.99), 3),
+        "statuses": statuses,
+        "analyses": analyses,
+        "parse_fallback_rate": round(analyses.get("fallback", 0) / analyzed, 4) if analyzed else None,
+        "error_rate": round(analyses.get("error", 0) / analyzed, 4) if analyzed else None,
+        "mock": mock.stats() if mock else None
+    }
+    print(json.dumps(summary))
+
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=2)
+
+if __name__ == "__main__":
+    main()
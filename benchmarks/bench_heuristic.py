@@ -0,0 +1,71 @@
+"""Throughput of the local heuristic provider (heuristic_util.analyze_prompts)
+
+Scores a synthetic mix of bare, medium and fully structured prompts in
+batches and reports prompts per second.
+
+    python benchmarks/bench_heuristic.py [--prompts 20000] [--batch 500] [--json out.json]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from heuristic_util import analyze_prompts  # noqa: E402
+
+SAMPLES = [
+    "write a poem",
+    "Explain quantum computing to a 10 year old in 100 words, using a friendly tone.",
+    """# Role
+You are a senior Python engineer.
+
+# Task
+Write a function that parses ISO 8601 dates. Because our users paste dates from many sources, handle time zones.
+
+# Requirements
+- Must not use third-party libraries
+- Keep it under 40 lines
+
+# Output format
+Return only a Python code block followed by 3 bullet points explaining edge cases.
+
+Example:
+Input: 2024-01-01T00:00:00Z
+Output: datetime(2024, 1, 1, tzinfo=utc)
+
+Think step by step and verify the result against the example.""",
+]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--prompts", type=int, default=20000)
+    parser.add_argument("--batch", type=int, default=500)
+    parser.add_argument("--json", dest="json_path", help="also write results to this file")
+    args = parser.parse_args()
+
+    # Vary the text so nothing downstream can memoize it
+    prompts = [f"{SAMPLES[index % len(SAMPLES)]} ({index})" for index in range(args.prompts)]
+    analyze_prompts(prompts[:args.batch])
+
+    started = time.perf_counter()
+    for offset in range(0, len(prompts), args.batch):
+        analyze_prompts(prompts[offset:offset + args.batch])
+    elapsed = time.perf_counter() - started
+
+    summary = {
+        "prompts": len(prompts),
+        "batch": args.batch,
+        "elapsed_s": round(elapsed, 3),
+        "prompts_per_s": round(len(prompts) / elapsed),
+        "mean_us": round(elapsed / len(prompts) * 1e6, 1)
+    }
+    print(json.dumps(summary))
+
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=2)
+
+if __name__ == "__main__":
+    main()
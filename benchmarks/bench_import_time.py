@@ -0,0 +1,109 @@
+"""Startup benchmark: `python -X importtime -c "import main"` against a budget
+
+Imports the app in fresh interpreters, reports the median cumulative import
+time and the heaviest packages, and fails (exit 1) when the median exceeds
+the budget or a provider SDK is imported at startup - those must stay lazy
+(see app_util.get_sdk_class).
+
+    python benchmarks/bench_import_time.py [--runs 5] [--budget-ms 800] [--module main] [--json out.json]
+"""
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Cold-start budget for `import main`; it was about 2s with eager SDK imports
+IMPORT_BUDGET_MS = 800
+
+# Modules that only a provider call may import
+LAZY_MODULES = ("groq", "openai", "anthropic", "httpx", "pydantic")
+
+_IMPORT_LINE = re.compile(r'^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|( *)(\S+)$')
+
+def import_profile(module, env):
+    """One fresh-interpreter import; returns {package: (cumulative_us, depth)} for module and what it pulled in
+
+    -X importtime prints in post-order, so module's imports are the lines
+    between the previous top-level entry and module's own line.
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT, env=env, capture_output=True, text=True, check=True
+    )
+    rows = []
+    for line in result.stderr.splitlines():
+        match = _IMPORT_LINE.match(line)
+        if match:
+            _, cumulative_us, indent, name = match.groups()
+            rows.append((name, int(cumulative_us), (len(indent) - 1) // 2))
+
+    end = next(index for index, (name, _, depth) in enumerate(rows) if name == module and depth == 0)
+    start = end
+    while start > 0 and rows[start - 1][2] > 0:
+        start -= 1
+    return {name: (cumulative_us, depth) for name, cumulative_us, depth in rows[start:end + 1]}
+
+def run(module, runs):
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ, HTTP_PREWARM="0", ANALYSIS_STORE_PATH=os.path.join(tmp, "analysis_cache.db"))
+        env.pop("PYTHONDONTWRITEBYTECODE", None)
+        # The first run fills the bytecode cache and is not counted
+        import_profile(module, env)
+        return [import_profile(module, env) for _ in range(runs)]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget-ms", type=float, default=IMPORT_BUDGET_MS)
+    parser.add_argument("--module", default="main")
+    parser.add_argument("--top", type=int, default=12, help="heaviest packages to list")
+    parser.add_argument("--json", dest="json_path", help="also write results to this file")
+    args = parser.parse_args()
+
+    profiles = run(args.module, args.runs)
+    totals_ms = [profile[args.module][0] / 1000 for profile in profiles]
+    median_ms = statistics.median(totals_ms)
+
+    # Heaviest direct imports of the module in the median run
+    median_profile = profiles[totals_ms.index(sorted(totals_ms)[len(totals_ms) // 2])]
+    heaviest = sorted(
+        ((name, cumulative / 1000) for name, (cumulative, depth) in median_profile.items() if depth == 1),
+        key=lambda item: item[1], reverse=True
+    )[:args.top]
+    eager = sorted({name.split(".")[0] for profile in profiles for name in profile
+                    if name.split(".")[0] in LAZY_MODULES})
+
+    print(f"{'package':<28} {'cumulative ms':>14}")
+    for name, ms in heaviest:
+        print(f"{name:<28} {ms:>14.1f}")
+
+    summary = {
+        "module": args.module,
+        "runs": args.runs,
+        "median_ms": round(median_ms, 1),
+        "min_ms": round(min(totals_ms), 1),
+        "max_ms": round(max(totals_ms), 1),
+        "budget_ms": args.budget_ms,
+        "eager_lazy_modules": eager,
+        "within_budget": median_ms <= args.budget_ms and not eager
+    }
+    print(json.dumps(summary))
+
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump({"summary": summary, "heaviest": heaviest}, f, indent=2)
+
+    if eager:
+        print(f"FAIL: imported at startup but should load lazily: {', '.join(eager)}", file=sys.stderr)
+    if median_ms > args.budget_ms:
+        print(f"FAIL: median import time {median_ms:.0f} ms is over the {args.budget_ms:.0f} ms budget", file=sys.stderr)
+    sys.exit(0 if summary["within_budget"] else 1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""Micro-benchmark: JSON extraction from provider outputs
+
+Compares the single-pass extractor used by _parse_response with the greedy
+regex path it replaced, over the corpus in provider_outputs.jsonl.
+
+    python benchmarks/bench_json_extract.py [--iterations 2000] [--json out.json]
+"""
+import argparse
+import json
+import os
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app_util import extract_json_object
+
+CORPUS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "provider_outputs.jsonl")
+
+def legacy_extract(text):
+    """The previous _parse_response path: greedy regex, then json.loads, then score regex"""
+    json_match = re.search(r'\{.*\}', text, re.DOTALL)
+    if not json_match:
+        return "none"
+    try:
+        json.loads(json_match.group(0))
+        return "parsed"
+    except json.JSONDecodeError:
+        return "partial" if re.search(r'"score":\s*(\d+)', text) else "none"
+
+def single_pass_extract(text):
+    """The current path"""
+    parsed, repaired = extract_json_object(text)
+    if parsed is None:
+        return "none"
+    return "repaired" if repaired else "parsed"
+
+def load_corpus(path=CORPUS_PATH):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def run(iterations):
+    rows = []
+    for sample in load_corpus():
+        text = sample["output"]
+        legacy_us = timeit.timeit(lambda: legacy_extract(text), number=iterations) / iterations * 1e6
+        single_us = timeit.timeit(lambda: single_pass_extract(text), number=iterations) / iterations * 1e6
+        rows.append({
+            "provider": sample["provider"],
+            "case": sample["case"],
+            "chars": len(text),
+            "legacy": legacy_extract(text),
+            "single_pass": single_pass_extract(text),
+            "legacy_us": round(legacy_us, 2),
+            "single_pass_us": round(single_us, 2)
+        })
+    return rows
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=2000)
+    parser.add_argument("--json", dest="json_path", help="also write results to this file")
+    args = parser.parse_args()
+
+    rows = run(args.iterations)
+    print(f"{'provider':<11} {'case':<18} {'chars':>6}  {'legacy':<8} {'us':>7}  {'single':<8} {'us':>7}")
+    for row in rows:
+        print(f"{row['provider']:<11} {row['case']:<18} {row['chars']:>6}  "
+              f"{row['legacy']:<8} {row['legacy_us']:>7.2f}  {row['single_pass']:<8} {row['single_pass_us']:>7.2f}")
+
+    usable = lambda key: sum(1 for row in rows if row[key] in ("parsed", "repaired"))
+    summary = {
+        "samples": len(rows),
+        "legacy_usable": usable("legacy"),
+        "single_pass_usable": usable("single_pass"),
+        "legacy_total_us": round(sum(row["legacy_us"] for row in rows), 2),
+        "single_pass_total_us": round(sum(row["single_pass_us"] for row in rows), 2)
+    }
+    print(json.dumps(summary))
+
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump({"summary": summary, "rows": rows}, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""Near-duplicate index: lookup latency, recall and memory at scale
+
+Fills a similarity_util.NearDuplicateIndex with synthetic prompts, then
+looks up one-word edits of indexed prompts (which should match) and fresh
+prompts (which should not), reporting lookup percentiles, recall,
+false positives and the index's peak RSS growth.
+
+    python benchmarks/bench_near_dup.py [--entries 200000] [--lookups 2000] [--json out.json]
+"""
+import argparse
+import json
+import os
+import random
+import resource
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from similarity_util import shingles, NearDuplicateIndex  # noqa: E402
+
+VOCABULARY = [f"word{index}" for index in range(5000)]
+NAMESPACE = "groq:llama-3.3-70b-versatile:comprehensive:0.7:1000"
+
+def make_prompt(rng):
+    return " ".join(rng.choice(VOCABULARY) for _ in range(rng.randint(10, 80)))
+
+def jaccard(left, right):
+    left, right = shingles(left), shingles(right)
+    return len(left & right) / len(left | right)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--entries", type=int, default=200000)
+    parser.add_argument("--lookups", type=int, default=2000)
+    parser.add_argument("--json", dest="json_path", help="also write results to this file")
+    args = parser.parse_args()
+
+    rng = random.Random(1)
+    prompts = [make_prompt(rng) for _ in range(args.entries)]
+    index = NearDuplicateIndex(max_entries=args.entries)
+
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    started = time.perf_counter()
+    for position, prompt in enumerate(prompts):
+        index.add(prompt, f"{position:064x}:{NAMESPACE}", NAMESPACE)
+    add_seconds = time.perf_counter() - started
+    rss_growth = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss_before
+
+    latencies = []
+    expected = found = 0
+    for position in range(args.lookups):
+        words = prompts[position].split()
+        words[len(words) // 2] = "edited"
+        query = " ".join(words)
+        started = time.perf_counter()
+        match = index.lookup(query, NAMESPACE)
+        latencies.append(time.perf_counter() - started)
+        if jaccard(query, prompts[position]) >= index.threshold:
+            expected += 1
+            found += bool(match and match[0].startswith(f"{position:064x}"))
+    false_positives = sum(1 for _ in range(args.lookups) if index.lookup(make_prompt(rng), NAMESPACE))
+
+    latencies.sort()
+    summary = {
+        "entries": args.entries,
+        "adds_per_s": round(args.entries / add_seconds),
+        "lookup_p50_us": round(latencies[len(latencies) // 2] * 1e6, 1),
+        "lookup_p99_us": round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1e6, 1),
+        "recall": round(found / expected, 3) if expected else None,
+        "false_positives": false_positives,
+        # Peak RSS growth (KiB on Linux) while filling, prompt strings included
+        "peak_rss_growth_mib": round(rss_growth / 1024, 1)
+    }
+    print(json.dumps(summary))
+
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+"""Load test: sync Flask path vs the async (ASGI) serving mode
+
+Drives N concurrent /api/prompt/analyze requests against an in-process mock
+OpenAI-compatible upstream that answers after a fixed latency. The sync path
+runs the Flask app on a fixed pool of worker threads, as a gthread/sync
+deployment would; the async path calls the ASGI app on one event loop. Both
+go through the real provider layer (Together AI's REST backend, pointed at
+the mock).
+
+    python benchmarks/load_async.py [--requests 400] [--latency 1.0] [--sync-workers 16] [--json out.json]
+"""
+import argparse
+import asyncio
+import json
+import os
+import resource
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Measure the provider path, not the cache, limiter or background warm-up
+os.environ.setdefault("ANALYSIS_CACHE_ENABLED", "0")
+os.environ.setdefault("ANALYSIS_STORE_ENABLED", "0")
+os.environ.setdefault("RATE_LIMIT_ENABLED", "0")
+os.environ.setdefault("HTTP_PREWARM", "0")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+MOCK_CONTENT = json.dumps({
+    "score": 62, "clarity_score": 15, "context_score": 12, "structure_score": 12, "role_score": 9,
+    "constraints_score": 7, "advanced_score": 7,
+    "strengths": ["Clear task"], "weaknesses": ["No audience"], "improvements": ["Name the audience"],
+    "new_prompt": "You are an expert writer. Write a short poem about the sea for children.",
+    "reasoning": "Adds role, audience and format."
+})
+
+class MockUpstream:
+    """Keep-alive HTTP/1.1 server on its own loop answering chat completions after a delay"""
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.port = None
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self._ready = threading.Event()
+        self._loop = None
+
+    def start(self):
+        threading.Thread(target=self._run, daemon=True).start()
+        self._ready.wait()
+        return f"http://127.0.0.1:{self.port}/v1/chat/completions"
+
+    def _run(self):
+        self._loop = asyncio.new_event_loop()
+        server = self._loop.run_until_complete(asyncio.start_server(self._handle, "127.0.0.1", 0, backlog=4096))
+        self.port = server.sockets[0].getsockname()[1]
+        self._ready.set()
+        self._loop.run_forever()
+
+    async def _handle(self, reader, writer):
+        try:
+            while True:
+                head = await reader.readuntil(b"\r\n\r\n")
+                length = 0
+                for line in head.split(b"\r\n"):
+                    if line.lower().startswith(b"content-length:"):
+                        length = int(line.split(b":", 1)[1])
+                await reader.readexactly(length)
+
+                self.in_flight += 1
+                self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+                await asyncio.sleep(self.latency)
+                self.in_flight -= 1
+
+                body = json.dumps({"choices": [{"message": {"role": "assistant", "content": MOCK_CONTENT}}]}).encode()
+                writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n"
+                             b"Content-Length: " + str(len(body)).encode() + b"\r\n\r\n" + body)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+def request_body(index):
+    return {
+        "prompt": f"Write a poem about the sea, variant {index}",
+        "api_key": "load-test-key-0000",
+        "provider": "together",
+        "model": "meta-llama/Meta-Llama-3.1-8B-Instruct-Turbo",
+        "cache": False
+    }
+
+def run_sync(app, requests_total, workers):
+    client = app.test_client()
+
+    def one(index):
+        started = time.perf_counter()
+        response = client.post("/api/prompt/analyze", json=request_body(index))
+        return response.status_code, time.perf_counter() - started
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(one, range(requests_total)))
+
+def run_async(app, requests_total):
+    async def one(index):
+        body = json.dumps(request_body(index)).encode()
+        sent = []
+
+        async def receive():
+            return {"type": "http.request", "body": body, "more_body": False}
+
+        async def send(message):
+            sent.append(message)
+
+        scope = {"type": "http", "method": "POST", "path": "/api/prompt/analyze", "headers": [
+            (b"content-type", b"application/json")
+        ], "query_string": b""}
+        started = time.perf_counter()
+        await app(scope, receive, send)
+        return sent[0]["status"], time.perf_counter() - started
+
+    async def main():
+        return await asyncio.gather(*(one(index) for index in range(requests_total)))
+
+    return asyncio.run(main())
+
+def measure(name, upstream, fn, *args):
+    upstream.peak_in_flight = 0
+    threads_before = threading.active_count()
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    started = time.perf_counter()
+    outcomes = fn(*args)
+    elapsed = time.perf_counter() - started
+    # Growth of the process's peak RSS (KiB on Linux); the sync run goes first
+    rss_growth = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss_before
+
+    latencies = sorted(seconds for _, seconds in outcomes)
+    return {
+        "mode": name,
+        "requests": len(outcomes),
+        "ok": sum(1 for status, _ in outcomes if status == 200),
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(len(outcomes) / elapsed, 1),
+        "p50_s": round(latencies[len(latencies) // 2], 3),
+        "p99_s": round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))], 3),
+        "peak_upstream_in_flight": upstream.peak_in_flight,
+        "threads_added": threading.active_count() - threads_before,
+        "peak_rss_growth_mib": round(rss_growth / 1024, 1)
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--latency", type=float, default=1.0, help="mock upstream latency in seconds")
+    parser.add_argument("--sync-workers", type=int, default=16, help="worker threads for the sync path")
+    parser.add_argument("--json", dest="json_path", help="also write results to this file")
+    args = parser.parse_args()
+
+    upstream = MockUpstream(args.latency)
+    url = upstream.start()
+    os.environ.setdefault("HTTP_POOL_SIZE", str(args.sync_workers))
+
+    # Imported outside the timed runs
+    import app_util
+    from asgi import app as asgi_app
+    from main import app as flask_app
+    app_util.HTTP_PROVIDER_ENDPOINTS["together"]["url"] = url
+
+    rows = [
+        measure(f"sync x{args.sync_workers} threads", upstream, run_sync, flask_app, args.requests, args.sync_workers),
+        measure("async (1 event loop)", upstream, run_async, asgi_app, args.requests)
+    ]
+    print(f"{'mode':<22} {'ok':>5} {'elapsed':>8} {'rps':>7} {'p50':>6} {'p99':>6} {'in-flight':>9} {'+RSS MiB':>8}")
+    for row in rows:
+        print(f"{row['mode']:<22} {row['ok']:>5} {row['elapsed_s']:>8.2f} {row['throughput_rps']:>7.1f} "
+              f"{row['p50_s']:>6.2f} {row['p99_s']:>6.2f} {row['peak_upstream_in_flight']:>9} {row['peak_rss_growth_mib']:>8.1f}")
+    summary = {"speedup": round(rows[0]["elapsed_s"] / rows[1]["elapsed_s"], 1), "latency_s": args.latency}
+    print(json.dumps(summary))
+
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump({"summary": summary, "rows": rows}, f, indent=2)
+
+if __name__ == "__main__":
+    main()
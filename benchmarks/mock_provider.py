@@ -0,0 +1,320 @@
+"""Local stand-in for the OpenAI-compatible and Anthropic chat APIs
+
+Answers POST .../chat/completions (Groq, OpenAI, Mistral, Together,
+OpenRouter) and POST .../v1/messages (Anthropic), streaming or not, after a
+latency drawn from a configurable distribution. A share of calls can fail
+with an HTTP error, and a share can return malformed analysis output
+(truncated JSON, prose, broken JSON), so parse fallbacks are exercised too.
+Like a real model, a reply stops at the request's max_tokens (finish_reason
+"length", stop_reason "max_tokens"), and a continuation request gets the
+rest of the cut-off reply. A request constrained to JSON (response_format,
+or a forced Anthropic tool) always gets the bare analysis object, as a
+tool_use block for Anthropic.
+
+Point the app at it with base URL overrides, e.g. for a mock on port 8900:
+
+    GROQ_BASE_URL=http://127.0.0.1:8900            (the SDK adds /openai/v1)
+    OPENAI_BASE_URL=http://127.0.0.1:8900/v1
+    ANTHROPIC_BASE_URL=http://127.0.0.1:8900       (the SDK adds /v1/messages)
+    TOGETHER_BASE_URL=http://127.0.0.1:8900/v1     (likewise MISTRAL_, OPENROUTER_)
+
+Run standalone:
+
+    python benchmarks/mock_provider.py --port 8900 --latency lognormal:0.8:0.4 --error-rate 0.02 --malformed-rate 0.05
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import threading
+import time
+
+# A well-formed analysis, as the templates ask for
+CANNED_ANALYSIS = {
+    "score": 62, "clarity_score": 15, "context_score": 12, "structure_score": 12, "role_score": 9,
+    "constraints_score": 7, "advanced_score": 7,
+    "strengths": ["Clear task", "Names the subject"],
+    "weaknesses": ["No audience", "No output format"],
+    "improvements": ["Name the audience", "Specify the format", "Add a length limit"],
+    "new_prompt": "You are an experienced children's poet. Write a 12-line rhyming poem about the sea for "
+                  "readers aged 6-8, using simple words and vivid images of waves, shells and gulls.",
+    "reasoning": "Adds role, audience, length and format."
+}
+
+# Base URL override each SDK or REST backend expects, relative to the mock's root
+BASE_URL_PATHS = {
+    "groq": "",               # the SDK appends /openai/v1/chat/completions
+    "openai": "/v1",
+    "anthropic": "",          # the SDK appends /v1/messages
+    "mistral": "/v1",
+    "together": "/v1",
+    "openrouter": "/api/v1",
+}
+
+def point_providers_at(root, providers=BASE_URL_PATHS):
+    """Set <PROVIDER>_BASE_URL for providers to the mock at root; call before importing app_util"""
+    for provider in providers:
+        os.environ[f"{provider.upper()}_BASE_URL"] = root + BASE_URL_PATHS[provider]
+
+def canned_outputs():
+    """Response texts by kind; "valid" ones parse cleanly, the rest need a fallback or repair"""
+    text = json.dumps(CANNED_ANALYSIS, indent=2)
+    return {
+        "valid": [
+            text,
+            f"```json\n{text}\n```",
+            f"Here is my analysis:\n\n{text}\n\nLet me know if you need more.",
+        ],
+        "malformed": [
+            text[:int(len(text) * 0.6)],                                   # truncated mid-object
+            "The prompt is short and lacks context. I would add a role and an audience.",  # no JSON at all
+            text.replace('"', "'"),                                        # not JSON
+            '{"score": 40, "new_prompt": "Write a poem" "reasoning": }',   # broken beyond repair
+        ]
+    }
+
+def parse_latency(spec):
+    """Sampler for "0.5", "fixed:0.5", "uniform:0.2:1.0", "normal:0.8:0.2", "lognormal:0.8:0.4" or "exponential:0.5"
+
+    lognormal takes the median and the sigma of the underlying normal.
+    """
+    kind, _, params = str(spec).partition(":")
+    if not params:
+        kind, params = "fixed", kind
+    values = [float(value) for value in params.split(":")]
+    samplers = {
+        "fixed": lambda rng: values[0],
+        "uniform": lambda rng: rng.uniform(values[0], values[1]),
+        "normal": lambda rng: rng.gauss(values[0], values[1]),
+        "lognormal": lambda rng: values[0] * rng.lognormvariate(0, values[1]),
+        "exponential": lambda rng: rng.expovariate(1 / values[0]),
+    }
+    if kind not in samplers:
+        raise ValueError(f"Unknown latency distribution: {kind}")
+    return lambda rng: max(0.0, samplers[kind](rng))
+
+class MockProvider:
+    """Keep-alive HTTP/1.1 mock provider on its own event loop thread"""
+
+    def __init__(self, latency="0.5", error_rate=0.0, error_statuses=(500,), malformed_rate=0.0,
+                 stream_chunks=20, seed=None, outputs=None, responder=None):
+        self.sample_latency = parse_latency(latency)
+        self.error_rate = float(error_rate)
+        self.error_statuses = tuple(error_statuses)
+        self.malformed_rate = float(malformed_rate)
+        self.stream_chunks = max(1, int(stream_chunks))
+        self.outputs = outputs or canned_outputs()
+        # responder(request, anthropic) -> (status, text, latency), or None for the random behaviour
+        self.responder = responder
+        self.rng = random.Random(seed)
+        self.port = None
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.counts = {"requests": 0, "errors": 0, "malformed": 0, "truncated": 0, "streamed": 0,
+                       "structured": 0}
+        self._ready = threading.Event()
+
+    def start(self, host="127.0.0.1", port=0):
+        """Serve in a daemon thread; returns the base URL (no path)"""
+        threading.Thread(target=self.serve, args=(host, port), daemon=True).start()
+        self._ready.wait()
+        return f"http://{host}:{self.port}"
+
+    def serve(self, host="127.0.0.1", port=0):
+        loop = asyncio.new_event_loop()
+        server = loop.run_until_complete(asyncio.start_server(self._handle, host, port, backlog=4096))
+        self.port = server.sockets[0].getsockname()[1]
+        self._ready.set()
+        loop.run_forever()
+
+    def stats(self):
+        return dict(self.counts, peak_in_flight=self.peak_in_flight)
+
+    async def _handle(self, reader, writer):
+        try:
+            while True:
+                head = await reader.readuntil(b"\r\n\r\n")
+                request_line, *header_lines = head.decode("latin-1").split("\r\n")
+                method, path = request_line.split(" ")[:2]
+                length = 0
+                for line in header_lines:
+                    if line.lower().startswith("content-length:"):
+                        length = int(line.split(":", 1)[1])
+                body = await reader.readexactly(length) if length else b""
+                if method != "POST" or not re.search(r"/(chat/completions|messages)$", path):
+                    # Prewarm HEADs and anything else
+                    await self._respond(writer, 404, b"", method == "HEAD")
+                    continue
+                await self._complete(writer, path.endswith("/messages"), json.loads(body or b"{}"))
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def _complete(self, writer, anthropic, request):
+        self.counts["requests"] += 1
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        try:
+            scripted = self.responder(request, anthropic) if self.responder else None
+            if scripted:
+                status, text, latency = scripted
+            else:
+                latency = self.sample_latency(self.rng)
+                status = self.rng.choice(self.error_statuses) if self.rng.random() < self.error_rate else 200
+            if status != 200:
+                self.counts["errors"] += 1
+                await asyncio.sleep(latency if scripted else latency * 0.2)
+                error = {"error": {"type": "mock_error", "message": f"Mock provider error {status}"}}
+                await self._respond(writer, status, json.dumps(error).encode(), extra=[("retry-after", "1")]
+                                    if status == 429 else [])
+                return
+
+            if request.get("response_format") or request.get("tools"):
+                self.counts["structured"] += 1
+                if not scripted:
+                    text = json.dumps(CANNED_ANALYSIS)
+            elif not scripted:
+                partial = _resumed_reply(request)
+                # A continuation: carry on from where the cut-off reply stopped
+                text = next((output[len(partial):] for outputs in [[json.dumps(CANNED_ANALYSIS)], *self.outputs.values()]
+                             for output in outputs if partial and output.startswith(partial)), None)
+                if text is None:
+                    kind = "malformed" if self.rng.random() < self.malformed_rate else "valid"
+                    if kind == "malformed":
+                        self.counts["malformed"] += 1
+                    text = self.rng.choice(self.outputs[kind])
+            # Like a real model, stop at max_tokens (about 4 characters each)
+            limit = request.get("max_tokens")
+            truncated = bool(limit) and len(text) > limit * 4
+            if truncated:
+                self.counts["truncated"] += 1
+                text = text[:limit * 4]
+            prompt_tokens = len(json.dumps(request.get("messages", ""))) // 4 + len(str(request.get("system", ""))) // 4
+            usage = (prompt_tokens, len(text) // 4)
+            if request.get("stream"):
+                self.counts["streamed"] += 1
+                await self._stream(writer, anthropic, request, text, usage, latency, truncated)
+            else:
+                await asyncio.sleep(latency)
+                build = _anthropic_message if anthropic else _chat_completion
+                await self._respond(writer, 200, json.dumps(build(request, text, usage, truncated)).encode())
+        finally:
+            self.in_flight -= 1
+
+    async def _stream(self, writer, anthropic, request, text, usage, latency, truncated=False):
+        """Server-sent events, chunked; about a third of the latency passes before the first token"""
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nTransfer-Encoding: chunked\r\n\r\n")
+        await asyncio.sleep(latency * 0.3)
+        size = max(1, len(text) // self.stream_chunks)
+        pieces = [text[index:index + size] for index in range(0, len(text), size)]
+        gap = latency * 0.7 / len(pieces)
+        events = (_anthropic_events if anthropic else _chat_chunks)(request, pieces, usage, truncated)
+        for position, event in enumerate(events):
+            data = event.encode()
+            writer.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+            await writer.drain()
+            if 0 < position <= len(pieces):
+                await asyncio.sleep(gap)
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+
+    @staticmethod
+    async def _respond(writer, status, body, head_only=False, extra=()):
+        headers = [("Content-Type", "application/json"), ("Content-Length", str(len(body))), *extra]
+        writer.write(f"HTTP/1.1 {status} Mock\r\n".encode() +
+                     "".join(f"{name}: {value}\r\n" for name, value in headers).encode() + b"\r\n" +
+                     (b"" if head_only else body))
+        await writer.drain()
+
+def _resumed_reply(request):
+    """The cut-off reply a continuation request asks to resume, if it is one
+
+    Chat APIs get it back as an assistant turn followed by an instruction;
+    Anthropic gets it as a final, prefilled assistant turn.
+    """
+    messages = request.get("messages") or []
+    for message in reversed(messages[-2:]):
+        if message.get("role") == "assistant" and isinstance(message.get("content"), str):
+            return message["content"]
+    return None
+
+def _chat_completion(request, text, usage, truncated=False):
+    return {
+        "id": "chatcmpl-mock", "object": "chat.completion", "created": int(time.time()),
+        "model": request.get("model", "mock"),
+        "choices": [{"index": 0, "finish_reason": "length" if truncated else "stop",
+                     "message": {"role": "assistant", "content": text}}],
+        "usage": {"prompt_tokens": usage[0], "completion_tokens": usage[1], "total_tokens": sum(usage),
+                  "prompt_tokens_details": {"cached_tokens": 0}}
+    }
+
+def _chat_chunks(request, pieces, usage, truncated=False):
+    base = {"id": "chatcmpl-mock", "object": "chat.completion.chunk", "created": int(time.time()),
+            "model": request.get("model", "mock")}
+    events = [dict(base, choices=[{"index": 0, "delta": {"role": "assistant", "content": ""}}])]
+    events += [dict(base, choices=[{"index": 0, "delta": {"content": piece}}]) for piece in pieces]
+    events.append(dict(base, choices=[{"index": 0, "delta": {}, "finish_reason": "length" if truncated else "stop"}]))
+    if (request.get("stream_options") or {}).get("include_usage"):
+        events.append(dict(base, choices=[], usage={"prompt_tokens": usage[0], "completion_tokens": usage[1],
+                                                    "total_tokens": sum(usage)}))
+    return [f"data: {json.dumps(event)}\n\n" for event in events] + ["data: [DONE]\n\n"]
+
+def _anthropic_message(request, text, usage, truncated=False):
+    content, stop_reason = [{"type": "text", "text": text}], "max_tokens" if truncated else "end_turn"
+    tools = request.get("tools")
+    if tools and not truncated:
+        try:
+            content = [{"type": "tool_use", "id": "toolu_mock", "name": tools[0]["name"], "input": json.loads(text)}]
+            stop_reason = "tool_use"
+        except ValueError:
+            pass
+    return {
+        "id": "msg_mock", "type": "message", "role": "assistant", "model": request.get("model", "mock"),
+        "content": content, "stop_reason": stop_reason,
+        "stop_sequence": None,
+        "usage": {"input_tokens": usage[0], "output_tokens": usage[1],
+                  "cache_read_input_tokens": 0, "cache_creation_input_tokens": 0}
+    }
+
+def _anthropic_events(request, pieces, usage, truncated=False):
+    message = dict(_anthropic_message(request, "", (usage[0], 0)), content=[], stop_reason=None)
+    events = [("message_start", {"type": "message_start", "message": message}),
+              ("content_block_start", {"type": "content_block_start", "index": 0,
+                                       "content_block": {"type": "text", "text": ""}})]
+    events += [("content_block_delta", {"type": "content_block_delta", "index": 0,
+                                        "delta": {"type": "text_delta", "text": piece}}) for piece in pieces]
+    events += [("content_block_stop", {"type": "content_block_stop", "index": 0}),
+               ("message_delta", {"type": "message_delta",
+                                  "delta": {"stop_reason": "max_tokens" if truncated else "end_turn",
+                                            "stop_sequence": None},
+                                  "usage": {"output_tokens": usage[1]}}),
+               ("message_stop", {"type": "message_stop"})]
+    return [f"event: {name}\ndata: {json.dumps(data)}\n\n" for name, data in events]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--latency", default="0.5", help='e.g. "0.5", "uniform:0.2:1", "lognormal:0.8:0.4"')
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--error-statuses", default="500", help="comma-separated statuses to fail with")
+    parser.add_argument("--malformed-rate", type=float, default=0.0)
+    parser.add_argument("--stream-chunks", type=int, default=20)
+    parser.add_argument("--outputs", help='JSON file {"valid": [...], "malformed": [...]} replacing the canned texts')
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args()
+
+    outputs = None
+    if args.outputs:
+        with open(args.outputs, encoding="utf-8") as f:
+            outputs = json.load(f)
+    mock = MockProvider(args.latency, args.error_rate, [int(status) for status in args.error_statuses.split(",")],
+                        args.malformed_rate, args.stream_chunks, args.seed, outputs)
+    print(f"Mock provider on http://{args.host}:{args.port}", flush=True)
+    mock.serve(args.host, args.port)
+
+if __name__ == "__main__":
+    main()
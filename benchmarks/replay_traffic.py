@@ -0,0 +1,195 @@
+"""Replay captured /api/prompt/analyze traffic against a local instance
+
+Reads a capture written with CAPTURE_ENABLED=1 (see capture_util.py) and
+re-sends its requests with their recorded arrival times divided by
+--speed (1, 10, 100...). Upstream calls go to benchmarks/mock_provider.py,
+which answers each one with the response text, error and latency recorded
+for that request, so parsing, fallbacks and timing follow production. Calls
+the capture has no answer for (e.g. production hit the cache) get the
+mock's canned output. Reports the replayed latencies and statuses next to
+the recorded ones.
+
+    python benchmarks/replay_traffic.py instance/traffic_capture.jsonl [--speed 10] [--json out.json]
+
+With --target the requests go to an already running server, which must have
+its <PROVIDER>_BASE_URL overrides pointing at --mock-port.
+"""
+import argparse
+import json
+import os
+import re
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mock_provider import point_providers_at, MockProvider  # noqa: E402
+
+# Production-like caching, but nothing left over from earlier runs, and no re-capture
+os.environ.setdefault("ANALYSIS_CACHE_ENABLED", "1")
+os.environ.setdefault("NEAR_DUP_ENABLED", "1")
+os.environ.setdefault("ANALYSIS_STORE_ENABLED", "0")
+os.environ.setdefault("RATE_LIMIT_ENABLED", "0")
+os.environ.setdefault("HTTP_PREWARM", "0")
+os.environ.setdefault("CAPTURE_ENABLED", "0")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+from bench_analyze import make_client, percentile  # noqa: E402
+
+_STATUS = re.compile(r"\b([45]\d\d)\b")
+
+def load_capture(path):
+    """Captured records in arrival order; unreadable lines are skipped"""
+    records = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if isinstance(record, dict) and isinstance(record.get("request"), dict):
+                records.append(record)
+    records.sort(key=lambda record: record.get("ts", 0))
+    return records
+
+def upstream_response(call):
+    """(status, text, latency) the mock should answer a recorded upstream call with"""
+    latency = float(call.get("seconds") or 0)
+    if "error" in call:
+        error = call["error"]
+        status = _STATUS.search(error)
+        if status:
+            return int(status.group(1)), "", latency
+        return (504 if "timed out" in error.lower() or "timeout" in error.lower() else 500), "", latency
+    if "text" in call:
+        return 200, call["text"], latency
+    return None
+
+class ReplayResponder:
+    """Matches upstream calls to in-flight replayed requests by the prompt they carry
+
+    The analysis templates embed the prompt verbatim, so the longest
+    in-flight prompt found in the call's messages identifies the request;
+    its recorded calls are served in order, and a request that makes more
+    calls than were recorded (e.g. SDK retries) gets its last one again.
+    """
+
+    def __init__(self):
+        self._in_flight = {}
+        self._lock = threading.Lock()
+        self.matched = 0
+        self.unmatched = 0
+
+    def begin(self, token, record):
+        calls = deque(call for call in record.get("upstream", []) if upstream_response(call))
+        with self._lock:
+            self._in_flight[token] = {"prompt": str(record["request"].get("prompt", "")), "calls": calls, "last": None}
+
+    def end(self, token):
+        with self._lock:
+            self._in_flight.pop(token, None)
+
+    def __call__(self, request, anthropic):
+        contents = [str(request.get("system", ""))]
+        for message in request.get("messages", []):
+            content = message.get("content")
+            contents.append(content if isinstance(content, str) else json.dumps(content))
+        text = "\n".join(contents)
+        with self._lock:
+            entries = [entry for entry in self._in_flight.values() if entry["prompt"] and entry["prompt"] in text]
+            # Coalesced duplicates share a prompt; the one with recorded calls made them
+            entry = max(entries, key=lambda entry: (len(entry["prompt"]), bool(entry["calls"] or entry["last"])),
+                        default=None)
+            call = None
+            if entry is not None:
+                call = entry["calls"].popleft() if entry["calls"] else entry["last"]
+                entry["last"] = call
+            if call is None:
+                self.unmatched += 1
+                return None
+            self.matched += 1
+        return upstream_response(call)
+
+def summarize(outcomes, elapsed=None):
+    latencies = sorted(seconds for _, seconds in outcomes)
+    statuses = {}
+    for status, _ in outcomes:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    summary = {
+        "requests": len(outcomes),
+        "p50_s": round(percentile(latencies, 0.5), 3) if latencies else None,
+        "p95_s": round(percentile(latencies, 0.95), 3) if latencies else None,
+        "p99_s": round(percentile(latencies, 0.99), 3) if latencies else None,
+        "statuses": statuses
+    }
+    if elapsed:
+        summary["elapsed_s"] = round(elapsed, 3)
+        summary["throughput_rps"] = round(len(outcomes) / elapsed, 1)
+    return summary
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("capture", help="JSONL capture file")
+    parser.add_argument("--speed", type=float, default=1.0, help="arrival-rate multiplier, e.g. 1, 10 or 100")
+    parser.add_argument("--limit", type=int, help="replay only the first N requests")
+    parser.add_argument("--max-concurrency", type=int, default=256)
+    parser.add_argument("--target", help="base URL of a running server instead of the in-process app")
+    parser.add_argument("--mock-port", type=int, default=0, help="port for the mock provider (with --target)")
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--json", dest="json_path", help="also write results to this file")
+    args = parser.parse_args()
+
+    records = load_capture(args.capture)[:args.limit]
+    if not records:
+        sys.exit(f"No captured requests in {args.capture}")
+
+    responder = ReplayResponder()
+    mock = MockProvider(responder=responder, seed=1)
+    root = mock.start(port=args.mock_port)
+    if not args.target:
+        point_providers_at(root)
+        os.environ.setdefault("HTTP_POOL_SIZE", str(args.max_concurrency))
+    post, _ = make_client(args)
+
+    def one(token, record):
+        responder.begin(token, record)
+        started = time.perf_counter()
+        try:
+            status, _ = post(record.get("path", "/api/prompt/analyze"), record["request"])
+        finally:
+            responder.end(token)
+        return status, time.perf_counter() - started
+
+    first_ts = records[0].get("ts", 0)
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.max_concurrency) as pool:
+        futures = []
+        for token, record in enumerate(records):
+            delay = (record.get("ts", first_ts) - first_ts) / args.speed - (time.perf_counter() - started)
+            if delay > 0:
+                time.sleep(delay)
+            futures.append(pool.submit(one, token, record))
+        outcomes = [future.result() for future in futures]
+    elapsed = time.perf_counter() - started
+
+    recorded_span = records[-1].get("ts", first_ts) - first_ts
+    report = {
+        "capture": args.capture,
+        "speed": args.speed,
+        "recorded": summarize([(record.get("status"), record.get("seconds", 0)) for record in records],
+                              recorded_span or None),
+        "replayed": summarize(outcomes, elapsed),
+        "upstream": {"matched": responder.matched, "unmatched": responder.unmatched,
+                     "peak_in_flight": mock.peak_in_flight}
+    }
+    print(json.dumps(report))
+
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == "__main__":
+    main()
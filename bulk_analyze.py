@@ -0,0 +1,385 @@
+"""Offline bulk analyzer for whole prompt libraries
+
+    python bulk_analyze.py prompts.jsonl -o results.jsonl --provider groq --concurrency groq=8,openai=16
+
+Streams prompts from JSONL (one object per line, like requests.jsonl) or
+CSV, runs prompt_analysis on per-provider worker pools without going
+through HTTP, and appends one JSON line per prompt to the output as each
+finishes. Each record supplies its prompt (--prompt-field) and id
+(--id-field, else its position), and may override provider, model and
+style. API keys come from --api-key or <PROVIDER>_API_KEY.
+
+Progress is checkpointed to <output>.checkpoint; rerunning the same command
+after an interruption resumes where it stopped without duplicating output
+(--restart starts over). Rate limits, timeouts and server errors are retried
+with backoff (--retries); records still failing that way are left out of the
+output and the checkpoint, so the next run picks them up. Prints progress with an ETA while running, and a
+throughput and error summary at the end.
+"""
+import argparse
+import csv
+import json
+import logging
+import os
+import random
+import re
+import signal
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, wait
+
+from app_util import prompt_analysis, provider_requires_api_key, PROVIDER_CONFIGS
+from batch_util import parse_concurrency_limits, ProviderPools, BATCH_DEFAULT_CONCURRENCY
+from metrics_util import classify_error
+from token_util import output_token_budget
+
+# Fields tried, in order, when a record has no --prompt-field / --id-field
+PROMPT_FIELDS = ("prompt", "body", "text")
+ID_FIELDS = ("id", "request_id")
+# Error classes worth another attempt; any other error is final and recorded
+TRANSIENT_ERROR_CLASSES = ("rate_limit", "timeout", "connection", "server_error")
+
+def read_records(path, fmt=None):
+    """Yield (index, record) from a JSONL or CSV file, one at a time
+
+    Unparseable JSONL lines are yielded as {"_error": ...} so they get an
+    error result rather than silently vanishing.
+    """
+    fmt = fmt or ("csv" if path.lower().endswith(".csv") else "jsonl")
+    with open(path, encoding="utf-8", newline="") as f:
+        if fmt == "csv":
+            yield from enumerate(csv.DictReader(f))
+            return
+        index = 0
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                record = {"_error": f"Invalid JSON: {e}"}
+            yield index, record if isinstance(record, dict) else {"prompt": record}
+            index += 1
+
+def count_records(path, fmt=None):
+    """Number of records in path, for the ETA"""
+    return sum(1 for _ in read_records(path, fmt))
+
+def record_field(record, field, fallbacks):
+    """record[field], or the first of fallbacks present when field is not given"""
+    for name in ([field] if field else fallbacks):
+        value = record.get(name)
+        if value not in (None, ""):
+            return value
+    return None
+
+class Checkpoint:
+    """Which records are done and how much of the output holds their results
+
+    Everything below watermark is done, as are the indexes in done; results
+    past output_bytes were written after the last save and are truncated on
+    resume, because their records will run again.
+    """
+
+    def __init__(self, path, input_path, output_path):
+        self.path = path
+        self.input_path = os.path.abspath(input_path)
+        self.output_path = os.path.abspath(output_path)
+        self.watermark = 0
+        self.done = set()
+        self.output_bytes = 0
+        self.stats = {}
+
+    @classmethod
+    def load(cls, path, input_path, output_path):
+        checkpoint = cls(path, input_path, output_path)
+        if not os.path.exists(path):
+            return checkpoint
+        with open(path, encoding="utf-8") as f:
+            state = json.load(f)
+        if state.get("input") != checkpoint.input_path or state.get("output") != checkpoint.output_path:
+            raise SystemExit(f"{path} belongs to another run ({state.get('input')} -> {state.get('output')}); "
+                             f"use --restart to start over")
+        checkpoint.watermark = state["watermark"]
+        checkpoint.done = set(state["done"])
+        checkpoint.output_bytes = state["output_bytes"]
+        checkpoint.stats = state.get("stats", {})
+        return checkpoint
+
+    def is_done(self, index):
+        return index < self.watermark or index in self.done
+
+    def mark(self, index):
+        self.done.add(index)
+        while self.watermark in self.done:
+            self.done.discard(self.watermark)
+            self.watermark += 1
+
+    def save(self, output_bytes, stats):
+        """Write atomically, so an interruption leaves the previous checkpoint intact"""
+        self.output_bytes = output_bytes
+        state = {
+            "input": self.input_path,
+            "output": self.output_path,
+            "watermark": self.watermark,
+            "done": sorted(self.done),
+            "output_bytes": output_bytes,
+            "stats": stats
+        }
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(state, f)
+        os.replace(temp_path, self.path)
+
+def is_transient(result):
+    """Whether result is an error that a later attempt may not hit"""
+    return result["status"] == "error" and result.get("error_class") in TRANSIENT_ERROR_CLASSES
+
+def retry_delay(attempt, backoff, error):
+    """Seconds before retry number attempt: jittered exponential backoff, at least any "retry in Ns" hint"""
+    delay = backoff * 2 ** attempt * random.uniform(0.5, 1.0)
+    hint = re.search(r"retry in (\d+)s", str(error))
+    return max(delay, int(hint.group(1))) if hint else delay
+
+def analyze_record(index, record, args):
+    """Analyze one record; returns its output line as a dict"""
+    started = time.perf_counter()
+    record_id = record_field(record, args.id_field, ID_FIELDS)
+    provider = str(record.get("provider") or args.provider).lower().strip()
+    model = record.get("model") or args.model
+    style = record.get("style") or args.style
+    result = {"id": record_id if record_id is not None else index, "index": index, "provider": provider,
+              "model": model or PROVIDER_CONFIGS.get(provider, {}).get("default_model"), "style": style}
+
+    prompt = record_field(record, args.prompt_field, PROMPT_FIELDS)
+    if record.get("_error") or not prompt:
+        error = record.get("_error") or "Record has no prompt"
+        return dict(result, status="error", error=error, error_class="invalid", seconds=0.0)
+
+    api_key = args.api_key if provider == args.provider and args.api_key else \
+        os.getenv(f"{provider.upper()}_API_KEY") or args.api_key
+    max_tokens = output_token_budget(str(prompt), style, provider, model)
+    for attempt in range(args.retries + 1):
+        if attempt:
+            time.sleep(retry_delay(attempt - 1, args.retry_backoff, result["error"]))
+        score, analysis_result = prompt_analysis(str(prompt), api_key, args.temperature, max_tokens,
+                                                 provider, model, style, fallback=not args.no_fallback)
+        seconds = round(time.perf_counter() - started, 3)
+        if score != "Error":
+            return dict(result, status="ok", score=score, analysis=analysis_result, seconds=seconds,
+                        attempts=attempt + 1)
+        result = dict(result, status="error", error=str(analysis_result), error_class=classify_error(analysis_result),
+                      seconds=seconds, attempts=attempt + 1)
+        if not is_transient(result):
+            break
+    return result
+
+def _duration(seconds):
+    seconds = int(seconds)
+    return f"{seconds // 3600}h{seconds // 60 % 60:02d}m{seconds % 60:02d}s" if seconds >= 3600 else \
+        f"{seconds // 60}m{seconds % 60:02d}s"
+
+class Progress:
+    """Running totals, with a progress line on stderr every interval seconds"""
+
+    def __init__(self, total, interval, stats=None):
+        stats = stats or {}
+        self.total = total
+        self.interval = interval
+        self.started = time.perf_counter()
+        self.last_report = self.started
+        self.ok = self.errors = self.fallbacks = self.deferred = 0
+        self.completed = 0
+        self.resumed = stats.get("ok", 0) + stats.get("errors", 0)
+        self.error_classes = {}
+        self.previous = stats
+
+    def record(self, result, deferred=False):
+        self.completed += 1
+        if deferred:
+            self.deferred += 1
+        elif result["status"] == "ok":
+            self.ok += 1
+            if isinstance(result.get("analysis"), dict) and result["analysis"].get("parse_fallback"):
+                self.fallbacks += 1
+        else:
+            self.errors += 1
+            self.error_classes[result["error_class"]] = self.error_classes.get(result["error_class"], 0) + 1
+        now = time.perf_counter()
+        if now - self.last_report >= self.interval:
+            self.last_report = now
+            print(self.line(), file=sys.stderr, flush=True)
+
+    def rate(self):
+        elapsed = time.perf_counter() - self.started
+        return self.completed / elapsed if elapsed > 0 else 0.0
+
+    def line(self):
+        done = self.resumed + self.completed - self.deferred
+        rate = self.rate()
+        text = f"{done}" + (f"/{self.total} ({done / self.total:.1%})" if self.total else "") + \
+            f"  {rate:.1f}/s  errors {self.errors}" + (f"  deferred {self.deferred}" if self.deferred else "")
+        if self.total and rate > 0:
+            text += f"  ETA {_duration((self.total - done) / rate)}"
+        return text
+
+    def totals(self):
+        """Counts across this run and the runs it resumed, for the checkpoint"""
+        error_classes = dict(self.previous.get("error_classes", {}))
+        for error_class, count in self.error_classes.items():
+            error_classes[error_class] = error_classes.get(error_class, 0) + count
+        return {
+            "ok": self.previous.get("ok", 0) + self.ok,
+            "errors": self.previous.get("errors", 0) + self.errors,
+            "parse_fallbacks": self.previous.get("parse_fallbacks", 0) + self.fallbacks,
+            "error_classes": error_classes
+        }
+
+    def summary(self, interrupted=False):
+        elapsed = time.perf_counter() - self.started
+        totals = self.totals()
+        done = totals["ok"] + totals["errors"]
+        return {
+            "interrupted": interrupted,
+            "total": self.total,
+            "done": done,
+            "this_run": self.completed,
+            "resumed": self.resumed,
+            "ok": totals["ok"],
+            "errors": totals["errors"],
+            "error_rate": round(totals["errors"] / done, 4) if done else 0.0,
+            "deferred": self.deferred,
+            "parse_fallbacks": totals["parse_fallbacks"],
+            "error_classes": totals["error_classes"],
+            "elapsed_s": round(elapsed, 1),
+            "throughput_per_s": round(self.rate(), 2)
+        }
+
+def run(args):
+    checkpoint_path = args.checkpoint or f"{args.output}.checkpoint"
+    if args.restart:
+        for path in (checkpoint_path, args.output):
+            if os.path.exists(path):
+                os.remove(path)
+    if not os.path.exists(checkpoint_path) and os.path.exists(args.output) and os.path.getsize(args.output):
+        raise SystemExit(f"{args.output} already has results but no checkpoint; use --restart to overwrite it")
+    checkpoint = Checkpoint.load(checkpoint_path, args.input, args.output)
+    if checkpoint.watermark or checkpoint.done:
+        print(f"Resuming: {checkpoint.watermark + len(checkpoint.done)} records already done", file=sys.stderr)
+
+    total = None if args.no_count else count_records(args.input, args.format)
+    progress = Progress(total, args.progress_interval, checkpoint.stats)
+    pools = ProviderPools(parse_concurrency_limits(args.concurrency), args.default_concurrency)
+    max_pending = args.max_pending or 2 * sum(pools.limit(provider) for provider in PROVIDER_CONFIGS)
+
+    # Results past the last checkpoint belong to records that run again
+    output = open(args.output, "ab")
+    output.truncate(checkpoint.output_bytes)
+    output.seek(checkpoint.output_bytes)
+    pending = {}
+    since_save = 0
+    interrupted = False
+
+    def finish(futures):
+        nonlocal since_save
+        for future in futures:
+            index = pending.pop(future)
+            try:
+                result = future.result()
+            except Exception as e:
+                result = {"id": index, "index": index, "status": "error", "error": f"Internal error: {e}",
+                          "error_class": "other", "seconds": 0.0}
+            # Out of retries on a transient error: no output line, and the
+            # record stays undone so the next run tries it again
+            if is_transient(result):
+                progress.record(result, deferred=True)
+            else:
+                output.write((json.dumps(result, default=str) + "\n").encode("utf-8"))
+                checkpoint.mark(index)
+                progress.record(result)
+            since_save += 1
+        if since_save >= args.checkpoint_every:
+            output.flush()
+            checkpoint.save(output.tell(), progress.totals())
+            since_save = 0
+
+    def stop(signum, frame):
+        raise KeyboardInterrupt
+    signal.signal(signal.SIGTERM, stop)
+
+    try:
+        for index, record in read_records(args.input, args.format):
+            if checkpoint.is_done(index):
+                continue
+            if args.limit is not None and progress.completed + len(pending) >= args.limit:
+                break
+            provider = str(record.get("provider") or args.provider).lower().strip()
+            pool = pools.executor(provider if provider in PROVIDER_CONFIGS else "")
+            pending[pool.submit(analyze_record, index, record, args)] = index
+            # Bound what is in flight so memory stays flat however long the input is
+            while len(pending) >= max_pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                finish(done)
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            finish(done)
+    except KeyboardInterrupt:
+        interrupted = True
+        # Keep what has finished; records still in flight run again on resume
+        finish([future for future in list(pending) if future.done()])
+    finally:
+        output.flush()
+        checkpoint.save(output.tell(), progress.totals())
+        output.close()
+
+    summary = progress.summary(interrupted)
+    print(json.dumps(summary), flush=True)
+    if summary["deferred"]:
+        print(f"{summary['deferred']} records failed with transient errors; rerun the same command to retry them",
+              file=sys.stderr, flush=True)
+    if interrupted:
+        print(f"Interrupted; rerun the same command to resume from {checkpoint_path}", file=sys.stderr, flush=True)
+        # In-flight provider calls cannot be cancelled - do not wait them out
+        os._exit(130)
+    return summary
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("input", help="JSONL or CSV file of prompts")
+    parser.add_argument("-o", "--output", required=True, help="JSONL file results are appended to")
+    parser.add_argument("--format", choices=("jsonl", "csv"), help="input format (default: from the extension)")
+    parser.add_argument("--prompt-field", help=f"field holding the prompt (default: first of {', '.join(PROMPT_FIELDS)})")
+    parser.add_argument("--id-field", help=f"field holding the record id (default: first of {', '.join(ID_FIELDS)})")
+    parser.add_argument("--provider", default="groq")
+    parser.add_argument("--model")
+    parser.add_argument("--style", default="comprehensive", choices=("quick", "comprehensive", "detailed"))
+    parser.add_argument("--temperature", type=float, default=0.7)
+    parser.add_argument("--api-key", default=None, help="API key for --provider (default: <PROVIDER>_API_KEY)")
+    parser.add_argument("--concurrency", default=os.getenv("BATCH_PROVIDER_CONCURRENCY", ""),
+                        help='per-provider limits, e.g. "groq=8,openai=16"')
+    parser.add_argument("--default-concurrency", type=int, default=BATCH_DEFAULT_CONCURRENCY)
+    parser.add_argument("--max-pending", type=int, help="records queued or in flight at once")
+    parser.add_argument("--no-fallback", action="store_true", help="do not fall back to other providers on failure")
+    parser.add_argument("--retries", type=int, default=3,
+                        help="retries for rate-limited, timed-out and server-error records")
+    parser.add_argument("--retry-backoff", type=float, default=2.0, help="seconds before the first retry, doubling")
+    parser.add_argument("--checkpoint", help="checkpoint file (default: <output>.checkpoint)")
+    parser.add_argument("--checkpoint-every", type=int, default=100, help="results between checkpoints")
+    parser.add_argument("--restart", action="store_true", help="discard the checkpoint and output and start over")
+    parser.add_argument("--limit", type=int, help="analyze at most N more records")
+    parser.add_argument("--no-count", action="store_true", help="skip counting the input (no ETA)")
+    parser.add_argument("--progress-interval", type=float, default=10.0, help="seconds between progress lines")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=os.getenv("LOG_LEVEL", "WARNING").upper(),
+                        format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    args.provider = args.provider.lower().strip()
+    if args.provider not in PROVIDER_CONFIGS:
+        parser.error(f"unsupported provider {args.provider}; choose from {', '.join(PROVIDER_CONFIGS)}")
+    args.api_key = args.api_key or os.getenv(f"{args.provider.upper()}_API_KEY")
+    if not args.api_key and provider_requires_api_key(args.provider):
+        parser.error(f"--api-key or {args.provider.upper()}_API_KEY is required for {args.provider}")
+    run(args)
+
+if __name__ == "__main__":
+    main()
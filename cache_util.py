@@ -0,0 +1,575 @@
+import asyncio
+import json
+import logging
+import os
+import re
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy import Column, Float, Integer, MetaData, String, Table, Text, delete, func, select, text
+from sqlalchemy.exc import OperationalError
+
+from app_util import prompt_analysis, provider_requires_api_key, PROVIDER_CONFIGS
+from db_util import get_sqlite_engine
+from metrics_util import classify_error, METRICS
+from similarity_util import NEAR_DUP_ENABLED, NEAR_DUP_INDEX
+
+logger = logging.getLogger(__name__)
+
+# Result cache configuration
+ANALYSIS_CACHE_ENABLED = os.getenv("ANALYSIS_CACHE_ENABLED", "1") == "1"
+ANALYSIS_CACHE_MAX_ENTRIES = int(os.getenv("ANALYSIS_CACHE_MAX_ENTRIES", 2048))
+ANALYSIS_CACHE_MAX_BYTES = int(os.getenv("ANALYSIS_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+ANALYSIS_CACHE_TTL = float(os.getenv("ANALYSIS_CACHE_TTL", 3600))
+
+# Shared second tier - one SQLite file for every worker on the host
+ANALYSIS_STORE_ENABLED = os.getenv("ANALYSIS_STORE_ENABLED", "1") == "1"
+ANALYSIS_STORE_PATH = os.getenv("ANALYSIS_STORE_PATH", "instance/analysis_cache.db")
+ANALYSIS_STORE_MAX_ENTRIES = int(os.getenv("ANALYSIS_STORE_MAX_ENTRIES", 100000))
+ANALYSIS_STORE_MAX_BYTES = int(os.getenv("ANALYSIS_STORE_MAX_BYTES", 512 * 1024 * 1024))
+ANALYSIS_STORE_TTL = float(os.getenv("ANALYSIS_STORE_TTL", 7 * 24 * 3600))
+ANALYSIS_STORE_WARM_ENTRIES = int(os.getenv("ANALYSIS_STORE_WARM_ENTRIES", 512))
+
+_WHITESPACE = re.compile(r"\s+")
+
+def normalize_prompt(query):
+    """Normalize a prompt so trivially different resubmissions share a cache key"""
+    return _WHITESPACE.sub(" ", str(query)).strip()
+
+def make_cache_key(query, provider="groq", model=None, style="comprehensive", temp=0.7, max_token=1000):
+    """Build the cache key for one analysis request"""
+    provider = str(provider or "groq").lower().strip()
+    if not model:
+        model = PROVIDER_CONFIGS.get(provider, {}).get("default_model", "")
+    prompt_hash = hashlib.sha256(normalize_prompt(query).encode("utf-8")).hexdigest()
+    return f"{prompt_hash}:{provider}:{model}:{style}:{float(temp):g}:{int(max_token)}"
+
+def is_cacheable(score, analysis_result):
+    """Only successful, fully parsed analyses from the requested provider are worth replaying"""
+    if score == "Error" or not isinstance(analysis_result, dict):
+        return False
+    # A fallback leg's answer would outlive the outage under the primary's key
+    if analysis_result.get("served_by"):
+        return False
+    # A long prompt merged around failed or unparsed sections is only partly analyzed
+    long_prompt = analysis_result.get("long_prompt")
+    if isinstance(long_prompt, dict) and (long_prompt.get("failed") or long_prompt.get("parse_fallbacks")):
+        return False
+    return not analysis_result.get("parse_fallback") and not analysis_result.get("truncation_repaired")
+
+class ResultCache:
+    """Thread-safe LRU cache with a TTL, an entry limit and a byte budget"""
+
+    def __init__(self, max_entries=ANALYSIS_CACHE_MAX_ENTRIES, max_bytes=ANALYSIS_CACHE_MAX_BYTES, ttl=ANALYSIS_CACHE_TTL):
+        self.max_entries = max(1, int(max_entries))
+        self.max_bytes = max(1, int(max_bytes))
+        self.ttl = float(ttl)
+        self._entries = OrderedDict()  # key -> (expires_at, size, value)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """Return the cached value for key, or None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry[0] < time.monotonic():
+                self._remove(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[2]
+
+    def set(self, key, value):
+        """Store value under key, evicting least recently used entries to fit"""
+        size = len(json.dumps(value, default=str))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (time.monotonic() + self.ttl, size, value)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _remove(self, key):
+        """Drop one entry (lock held)"""
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+
+    def clear(self):
+        """Drop all entries"""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        """Counters for monitoring"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0
+            }
+
+RESULT_CACHE = ResultCache()
+
+class SharedResultStore:
+    """Size-bounded analysis cache in a WAL-mode SQLite file shared across workers"""
+
+    # Bounds are enforced every this many writes rather than on each one
+    TRIM_INTERVAL = 100
+    # Last-access stamps older than this are refreshed on read
+    TOUCH_INTERVAL = 60
+
+    def __init__(self, path=ANALYSIS_STORE_PATH, max_entries=ANALYSIS_STORE_MAX_ENTRIES,
+                 max_bytes=ANALYSIS_STORE_MAX_BYTES, ttl=ANALYSIS_STORE_TTL):
+        self.path = path
+        self.max_entries = max(1, int(max_entries))
+        self.max_bytes = max(1, int(max_bytes))
+        self.ttl = float(ttl)
+        self.metadata = MetaData()
+        self.table = Table(
+            "analysis_cache", self.metadata,
+            Column("key", String(255), primary_key=True),
+            Column("value", Text, nullable=False),
+            Column("size", Integer, nullable=False),
+            Column("expires_at", Float, nullable=False, index=True),
+            Column("last_access", Float, nullable=False, index=True)
+        )
+        self._engine = None
+        self._init_lock = threading.Lock()
+        self._writes = 0
+
+    @property
+    def engine(self):
+        """Engine, created with the schema on first use (after any fork)"""
+        if self._engine is None:
+            with self._init_lock:
+                if self._engine is None:
+                    engine = get_sqlite_engine(self.path)
+                    try:
+                        self.metadata.create_all(engine)
+                    except OperationalError:
+                        # Another worker created the table at the same moment
+                        self.metadata.create_all(engine)
+                    self._engine = engine
+        return self._engine
+
+    def get(self, key):
+        """Return the stored value for key, or None"""
+        now = time.time()
+        table = self.table
+        with self.engine.connect() as conn:
+            row = conn.execute(
+                select(table.c.value, table.c.last_access)
+                .where(table.c.key == key, table.c.expires_at > now)
+            ).first()
+            if row is None:
+                return None
+            if now - row.last_access > self.TOUCH_INTERVAL:
+                conn.execute(table.update().where(table.c.key == key).values(last_access=now))
+                conn.commit()
+        return _decode_entry(row.value)
+
+    def set(self, key, value):
+        """Store value under key"""
+        payload = json.dumps(value, default=str)
+        if len(payload) > self.max_bytes:
+            return
+        now = time.time()
+        with self.engine.begin() as conn:
+            conn.execute(
+                text(
+                    "INSERT OR REPLACE INTO analysis_cache (key, value, size, expires_at, last_access) "
+                    "VALUES (:key, :value, :size, :expires_at, :last_access)"
+                ),
+                {"key": key, "value": payload, "size": len(payload), "expires_at": now + self.ttl, "last_access": now}
+            )
+        self._writes += 1
+        if self._writes % self.TRIM_INTERVAL == 0:
+            self.trim()
+
+    def trim(self):
+        """Delete expired rows, then least recently used rows until within bounds"""
+        table = self.table
+        deleted = 0
+        with self.engine.begin() as conn:
+            deleted += conn.execute(delete(table).where(table.c.expires_at <= time.time())).rowcount
+            count, total_bytes = conn.execute(select(func.count(), func.coalesce(func.sum(table.c.size), 0))).one()
+            while count > self.max_entries or total_bytes > self.max_bytes:
+                # Remove at least the overflow, plus 10% headroom, oldest first
+                excess = max(count - self.max_entries, count // 10, 1)
+                oldest = select(table.c.key).order_by(table.c.last_access).limit(excess)
+                deleted += conn.execute(delete(table).where(table.c.key.in_(oldest))).rowcount
+                count, total_bytes = conn.execute(select(func.count(), func.coalesce(func.sum(table.c.size), 0))).one()
+        return deleted
+
+    def compact(self):
+        """Trim, then VACUUM the file and truncate the WAL"""
+        deleted = self.trim()
+        with self.engine.connect() as conn:
+            conn = conn.execution_options(isolation_level="AUTOCOMMIT")
+            conn.execute(text("VACUUM"))
+            conn.execute(text("PRAGMA wal_checkpoint(TRUNCATE)"))
+        return {"deleted": deleted, **self.stats()}
+
+    def recent(self, limit):
+        """Most recently used live entries, newest first, for warming a local tier"""
+        table = self.table
+        with self.engine.connect() as conn:
+            rows = conn.execute(
+                select(table.c.key, table.c.value)
+                .where(table.c.expires_at > time.time())
+                .order_by(table.c.last_access.desc())
+                .limit(limit)
+            ).all()
+        return [(row.key, _decode_entry(row.value)) for row in rows]
+
+    def stats(self):
+        """Row count and payload bytes"""
+        table = self.table
+        with self.engine.connect() as conn:
+            count, total_bytes = conn.execute(select(func.count(), func.coalesce(func.sum(table.c.size), 0))).one()
+        file_bytes = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+        return {"entries": count, "bytes": total_bytes, "file_bytes": file_bytes}
+
+def _decode_entry(payload):
+    """Stored entries are (score, analysis_result) pairs"""
+    score, analysis_result = json.loads(payload)
+    return score, analysis_result
+
+SHARED_STORE = SharedResultStore() if ANALYSIS_STORE_ENABLED else None
+
+def warm_result_cache(limit=ANALYSIS_STORE_WARM_ENTRIES):
+    """Preload the in-process cache from the shared store after a restart"""
+    if SHARED_STORE is None or not ANALYSIS_CACHE_ENABLED or limit <= 0:
+        return 0
+    try:
+        entries = SHARED_STORE.recent(limit)
+    except Exception as e:
+        logger.warning("Result cache warm start skipped: %s", e)
+        return 0
+    # Insert oldest first so the hottest entries end up most recently used
+    for key, value in reversed(entries):
+        RESULT_CACHE.set(key, value)
+    return len(entries)
+
+# Single-flight - concurrent identical analyses share one upstream call
+SINGLE_FLIGHT_ENABLED = os.getenv("SINGLE_FLIGHT_ENABLED", "1") == "1"
+
+# Error classes tied to the caller's own key; a waiter with a different key retries
+_CREDENTIAL_ERRORS = ("auth", "quota")
+
+class _Flight:
+    """One in-flight call and the callers waiting on it"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+class SingleFlight:
+    """Collapse concurrent calls with the same key into one
+
+    The first caller for a key runs the call; callers arriving while it is
+    in flight block and receive its result, or re-raise its exception.
+    Nothing is kept once the call finishes - that is the cache's job.
+    """
+
+    def __init__(self):
+        self._flights = {}
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.followers = 0
+
+    def do(self, key, fn):
+        """Return (fn(), shared) where shared is True when another caller's call was joined"""
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is None:
+                flight = self._flights[key] = _Flight()
+                self.leaders += 1
+                leader = True
+            else:
+                self.followers += 1
+                leader = False
+        METRICS.inc("prompt_analysis_singleflight_total", role="leader" if leader else "follower")
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result, True
+
+        try:
+            flight.result = fn()
+            return flight.result, False
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+
+    def stats(self):
+        with self._lock:
+            total = self.leaders + self.followers
+            return {
+                "in_flight": len(self._flights),
+                "leaders": self.leaders,
+                "followers": self.followers,
+                "coalescing_ratio": round(self.followers / total, 4) if total else 0.0
+            }
+
+class AsyncSingleFlight(SingleFlight):
+    """SingleFlight for coroutines on one event loop
+
+    The call runs as its own task, so a caller that is cancelled (say, a
+    dropped connection) does not cancel it for everyone else.
+    """
+
+    async def do(self, key, fn):
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            task = self._flights.get((loop, key))
+            leader = task is None
+            if leader:
+                task = self._flights[(loop, key)] = loop.create_task(fn())
+                task.add_done_callback(lambda _: self._forget((loop, key)))
+                self.leaders += 1
+            else:
+                self.followers += 1
+        METRICS.inc("prompt_analysis_singleflight_total", role="leader" if leader else "follower")
+        return await asyncio.shield(task), not leader
+
+    def _forget(self, flight_key):
+        with self._lock:
+            self._flights.pop(flight_key, None)
+
+SINGLE_FLIGHT = SingleFlight()
+ASYNC_SINGLE_FLIGHT = AsyncSingleFlight()
+
+def coalescing_stats():
+    """Leaders, followers and coalescing ratio across the sync and async paths"""
+    stats = [SINGLE_FLIGHT.stats(), ASYNC_SINGLE_FLIGHT.stats()]
+    leaders = sum(item["leaders"] for item in stats)
+    followers = sum(item["followers"] for item in stats)
+    return {
+        "in_flight": sum(item["in_flight"] for item in stats),
+        "leaders": leaders,
+        "followers": followers,
+        "coalescing_ratio": round(followers / (leaders + followers), 4) if leaders + followers else 0.0
+    }
+
+def _is_credential_error(score, analysis_result):
+    return score == "Error" and classify_error(analysis_result) in _CREDENTIAL_ERRORS
+
+def cached_prompt_analysis(query, api_key, temp, max_token, provider="groq", model=None, style="comprehensive",
+                           use_cache=True, hedge=None, approximate=False):
+    """prompt_analysis with result memoization and single-flight coalescing
+
+    Checks the in-process cache, then the shared store, then (when
+    approximate) the analysis of a near-duplicate prompt, then joins an
+    identical in-flight analysis if there is one. Returns (score,
+    analysis_result, cache_status) where cache_status is "HIT",
+    "HIT-SHARED", "NEAR-HIT", "MISS", "COALESCED" or "BYPASS".
+    """
+    # Local scoring is cheaper than a cache lookup
+    caching = use_cache and ANALYSIS_CACHE_ENABLED and provider_requires_api_key(provider)
+    key = make_cache_key(query, provider, model, style, temp, max_token)
+    if caching:
+        cached, cache_status = lookup_cached_analysis(key)
+        if cached is not None:
+            return cached[0], cached[1], cache_status
+        if approximate:
+            near = near_duplicate_analysis(query, api_key, temp, max_token, provider, model, style, key)
+            if near is not None:
+                return near[0], near[1], "NEAR-HIT"
+
+    def analyze():
+        score, analysis_result = prompt_analysis(query, api_key, temp, max_token, provider, model, style, hedge=hedge)
+        if caching:
+            store_analysis(key, score, analysis_result, query, api_key)
+        return score, analysis_result
+
+    miss_status = "MISS" if caching else "BYPASS"
+    if not SINGLE_FLIGHT_ENABLED:
+        return (*analyze(), miss_status)
+
+    # Cached and uncached requests never share a flight - only one of them stores
+    (score, analysis_result), shared = SINGLE_FLIGHT.do((key, caching), analyze)
+    if shared and _is_credential_error(score, analysis_result):
+        # The leader's key was refused; this caller's own key may not be
+        return (*analyze(), miss_status)
+    return score, analysis_result, "COALESCED" if shared else miss_status
+
+async def async_cached_prompt_analysis(query, api_key, temp, max_token, provider="groq", model=None,
+                                       style="comprehensive", use_cache=True, hedge=None, approximate=False):
+    """cached_prompt_analysis for the async serving mode
+
+    Shared-store reads and writes run on a worker thread so SQLite never
+    blocks the event loop.
+    """
+    # Imported here so the sync app never needs the async stack (httpx)
+    from async_util import async_prompt_analysis
+
+    # Local scoring is cheaper than a cache lookup
+    caching = use_cache and ANALYSIS_CACHE_ENABLED and provider_requires_api_key(provider)
+    key = make_cache_key(query, provider, model, style, temp, max_token)
+    if caching:
+        cached = RESULT_CACHE.get(key)
+        if cached is not None:
+            return cached[0], cached[1], "HIT"
+        if SHARED_STORE is not None:
+            cached, cache_status = await asyncio.to_thread(lookup_cached_analysis, key)
+            if cached is not None:
+                return cached[0], cached[1], cache_status
+        if approximate:
+            args = (query, api_key, temp, max_token, provider, model, style, key)
+            near = await asyncio.to_thread(near_duplicate_analysis, *args) if SHARED_STORE is not None \
+                else near_duplicate_analysis(*args)
+            if near is not None:
+                return near[0], near[1], "NEAR-HIT"
+
+    async def analyze():
+        score, analysis_result = await async_prompt_analysis(query, api_key, temp, max_token, provider, model, style,
+                                                             hedge=hedge)
+        if caching and is_cacheable(score, analysis_result):
+            await asyncio.to_thread(store_analysis, key, score, analysis_result, query, api_key)
+        return score, analysis_result
+
+    miss_status = "MISS" if caching else "BYPASS"
+    if not SINGLE_FLIGHT_ENABLED:
+        return (*await analyze(), miss_status)
+
+    (score, analysis_result), shared = await ASYNC_SINGLE_FLIGHT.do((key, caching), analyze)
+    if shared and _is_credential_error(score, analysis_result):
+        return (*await analyze(), miss_status)
+    return score, analysis_result, "COALESCED" if shared else miss_status
+
+def lookup_cached_analysis(key):
+    """Look key up in both tiers; returns ((score, analysis_result), cache_status) or (None, "MISS")"""
+    cached = RESULT_CACHE.get(key)
+    if cached is not None:
+        return cached, "HIT"
+
+    shared = _shared_store_call("get", key)
+    if shared is not None:
+        RESULT_CACHE.set(key, shared)
+        return shared, "HIT-SHARED"
+    return None, "MISS"
+
+def store_analysis(key, score, analysis_result, query=None, api_key=None):
+    """Write a fresh analysis through both tiers when it is worth caching
+
+    With query, the prompt is also indexed for near-duplicate lookups by
+    callers with the same api_key.
+    """
+    if is_cacheable(score, analysis_result):
+        # Which hedge leg won and what the call cost are per-request detail, not part of the analysis
+        analysis_result = {key: value for key, value in analysis_result.items() if key not in ("hedge", "usage")}
+        RESULT_CACHE.set(key, (score, analysis_result))
+        _shared_store_call("set", key, (score, analysis_result))
+        if query is not None and NEAR_DUP_ENABLED:
+            NEAR_DUP_INDEX.add(query, key, _key_namespace(key, api_key))
+
+# Near-duplicate reuse - an approximate answer can be refreshed with a full
+# analysis in the background so the next identical request is an exact hit
+NEAR_DUP_REFRESH = os.getenv("NEAR_DUP_REFRESH", "1") == "1"
+NEAR_DUP_REFRESH_WORKERS = int(os.getenv("NEAR_DUP_REFRESH_WORKERS", 4))
+NEAR_DUP_REFRESH_MAX_PENDING = int(os.getenv("NEAR_DUP_REFRESH_MAX_PENDING", 64))
+
+_refresh_executor = None
+_refresh_lock = threading.Lock()
+_refreshing = set()
+
+def _key_namespace(key, api_key=None):
+    """The caller's API key hash and everything in a cache key but the prompt hash
+
+    Only analyses in one namespace are interchangeable, and one caller
+    never receives an analysis of another caller's prompt.
+    """
+    caller = hashlib.sha256(str(api_key or "").encode("utf-8")).hexdigest()[:16]
+    return f"{caller}:{key.partition(':')[2]}"
+
+def near_duplicate_analysis(query, api_key, temp, max_token, provider, model, style, key):
+    """The cached analysis of a near-identical prompt, flagged as approximate, or None
+
+    key is query's own cache key. The neighbour's scores and findings are
+    reused, but its rewrite is not - new_prompt is query itself until the
+    full analysis arrives. When NEAR_DUP_REFRESH is on, that analysis is
+    queued in the background.
+    """
+    if not NEAR_DUP_ENABLED:
+        return None
+    match = NEAR_DUP_INDEX.lookup(query, _key_namespace(key, api_key), exclude=key)
+    if match is None:
+        return None
+    neighbor_key, similarity = match
+    cached, _ = lookup_cached_analysis(neighbor_key)
+    if cached is None:
+        # The neighbour's analysis has expired from both tiers
+        NEAR_DUP_INDEX.discard(neighbor_key)
+        return None
+    refreshing = NEAR_DUP_REFRESH and _refresh_in_background(
+        query, api_key, temp, max_token, provider, model, style, key
+    )
+    score, analysis_result = cached
+    return score, dict(analysis_result, new_prompt=query,
+                       approximate={"similarity": round(similarity, 3), "refreshing": refreshing, "rewrite": False})
+
+def _refresh_in_background(query, api_key, temp, max_token, provider, model, style, key):
+    """Queue a full analysis of query; False when one is already queued or the queue is full"""
+    global _refresh_executor
+    with _refresh_lock:
+        if key in _refreshing or len(_refreshing) >= NEAR_DUP_REFRESH_MAX_PENDING:
+            return False
+        _refreshing.add(key)
+        if _refresh_executor is None:
+            _refresh_executor = ThreadPoolExecutor(max_workers=max(1, NEAR_DUP_REFRESH_WORKERS),
+                                                   thread_name_prefix="near-dup-refresh")
+
+    def analyze():
+        score, analysis_result = prompt_analysis(query, api_key, temp, max_token, provider, model, style)
+        store_analysis(key, score, analysis_result, query, api_key)
+        return score, analysis_result
+
+    def refresh():
+        try:
+            # Joins a foreground analysis of the same prompt if one is running
+            SINGLE_FLIGHT.do((key, True), analyze)
+        except Exception as e:
+            logger.warning("Near-duplicate refresh failed: %s", e)
+        finally:
+            with _refresh_lock:
+                _refreshing.discard(key)
+
+    _refresh_executor.submit(refresh)
+    return True
+
+def _shared_store_call(method, *args):
+    """Call the shared store, treating any storage failure as a miss"""
+    if SHARED_STORE is None:
+        return None
+    try:
+        return getattr(SHARED_STORE, method)(*args)
+    except Exception as e:
+        logger.warning("Shared result store %s failed: %s", method, e)
+        return None
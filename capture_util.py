@@ -0,0 +1,120 @@
+import contextvars
+import hashlib
+import json
+import logging
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Traffic capture - a sample of /api/prompt/analyze requests is appended to
+# a JSONL file with API keys redacted, together with each upstream call's
+# raw response text and timing, for benchmarks/replay_traffic.py
+CAPTURE_ENABLED = os.getenv("CAPTURE_ENABLED", "0") == "1"
+CAPTURE_SAMPLE_RATE = float(os.getenv("CAPTURE_SAMPLE_RATE", 0.01))
+CAPTURE_PATH = os.getenv("CAPTURE_PATH", "instance/traffic_capture.jsonl")
+
+# Request fields holding credentials, at the top level and inside "hedge"
+REDACTED_FIELDS = ("api_key",)
+
+# The capture record of the request, and the upstream call, in progress
+_current_capture = contextvars.ContextVar("traffic_capture", default=None)
+_current_call = contextvars.ContextVar("traffic_capture_call", default=None)
+
+def redact_key(api_key):
+    """Stable stand-in for an API key: requests sharing a key still share one after redaction"""
+    if not api_key:
+        return api_key
+    return "redacted-" + hashlib.sha256(str(api_key).encode()).hexdigest()[:12]
+
+def redact_request(data):
+    """Copy of a request body with its credentials replaced"""
+    redacted = dict(data)
+    for field in REDACTED_FIELDS:
+        if field in redacted:
+            redacted[field] = redact_key(redacted[field])
+    if isinstance(redacted.get("hedge"), dict):
+        redacted["hedge"] = redact_request(redacted["hedge"])
+    return redacted
+
+class TrafficCapture:
+    """Sampled, append-only JSONL recorder of analysis requests"""
+
+    def __init__(self, path=CAPTURE_PATH, sample_rate=CAPTURE_SAMPLE_RATE, enabled=CAPTURE_ENABLED):
+        self.path = path
+        self.sample_rate = float(sample_rate)
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self.captured = 0
+
+    @contextmanager
+    def request(self, data, path="/api/prompt/analyze"):
+        """Capture one request if it is sampled; yields its record, or None
+
+        The caller fills in "status" (and "cache") before the block ends;
+        upstream calls made inside the block are added as they finish.
+        """
+        if not self.enabled or not isinstance(data, dict) or random.random() >= self.sample_rate:
+            yield None
+            return
+        record = {"ts": round(time.time(), 3), "path": path, "request": redact_request(data), "upstream": []}
+        token = _current_capture.set(record)
+        started = time.perf_counter()
+        try:
+            yield record
+        finally:
+            _current_capture.reset(token)
+            record["seconds"] = round(time.perf_counter() - started, 4)
+            self._write(record)
+
+    def _write(self, record):
+        try:
+            line = json.dumps(record, default=str) + "\n"
+            with self._lock:
+                directory = os.path.dirname(self.path)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(line)
+                self.captured += 1
+        except Exception as e:
+            logger.warning("Traffic capture write failed: %s", e)
+
+TRAFFIC_CAPTURE = TrafficCapture()
+
+@contextmanager
+def capture_upstream(provider, model):
+    """Record the provider call made inside the block on the captured request, if any"""
+    record = _current_capture.get()
+    if record is None:
+        yield
+        return
+    call = {"provider": provider, "model": model}
+    token = _current_call.set(call)
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        _current_call.reset(token)
+        call["seconds"] = round(time.perf_counter() - started, 4)
+        record["upstream"].append(call)
+
+def note_upstream_text(text):
+    """Keep the raw response text of the upstream call in progress"""
+    call = _current_call.get()
+    if call is not None:
+        call["text"] = text
+
+def note_upstream_result(result):
+    """Keep the outcome of the upstream call in progress: its error, or its token usage"""
+    call = _current_call.get()
+    if call is None:
+        return
+    score, analysis_result = result
+    if score == "Error":
+        call["error"] = str(analysis_result)
+    elif isinstance(analysis_result, dict) and analysis_result.get("usage"):
+        call["usage"] = analysis_result["usage"]
@@ -0,0 +1,39 @@
+import os
+import threading
+
+from sqlalchemy import create_engine, event
+
+_engines = {}
+_engines_lock = threading.Lock()
+
+def get_sqlite_engine(path):
+    """Get a process-wide SQLAlchemy engine for a SQLite file in WAL mode
+
+    WAL lets every gunicorn worker on the host read while one writes, so the
+    same file can back caches and queues shared across workers. Engines are
+    created lazily so each forked worker opens its own connections.
+    """
+    path = os.path.abspath(path)
+    engine = _engines.get(path)
+    if engine is not None:
+        return engine
+
+    with _engines_lock:
+        engine = _engines.get(path)
+        if engine is None:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            engine = create_engine(
+                f"sqlite:///{path}",
+                connect_args={"check_same_thread": False, "timeout": 10}
+            )
+            event.listen(engine, "connect", _configure_sqlite_connection)
+            _engines[path] = engine
+    return engine
+
+def _configure_sqlite_connection(dbapi_connection, connection_record):
+    """Per-connection pragmas for concurrent multi-process access"""
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA busy_timeout=10000")
+    cursor.close()
@@ -0,0 +1,221 @@
+import os
+import re
+
+# Version tag reported as the "model" of the local provider
+HEURISTIC_MODEL = "heuristic-v1"
+
+# Send a local analysis as the first event of every provider stream
+HEURISTIC_PRELIMINARY = os.getenv("HEURISTIC_PRELIMINARY", "1") == "1"
+
+# Dimension maxima, matching the scoring rubric the LLM templates use
+DIMENSION_MAX = {
+    "clarity": 25,
+    "context": 20,
+    "structure": 20,
+    "role": 15,
+    "constraints": 10,
+    "advanced": 10,
+}
+
+# Lexical and structural features - each pattern is counted once per prompt
+_I = re.IGNORECASE
+_M = re.MULTILINE
+FEATURE_PATTERNS = {
+    "role": re.compile(r"\b(?:you are|act as|acting as|pretend to be|take the role|your role|role\s*:|persona"
+                       r"|as an? (?:expert|senior|professional|experienced|specialist|\w+ (?:expert|engineer|"
+                       r"writer|teacher|analyst|consultant|developer|designer|scientist|editor|coach)))\b", _I),
+    "task_verb": re.compile(r"^\s*(?:please\s+)?(?:write|explain|create|generate|summari[sz]e|analy[sz]e|list|describe"
+                            r"|compare|draft|design|build|implement|translate|classify|extract|review|rewrite|outline"
+                            r"|evaluate|plan|suggest|give|find|identify|calculate|convert|answer)\b", _I | _M),
+    "question": re.compile(r"\?"),
+    "vague": re.compile(r"\b(?:something|stuff|things?|etc|whatever|somehow|some kind of|anything|good|nice|better)\b", _I),
+    "specific": re.compile(r"\b\d+\b|\"[^\"]{2,}\"|'[^']{2,}'|`[^`]+`"),
+    "context": re.compile(r"\b(?:context|background|audience|reader|users?|customers?|stakeholders?|purpose|goal"
+                          r"|objective|because|so that|in order to|given that|for (?:beginners|experts|children|kids"
+                          r"|students|developers|managers|executives|a \w+ audience)|\d+[- ]years?[- ]olds?|currently|our|we are"
+                          r"|i am|i'm)\b", _I),
+    "heading": re.compile(r"^\s*(?:#{1,6}\s+\S|[A-Z][A-Za-z /&-]{2,40}:\s*$)", _M),
+    "bullet": re.compile(r"^\s*(?:[-*•]|\d+[.)])\s+\S", _M),
+    "delimiter": re.compile(r"```|\"\"\"|<\w+>|</\w+>|^-{3,}$", _M),
+    "format": re.compile(r"\b(?:format|json|yaml|xml|csv|table|markdown|bullet(?:ed)? (?:points?|list)|numbered list"
+                         r"|headings?|sections?|paragraphs?|respond (?:with|in|only)|output|return (?:only|a|the)"
+                         r"|template|schema)\b", _I),
+    "constraint": re.compile(r"\b(?:must|should|shall|do not|don't|never|avoid|only|exactly|at (?:most|least)"
+                             r"|no more than|fewer than|less than|limit(?:ed)? to|within|without|maximum|minimum"
+                             r"|required?|ensure|make sure)\b", _I),
+    "length": re.compile(r"\b\d+\s*(?:words?|sentences?|paragraphs?|lines?|characters?|bullets?|items?|pages?"
+                         r"|tokens?)\b", _I),
+    "tone": re.compile(r"\b(?:tone|style|formal|informal|friendly|concise|professional|casual|technical|simple"
+                       r"|plain language|voice)\b", _I),
+    "reasoning": re.compile(r"\b(?:step[- ]by[- ]step|think (?:through|carefully|about)|reason(?:ing)?|explain your"
+                            r"|chain of thought|first,|then,|finally,|break (?:it|this) down)\b", _I),
+    "examples": re.compile(r"\b(?:for example|e\.g\.|such as|example\s*\d*\s*:|examples?\s*:)|^\s*(?:input|output|q|a"
+                           r"|user|assistant)\s*:", _I | _M),
+    "verification": re.compile(r"\b(?:verify|double[- ]check|validate|self[- ]check|review your|reflect|critique"
+                               r"|confidence|if (?:you are )?(?:unsure|uncertain)|cite|sources?)\b", _I),
+}
+
+# Role guesses for the rewrite, tried in order against the prompt
+_ROLE_GUESSES = [
+    (re.compile(r"\b(?:code|function|python|javascript|sql|api|bug|program|script|class)\b", _I),
+     "a senior software engineer who writes clean, well-tested code"),
+    (re.compile(r"\b(?:poem|story|essay|blog|article|novel|lyrics|script|copy)\b", _I),
+     "an experienced writer and editor"),
+    (re.compile(r"\b(?:data|analy[sz]e|statistics?|metrics?|chart|dataset|trend)\b", _I),
+     "a careful data analyst"),
+    (re.compile(r"\b(?:market|marketing|sales|brand|campaign|customers?|product)\b", _I),
+     "a marketing strategist"),
+    (re.compile(r"\b(?:explain|teach|learn|lesson|student|understand|concept)\b", _I),
+     "a patient teacher who explains ideas clearly"),
+    (re.compile(r"\b(?:health|medical|symptoms?|diet|fitness)\b", _I),
+     "a knowledgeable health educator"),
+    (re.compile(r"\b(?:legal|contract|law|policy|compliance)\b", _I),
+     "a legal analyst"),
+]
+_DEFAULT_ROLE = "an expert in the subject of this request"
+
+# Per-dimension feedback, chosen from how much of the dimension's maximum was scored
+_FEEDBACK = {
+    "clarity": ("States the task directly and specifically",
+                "The task is vague or not stated as a clear instruction",
+                "Open with one direct instruction and replace vague words with specifics"),
+    "context": ("Gives background on the audience or purpose",
+                "Little context about the audience, purpose or situation",
+                "Say who the output is for and what it will be used for"),
+    "structure": ("Organized into sections, lists or delimited blocks",
+                  "Written as one unstructured block",
+                  "Split the prompt into labelled sections (role, task, context, output format)"),
+    "role": ("Defines a role or persona for the model",
+             "No role or persona is defined",
+             "Start with a role, e.g. \"You are an experienced ...\""),
+    "constraints": ("Sets explicit constraints or an output format",
+                    "No constraints, length limits or output format",
+                    "Specify the output format, length and anything to avoid"),
+    "advanced": ("Uses examples or reasoning guidance",
+                 "No examples, reasoning steps or self-checks",
+                 "Add an example of the expected output or ask for step-by-step reasoning"),
+}
+
+# Feedback items per list, by analysis style
+_FEEDBACK_ITEMS = {"quick": 2, "comprehensive": 3, "detailed": 4}
+
+def extract_features(prompts):
+    """Feature columns for a batch: {feature: [count per prompt]} plus word and line counts
+
+    Features are computed column by column over the whole batch, one
+    precompiled pattern at a time.
+    """
+    features = {name: [len(pattern.findall(text)) for text in prompts] for name, pattern in FEATURE_PATTERNS.items()}
+    features["words"] = [len(text.split()) for text in prompts]
+    features["lines"] = [sum(1 for line in text.splitlines() if line.strip()) for text in prompts]
+    return features
+
+def _saturate(value, full):
+    """0..1, reaching 1 once value reaches full"""
+    return min(1.0, value / full) if full > 0 else 0.0
+
+def _scale(fraction, maximum):
+    """Map a 0..1 fraction onto a dimension's 1..maximum range"""
+    return 1 + int(round((maximum - 1) * max(0.0, min(1.0, fraction))))
+
+def score_features(features):
+    """Per-prompt dimension scores [{"clarity": n, ...}] from extract_features() columns"""
+    columns = zip(*(features[name] for name in (
+        "task_verb", "question", "vague", "specific", "context", "heading", "bullet", "delimiter", "format",
+        "constraint", "length", "tone", "reasoning", "examples", "verification", "role", "words", "lines"
+    )))
+    scores = []
+    for (task_verb, question, vague, specific, context, heading, bullet, delimiter, fmt,
+         constraint, length, tone, reasoning, examples, verification, role, words, lines) in columns:
+        # Very short prompts cannot be clear about much; very long ones get no extra credit
+        detail = _saturate(words, 60)
+        clarity = (0.35 * min(1, task_verb + question) + 0.3 * detail + 0.2 * _saturate(specific, 3)
+                   + 0.15 * (1 - _saturate(vague, 4)))
+        context_fraction = 0.6 * _saturate(context, 4) + 0.4 * _saturate(words, 120)
+        structure = (0.35 * _saturate(heading, 3) + 0.35 * _saturate(bullet, 4) + 0.15 * min(1, delimiter)
+                     + 0.15 * _saturate(lines, 6))
+        role_fraction = _saturate(role, 1) * (0.7 + 0.3 * detail)
+        constraints = 0.4 * _saturate(constraint, 4) + 0.3 * _saturate(fmt, 2) + 0.2 * min(1, length) + 0.1 * min(1, tone)
+        advanced = 0.45 * _saturate(examples, 2) + 0.35 * _saturate(reasoning, 2) + 0.2 * min(1, verification)
+        scores.append({
+            "clarity": _scale(clarity, DIMENSION_MAX["clarity"]),
+            "context": _scale(context_fraction, DIMENSION_MAX["context"]),
+            "structure": _scale(structure, DIMENSION_MAX["structure"]),
+            "role": _scale(role_fraction, DIMENSION_MAX["role"]),
+            "constraints": _scale(constraints, DIMENSION_MAX["constraints"]),
+            "advanced": _scale(advanced, DIMENSION_MAX["advanced"]),
+        })
+    return scores
+
+def analyze_prompts(prompts, style="comprehensive"):
+    """Score a batch of prompts locally; returns [(score, analysis_result)] in input order
+
+    analysis_result has the same shape as a parsed provider response
+    (overall_score, detailed_scores, strengths, weaknesses, improvements,
+    new_prompt, reasoning), so callers cannot tell the paths apart.
+    """
+    prompts = [str(prompt or "") for prompt in prompts]
+    features = extract_features(prompts)
+    results = []
+    for index, (prompt, detailed) in enumerate(zip(prompts, score_features(features))):
+        overall = sum(detailed.values())
+        strengths, weaknesses, improvements = _feedback(detailed, style)
+        results.append((overall, {
+            "overall_score": overall,
+            "detailed_scores": detailed,
+            "strengths": strengths,
+            "weaknesses": weaknesses,
+            "improvements": improvements,
+            "new_prompt": _rewrite(prompt, detailed, features["format"][index], features["length"][index]),
+            "reasoning": "Scored locally from lexical and structural features (role markers, output-format "
+                         "specs, constraint phrases, sections and examples); no model was called.",
+            "heuristic": True
+        }))
+    return results
+
+def analyze_prompt(prompt, style="comprehensive"):
+    """Score one prompt locally; returns (score, analysis_result)"""
+    return analyze_prompts([prompt], style)[0]
+
+def _feedback(detailed, style):
+    """Strengths, weaknesses and improvements, strongest and weakest dimensions first"""
+    items = _FEEDBACK_ITEMS.get(style, _FEEDBACK_ITEMS["comprehensive"])
+    ranked = sorted(detailed, key=lambda name: detailed[name] / DIMENSION_MAX[name])
+    strengths = [_FEEDBACK[name][0] for name in reversed(ranked) if detailed[name] / DIMENSION_MAX[name] >= 0.6]
+    weak = [name for name in ranked if detailed[name] / DIMENSION_MAX[name] < 0.4]
+    if not strengths:
+        strengths = ["States a request that can be built on"]
+    if not weak:
+        return strengths[:items], [f"No major gaps; {ranked[0]} is the least developed dimension"], \
+            [_FEEDBACK[ranked[0]][2]]
+    return (strengths[:items], [_FEEDBACK[name][1] for name in weak][:items],
+            [_FEEDBACK[name][2] for name in weak][:items])
+
+def _rewrite(prompt, detailed, format_mentions, length_mentions):
+    """Restructure the prompt, adding only the sections its weak dimensions are missing"""
+    task = prompt.strip()
+    sections = []
+    if detailed["role"] / DIMENSION_MAX["role"] < 0.6:
+        role = next((description for pattern, description in _ROLE_GUESSES if pattern.search(task)), _DEFAULT_ROLE)
+        sections.append(f"# Role\nYou are {role}.")
+    sections.append(f"# Task\n{task}")
+    if detailed["context"] / DIMENSION_MAX["context"] < 0.6:
+        sections.append("# Context\n- Audience: [who will read or use the result]\n"
+                        "- Purpose: [what the result will be used for]\n- Background: [relevant facts or constraints]")
+    requirements = []
+    if detailed["clarity"] / DIMENSION_MAX["clarity"] < 0.6:
+        requirements.append("Be specific and concrete; avoid generic statements")
+    if detailed["constraints"] / DIMENSION_MAX["constraints"] < 0.6:
+        if not length_mentions:
+            requirements.append("Keep the response to [length, e.g. 200 words]")
+        requirements.append("Use a [tone, e.g. professional and friendly] tone")
+        requirements.append("Do not include [anything to leave out]")
+    if requirements:
+        sections.append("# Requirements\n" + "\n".join(f"- {item}" for item in requirements))
+    if not format_mentions:
+        sections.append("# Output format\nPresent the answer as [format, e.g. a short introduction followed by "
+                        "a bulleted list], with clear headings where useful.")
+    if detailed["advanced"] / DIMENSION_MAX["advanced"] < 0.6:
+        sections.append("# Approach\nThink through the request step by step before answering, then check the "
+                        "result against the requirements above.")
+    return "\n\n".join(sections)
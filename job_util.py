@@ -0,0 +1,332 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+
+from sqlalchemy import Column, Float, Integer, MetaData, String, Table, Text, delete, func, select
+from sqlalchemy.exc import OperationalError
+
+from capture_util import redact_request
+from db_util import get_sqlite_engine
+from metrics_util import METRICS
+
+logger = logging.getLogger(__name__)
+
+# Job queue - POST /api/jobs queues an analysis in a SQLite file shared by
+# every worker on the host, and a pool of threads per process runs them
+JOB_QUEUE_PATH = os.getenv("JOB_QUEUE_PATH", "instance/jobs.db")
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", 4))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", 3))
+JOB_RETRY_BASE_DELAY = float(os.getenv("JOB_RETRY_BASE_DELAY", 2.0))
+JOB_RETRY_MAX_DELAY = float(os.getenv("JOB_RETRY_MAX_DELAY", 60.0))
+# A running job whose worker has not finished it by then (say, the process
+# died) is picked up again by another worker
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", 300))
+JOB_RESULT_TTL = float(os.getenv("JOB_RESULT_TTL", 24 * 3600))
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", 0.5))
+JOB_LONG_POLL_MAX = float(os.getenv("JOB_LONG_POLL_MAX", 30))
+
+# Outcomes worth another attempt: rate limits, open circuits and provider-side failures
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+FINISHED_STATUSES = ("succeeded", "failed")
+
+def dedup_key(data, identity):
+    """Key under which identical submissions share one job
+
+    identity is the request's cache key; the caller's API key and hedge are
+    folded in so one caller never waits on another's credentials.
+    """
+    hedge = data.get("hedge") if isinstance(data.get("hedge"), dict) else None
+    material = json.dumps([identity, str(data.get("api_key") or ""), hedge, data.get("cache", True) is not False,
+                           data.get("approximate") is True], sort_keys=True, default=str)
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+class JobQueue:
+    """Durable analysis job queue in a WAL-mode SQLite file
+
+    Jobs are claimed with a conditional UPDATE, so any number of threads and
+    processes can work the same file. The request - API key included - is
+    stored until the job finishes, then replaced with a redacted copy.
+    """
+
+    # Finished jobs past their TTL are deleted every this many completions
+    TRIM_INTERVAL = 100
+
+    def __init__(self, path=JOB_QUEUE_PATH, workers=JOB_WORKERS, max_attempts=JOB_MAX_ATTEMPTS,
+                 lease_seconds=JOB_LEASE_SECONDS, result_ttl=JOB_RESULT_TTL):
+        self.path = path
+        self.workers = max(0, int(workers))
+        self.max_attempts = max(1, int(max_attempts))
+        self.lease_seconds = float(lease_seconds)
+        self.result_ttl = float(result_ttl)
+        self.metadata = MetaData()
+        self.table = Table(
+            "analysis_jobs", self.metadata,
+            Column("id", String(32), primary_key=True),
+            Column("dedup_key", String(64), nullable=False, index=True),
+            Column("status", String(16), nullable=False),
+            Column("request", Text, nullable=False),
+            Column("result", Text),
+            Column("result_status", Integer),
+            Column("error", Text),
+            Column("attempts", Integer, nullable=False, default=0),
+            Column("created_at", Float, nullable=False),
+            Column("available_at", Float, nullable=False, index=True),
+            Column("started_at", Float),
+            Column("finished_at", Float),
+            Column("lease_expires_at", Float),
+            Column("expires_at", Float, index=True)
+        )
+        self._engine = None
+        self._init_lock = threading.Lock()
+        self._changed = threading.Condition()
+        self._runner = None
+        self._threads = []
+        self._pid = None
+        self._completions = 0
+
+    @property
+    def engine(self):
+        """Engine, created with the schema on first use (after any fork)"""
+        if self._engine is None:
+            with self._init_lock:
+                if self._engine is None:
+                    engine = get_sqlite_engine(self.path)
+                    try:
+                        self.metadata.create_all(engine)
+                    except OperationalError:
+                        # Another worker created the table at the same moment
+                        self.metadata.create_all(engine)
+                    self._engine = engine
+        return self._engine
+
+    def submit(self, data, identity):
+        """Queue data unless an identical job is pending or has a live result; returns (job_id, deduplicated)"""
+        now = time.time()
+        table = self.table
+        key = dedup_key(data, identity)
+        with self.engine.begin() as conn:
+            existing = conn.execute(
+                select(table.c.id)
+                .where(table.c.dedup_key == key,
+                       table.c.status.in_(("queued", "running")) |
+                       ((table.c.status == "succeeded") & (table.c.expires_at > now)))
+                .order_by(table.c.created_at.desc())
+                .limit(1)
+            ).first()
+            if existing is not None:
+                METRICS.inc("job_queue_jobs_total", outcome="deduplicated")
+                return existing.id, True
+            job_id = uuid.uuid4().hex
+            conn.execute(table.insert().values(
+                id=job_id, dedup_key=key, status="queued", request=json.dumps(data), attempts=0,
+                created_at=now, available_at=now
+            ))
+        METRICS.inc("job_queue_jobs_total", outcome="queued")
+        self._notify()
+        return job_id, False
+
+    def get(self, job_id):
+        """The job as a JSON-ready dict, or None"""
+        table = self.table
+        with self.engine.connect() as conn:
+            row = conn.execute(select(table).where(table.c.id == job_id)).first()
+        if row is None:
+            return None
+        job = {
+            "job_id": row.id,
+            "status": row.status,
+            "attempts": row.attempts,
+            "created_at": row.created_at,
+            "started_at": row.started_at,
+            "finished_at": row.finished_at
+        }
+        if row.status == "queued" and row.attempts:
+            job["retry_at"] = row.available_at
+        if row.result is not None:
+            job["result"] = json.loads(row.result)
+            job["result_status"] = row.result_status
+        if row.error:
+            job["error"] = row.error
+        return job
+
+    def wait(self, job_id, timeout):
+        """get(job_id), waiting up to timeout seconds for the job to finish"""
+        deadline = time.monotonic() + min(max(0.0, float(timeout)), JOB_LONG_POLL_MAX)
+        while True:
+            job = self.get(job_id)
+            remaining = deadline - time.monotonic()
+            if job is None or job["status"] in FINISHED_STATUSES or remaining <= 0:
+                return job
+            # Woken at once by this process's workers; jobs finished elsewhere are seen on the next poll
+            with self._changed:
+                self._changed.wait(min(JOB_POLL_INTERVAL, remaining))
+
+    def claim(self):
+        """Lease the next runnable job to the caller; returns (job_id, data, attempt) or None"""
+        table = self.table
+        now = time.time()
+        runnable = ((table.c.status == "queued") & (table.c.available_at <= now)) | \
+                   ((table.c.status == "running") & (table.c.lease_expires_at <= now))
+        with self.engine.begin() as conn:
+            for _ in range(3):
+                row = conn.execute(
+                    select(table.c.id, table.c.request, table.c.attempts)
+                    .where(runnable)
+                    .order_by(table.c.available_at)
+                    .limit(1)
+                ).first()
+                if row is None:
+                    return None
+                # Only one claimant's UPDATE still matches the row
+                claimed = conn.execute(
+                    table.update()
+                    .where(table.c.id == row.id, table.c.attempts == row.attempts, runnable)
+                    .values(status="running", attempts=row.attempts + 1, started_at=now,
+                            lease_expires_at=now + self.lease_seconds)
+                ).rowcount
+                if claimed:
+                    return row.id, json.loads(row.request), row.attempts + 1
+        return None
+
+    def complete(self, job_id, body, status, attempt):
+        """Record a run's outcome: finish the job, or queue another attempt
+
+        Returns False, recording nothing, when the caller no longer holds the
+        job - its lease ran out and another worker claimed it.
+        """
+        now = time.time()
+        if status in RETRYABLE_STATUSES and attempt < self.max_attempts:
+            delay = min(JOB_RETRY_MAX_DELAY, JOB_RETRY_BASE_DELAY * 2 ** (attempt - 1))
+            retry_after = body.get("retry_after") if isinstance(body, dict) else None
+            if isinstance(retry_after, (int, float)):
+                delay = max(delay, float(retry_after))
+            if not self._update_leased(job_id, attempt, status="queued", available_at=now + delay,
+                                       lease_expires_at=None,
+                                       error=str(body.get("error", "")) if isinstance(body, dict) else None):
+                return self._lost_lease(job_id, attempt)
+            METRICS.inc("job_queue_jobs_total", outcome="retried")
+            return True
+        succeeded = status == 200
+        request = self._request(job_id)
+        updated = self._update_leased(
+            job_id,
+            attempt,
+            status="succeeded" if succeeded else "failed",
+            result=json.dumps(body, default=str),
+            result_status=status,
+            error=None if succeeded else str(body.get("error", "")) if isinstance(body, dict) else str(body),
+            request=json.dumps(redact_request(request)) if request is not None else "{}",
+            finished_at=now,
+            lease_expires_at=None,
+            expires_at=now + self.result_ttl
+        )
+        if not updated:
+            return self._lost_lease(job_id, attempt)
+        METRICS.inc("job_queue_jobs_total", outcome="succeeded" if succeeded else "failed")
+        self._notify()
+        self._completions += 1
+        if self._completions % self.TRIM_INTERVAL == 0:
+            self.trim()
+        return True
+
+    def trim(self):
+        """Delete finished jobs whose results have expired"""
+        table = self.table
+        with self.engine.begin() as conn:
+            return conn.execute(
+                delete(table).where(table.c.status.in_(FINISHED_STATUSES), table.c.expires_at <= time.time())
+            ).rowcount
+
+    def stats(self):
+        """Queue depth and the age of its oldest job, for autoscaling"""
+        table = self.table
+        now = time.time()
+        with self.engine.connect() as conn:
+            counts = dict(conn.execute(select(table.c.status, func.count()).group_by(table.c.status)).all())
+            oldest = conn.execute(
+                select(func.min(table.c.created_at)).where(table.c.status == "queued", table.c.available_at <= now)
+            ).scalar()
+        return {
+            "depth": counts.get("queued", 0),
+            "running": counts.get("running", 0),
+            "succeeded": counts.get("succeeded", 0),
+            "failed": counts.get("failed", 0),
+            "oldest_age_seconds": round(now - oldest, 3) if oldest is not None else 0.0,
+            "workers": len(self._threads) if self._pid == os.getpid() else 0
+        }
+
+    def start(self, runner):
+        """Run jobs on this process's worker threads with runner(data) -> (body, status)
+
+        Safe to call repeatedly; threads are (re)started in each forked worker.
+        """
+        if self.workers <= 0 or (self._pid == os.getpid() and self._threads):
+            return
+        with self._init_lock:
+            if self._pid == os.getpid() and self._threads:
+                return
+            self._runner = runner
+            self._pid = os.getpid()
+            self._threads = [threading.Thread(target=self._work, name=f"job-worker-{index}", daemon=True)
+                             for index in range(self.workers)]
+            for thread in self._threads:
+                thread.start()
+
+    def _work(self):
+        while True:
+            try:
+                claimed = self.claim()
+            except Exception as e:
+                logger.warning("Job claim failed: %s", e)
+                claimed = None
+            if claimed is None:
+                with self._changed:
+                    self._changed.wait(JOB_POLL_INTERVAL)
+                continue
+            self._run(*claimed)
+
+    def _run(self, job_id, data, attempt):
+        if attempt > self.max_attempts:
+            # Its earlier workers died mid-run; stop handing it out
+            self.complete(job_id, {"error": "Job abandoned after repeated worker failures"}, 500, attempt)
+            return
+        try:
+            body, status = self._runner(data)
+        except Exception as e:
+            logger.exception("Job %s failed", job_id)
+            body, status = {"error": f"Internal server error: {str(e)}"}, 500
+        try:
+            self.complete(job_id, body, status, attempt)
+        except Exception as e:
+            logger.warning("Could not record job %s: %s", job_id, e)
+
+    def _request(self, job_id):
+        table = self.table
+        with self.engine.connect() as conn:
+            row = conn.execute(select(table.c.request).where(table.c.id == job_id)).first()
+        return json.loads(row.request) if row is not None else None
+
+    def _update_leased(self, job_id, attempt, **values):
+        """Update the job only while it is still running under this attempt's claim"""
+        table = self.table
+        with self.engine.begin() as conn:
+            return conn.execute(
+                table.update()
+                .where(table.c.id == job_id, table.c.status == "running", table.c.attempts == attempt)
+                .values(**values)
+            ).rowcount > 0
+
+    def _lost_lease(self, job_id, attempt):
+        logger.warning("Job %s attempt %d finished after losing its lease; result discarded", job_id, attempt)
+        METRICS.inc("job_queue_jobs_total", outcome="lease_lost")
+        return False
+
+    def _notify(self):
+        with self._changed:
+            self._changed.notify_all()
+
+JOB_QUEUE = JobQueue()
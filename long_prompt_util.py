@@ -0,0 +1,225 @@
+import math
+import os
+import re
+
+from token_util import count_tokens
+
+# Long prompts - a prompt above LONG_PROMPT_TOKENS is split at section
+# boundaries, the sections are analyzed in parallel, and the analyses are
+# merged, so latency follows the largest section rather than the whole prompt
+LONG_PROMPT_ENABLED = os.getenv("LONG_PROMPT_ENABLED", "1") == "1"
+LONG_PROMPT_TOKENS = int(os.getenv("LONG_PROMPT_TOKENS", 4000))
+LONG_PROMPT_CHUNK_TOKENS = int(os.getenv("LONG_PROMPT_CHUNK_TOKENS", 1500))
+LONG_PROMPT_MAX_CHUNKS = int(os.getenv("LONG_PROMPT_MAX_CHUNKS", 12))
+# Sections scoring below this (out of 100) get their rewrite; the rest are kept verbatim
+LONG_PROMPT_REWRITE_BELOW = int(os.getenv("LONG_PROMPT_REWRITE_BELOW", 70))
+LONG_PROMPT_MAX_FINDINGS = int(os.getenv("LONG_PROMPT_MAX_FINDINGS", 8))
+
+# How each dimension of the section scores combines into the prompt's: a
+# role, context, constraints or advanced technique stated in any section
+# serves the whole prompt, while clarity and structure are only as good as
+# the text on average
+DIMENSION_MERGE = {
+    "clarity": "mean",
+    "context": "max",
+    "structure": "mean",
+    "role": "max",
+    "constraints": "max",
+    "advanced": "max",
+}
+
+# Section starts: markdown headings, XML-style section tags, horizontal rules
+# and all-caps labels of two or more words, or ending in a colon ("OUTPUT FORMAT", "RULES:")
+_HEADING = re.compile(r"#{1,6}\s+\S|<[A-Za-z_][\w-]*>\s*$|(?:-{3,}|\*{3,}|_{3,}|={3,})\s*$"
+                      r"|[A-Z][A-Z0-9 /&()-]{2,60}:\s*$|[A-Z][A-Z0-9/&()-]+(?: [A-Z0-9/&()-]+){1,8}\s*$")
+_SETEXT_UNDERLINE = re.compile(r"(?:=+|-+)\s*$")
+# The note section_query adds; a local rewrite keeps it in place of the task
+_SECTION_NOTE = re.compile(r"^[ \t]*\[Section \d+ of \d+[^\]\n]*\][ \t]*\n*", re.M)
+
+def is_long_prompt(query, provider=None):
+    """Whether query is long enough to be analyzed section by section"""
+    return LONG_PROMPT_ENABLED and isinstance(query, str) and count_tokens(query, provider) > LONG_PROMPT_TOKENS
+
+def split_sections(text):
+    """Split text before each heading into [(title, text)]; the texts concatenate back to text
+
+    The preamble before the first heading has title None.
+    """
+    lines = text.splitlines(keepends=True)
+    sections, start, title = [], 0, None
+    for index, line in enumerate(lines):
+        stripped = line.strip()
+        # A run of = or - under a line of text underlines that line's heading
+        underline = bool(stripped) and index > 0 and lines[index - 1].strip() and _SETEXT_UNDERLINE.match(stripped)
+        if underline:
+            continue
+        setext = bool(stripped) and index + 1 < len(lines) and _SETEXT_UNDERLINE.match(lines[index + 1].strip())
+        if not (setext or _HEADING.match(stripped)):
+            continue
+        if index:
+            sections.append((title, "".join(lines[start:index])))
+            start = index
+        title = stripped.strip("#<>:*_=- ") or None
+    sections.append((title, "".join(lines[start:])))
+    return [(title, section) for title, section in sections if section]
+
+def _split_oversized(text, limit, provider):
+    """Split one section over limit tokens at paragraphs, then lines, then characters"""
+    for pattern in (r"(?<=\n\n)", r"(?<=\n)"):
+        pieces = [piece for piece in re.split(pattern, text) if piece]
+        if len(pieces) > 1:
+            return _pack([(None, piece) for piece in pieces], limit, provider)
+    size = max(1, int(limit * 3.5))
+    return [text[index:index + size] for index in range(0, len(text), size)]
+
+def _pack(sections, limit, provider):
+    """Greedily join consecutive sections into texts of at most limit tokens"""
+    texts, current, current_tokens = [], "", 0
+    for _, section in sections:
+        tokens = count_tokens(section, provider)
+        if tokens > limit:
+            if current:
+                texts.append(current)
+                current, current_tokens = "", 0
+            texts.extend(_split_oversized(section, limit, provider))
+        elif current and current_tokens + tokens > limit:
+            texts.append(current)
+            current, current_tokens = section, tokens
+        else:
+            current, current_tokens = current + section, current_tokens + tokens
+    if current:
+        texts.append(current)
+    return texts
+
+def chunk_prompt(text, provider=None, chunk_tokens=LONG_PROMPT_CHUNK_TOKENS, max_chunks=LONG_PROMPT_MAX_CHUNKS):
+    """Split text into at most max_chunks [(title, text)] chunks at section boundaries
+
+    Sections are packed into chunks of about chunk_tokens; the chunk size
+    grows when that would make too many. The chunk texts concatenate back to
+    text.
+    """
+    sections = split_sections(text)
+    limit = max(chunk_tokens, math.ceil(count_tokens(text, provider) / max(1, max_chunks)))
+    while True:
+        texts = _pack(sections, limit, provider)
+        if len(texts) <= max_chunks:
+            break
+        limit = int(limit * 1.25) + 1
+    chunks = []
+    for chunk in texts:
+        titles = split_sections(chunk)
+        chunks.append((titles[0][0] if titles else None, chunk))
+    return chunks
+
+def section_query(chunks, index):
+    """The text analyzed for chunk index: the section, with a note placing it in the prompt"""
+    title, text = chunks[index]
+    label = f": {title}" if title else ""
+    return (f"[Section {index + 1} of {len(chunks)} of a longer prompt{label}. Analyze and rewrite this section only; "
+            f"keep its heading and do not add a preamble for the whole prompt.]\n\n{text.strip()}")
+
+def _section_rewrite(analysis_result, text):
+    """The section's rewritten text, keeping the original's surrounding whitespace, or None"""
+    rewrite = _SECTION_NOTE.sub("", str(analysis_result.get("new_prompt") or "")).strip()
+    if not rewrite or rewrite == text.strip():
+        return None
+    leading = text[:len(text) - len(text.lstrip())]
+    trailing = text[len(text.rstrip()):]
+    return leading + rewrite + trailing
+
+def _merge_findings(findings, limit):
+    """De-duplicated findings, case-insensitively, first occurrence kept, at most limit"""
+    merged, seen = [], set()
+    for finding in findings:
+        key = str(finding).strip().lower().rstrip(".")
+        if key and key not in seen:
+            seen.add(key)
+            merged.append(str(finding).strip())
+    return merged[:limit]
+
+def _merge_usage(usages):
+    usages = [usage for usage in usages if isinstance(usage, dict)]
+    if not usages:
+        return None
+    return {field: sum(usage.get(field) or 0 for usage in usages) for field in usages[0]}
+
+def merge_section_analyses(chunks, results, provider=None):
+    """Reduce per-chunk (score, analysis_result) results into one analysis of the whole prompt
+
+    Dimension scores combine per DIMENSION_MERGE, weighted by section
+    length; findings are pooled with the weakest sections first; the
+    improved prompt is the original with only sections scoring below
+    LONG_PROMPT_REWRITE_BELOW replaced by their rewrites. A section whose
+    analysis failed is kept verbatim; if every one failed, the first error
+    is returned. Failed and parse-fallback sections are counted in the
+    long_prompt block, which keeps such a partial merge out of the cache.
+    """
+    analyzed = [(index, result[1]) for index, result in enumerate(results)
+                if isinstance(result, tuple) and result[0] != "Error" and isinstance(result[1], dict)]
+    if not analyzed:
+        error = next((result for result in results if isinstance(result, tuple)), None)
+        return error or ("Error", f"Long prompt analysis failed: {results[0]}")
+
+    weights = {index: max(1, count_tokens(chunks[index][1], provider)) for index, _ in analyzed}
+    total_weight = sum(weights.values())
+    detailed_scores = {}
+    for dimension, how in DIMENSION_MERGE.items():
+        values = [(analysis.get("detailed_scores") or {}).get(dimension, 0) for _, analysis in analyzed]
+        if how == "max":
+            detailed_scores[dimension] = max(values)
+        else:
+            detailed_scores[dimension] = round(sum(value * weights[index] for value, (index, _) in
+                                                   zip(values, analyzed)) / total_weight)
+
+    by_weakness = sorted(analyzed, key=lambda item: item[1].get("overall_score", 0))
+    strengths, weaknesses, improvements = [], [], []
+    for index, analysis in by_weakness:
+        title = chunks[index][0]
+        prefix = f"{title}: " if title else ""
+        strengths.extend(analysis.get("strengths") or [])
+        weaknesses.extend(prefix + str(item) for item in analysis.get("weaknesses") or [])
+        improvements.extend(prefix + str(item) for item in analysis.get("improvements") or [])
+
+    # Rewrite pass: only weak sections change, so the rest of the prompt survives verbatim
+    results_by_index = dict(analyzed)
+    parts, sections = [], []
+    for index, (title, text) in enumerate(chunks):
+        analysis = results_by_index.get(index)
+        rewrite = None
+        if analysis is not None and analysis.get("overall_score", 0) < LONG_PROMPT_REWRITE_BELOW:
+            rewrite = _section_rewrite(analysis, text)
+        parts.append(rewrite or text)
+        sections.append({
+            "index": index,
+            "title": title,
+            "tokens": count_tokens(text, provider),
+            "score": analysis.get("overall_score") if analysis is not None else None,
+            "outcome": "failed" if analysis is None else "rewritten" if rewrite else "kept"
+        })
+
+    rewritten = [section for section in sections if section["outcome"] == "rewritten"]
+    failed = [section for section in sections if section["outcome"] == "failed"]
+    parse_fallbacks = sum(1 for _, analysis in analyzed if analysis.get("parse_fallback"))
+    reasoning = f"Analyzed as {len(chunks)} sections; rewrote {len(rewritten)} scoring below " \
+                f"{LONG_PROMPT_REWRITE_BELOW} and kept the rest verbatim."
+    if failed:
+        reasoning += f" {len(failed)} section(s) could not be analyzed and were kept as written."
+
+    result = {
+        "overall_score": sum(detailed_scores.values()),
+        "detailed_scores": detailed_scores,
+        "strengths": _merge_findings(strengths, LONG_PROMPT_MAX_FINDINGS),
+        "weaknesses": _merge_findings(weaknesses, LONG_PROMPT_MAX_FINDINGS),
+        "improvements": _merge_findings(improvements, LONG_PROMPT_MAX_FINDINGS),
+        "new_prompt": "".join(parts),
+        "reasoning": reasoning,
+        "math_corrected": any(analysis.get("math_corrected") for _, analysis in analyzed),
+        "long_prompt": {"sections": sections, "rewritten": len(rewritten), "failed": len(failed),
+                        "parse_fallbacks": parse_fallbacks}
+    }
+    if all(analysis.get("parse_fallback") for _, analysis in analyzed):
+        result["parse_fallback"] = True
+    usage = _merge_usage([analysis.get("usage") for _, analysis in analyzed])
+    if usage:
+        result["usage"] = usage
+    return result["overall_score"], result
@@ -1,8 +1,31 @@
-from flask import Flask, send_from_directory, request, jsonify
+from flask import Flask, Response, abort, request, jsonify, stream_with_context
 from flask_cors import CORS
 import os
 import json
-from app_util import prompt_analysis
+import logging
+import re
+import threading
+from app_util import (
+    prewarm_http_transport, provider_requires_api_key, stream_prompt_analysis, PROVIDER_CONFIGS
+)
+from heuristic_util import analyze_prompt as heuristic_analysis, HEURISTIC_PRELIMINARY
+from batch_util import fan_out, BATCH_MAX_ITEMS
+from metrics_util import parse_failure_rates, truncation_rates, METRICS
+from cache_util import (
+    async_cached_prompt_analysis, cached_prompt_analysis, coalescing_stats, lookup_cached_analysis, make_cache_key,
+    near_duplicate_analysis, store_analysis, warm_result_cache, ANALYSIS_CACHE_ENABLED, RESULT_CACHE, SHARED_STORE
+)
+from similarity_util import NEAR_DUP_INDEX
+from token_util import output_token_budget
+from capture_util import TRAFFIC_CAPTURE
+from job_util import FINISHED_STATUSES, JOB_QUEUE
+from asset_util import ASSET_PREFIX, STATIC_ASSETS
+
+logging.basicConfig(
+    level=os.getenv('LOG_LEVEL', 'INFO').upper(),
+    format='%(asctime)s %(levelname)s %(name)s: %(message)s'
+)
+logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'asdf#FGSgvasgf$5$WGT'
@@ -10,24 +33,106 @@ app.config['SECRET_KEY'] = 'asdf#FGSgvasgf$5$WGT'
 # Enable CORS for all routes
 CORS(app)
 
+_background_pid = None
+_background_lock = threading.Lock()
+
+def start_background_work():
+    """Start this process's warm-ups and job workers (again, after a fork)
+
+    Called by the server entry points and on the first request, never on
+    import, so tools that import this module start no threads and open no
+    SQLite files.
+    """
+    global _background_pid
+    if _background_pid == os.getpid():
+        return
+    with _background_lock:
+        if _background_pid == os.getpid():
+            return
+        _background_pid = os.getpid()
+    # Warm pooled connections to the REST providers
+    if os.getenv('HTTP_PREWARM', '1') == '1':
+        threading.Thread(target=prewarm_http_transport, daemon=True).start()
+    # Warm the in-process result cache from the shared store after a deploy
+    threading.Thread(target=warm_result_cache, daemon=True).start()
+    # Minify, fingerprint and compress the page
+    threading.Thread(target=STATIC_ASSETS.get, args=('/',), daemon=True).start()
+    # Work the job queue in every serving process
+    JOB_QUEUE.start(_run_job)
+
+@app.before_request
+def _start_background_work_on_first_request():
+    start_background_work()
+
+@app.cli.command('cache-compact')
+def cache_compact():
+    """Trim and VACUUM the shared analysis cache"""
+    if SHARED_STORE is None:
+        print("Shared analysis store is disabled (ANALYSIS_STORE_ENABLED=0)")
+        return
+    print(json.dumps(SHARED_STORE.compact(), indent=2))
+
+@app.cli.command('assets-build')
+def assets_build():
+    """Build the static assets and list them with their compressed sizes"""
+    assets = STATIC_ASSETS.build()
+    print(json.dumps({path: {encoding: len(body) for encoding, body in asset.variants.items()}
+                      for path, asset in assets.items()}, indent=2))
+
 # Global error handlers for API routes
 @app.errorhandler(404)
 def not_found_error(error):
     if request.path.startswith('/api/'):
         return jsonify({'error': 'API endpoint not found'}), 404
-    # For non-API routes, serve the main page (SPA behavior)
-    return send_from_directory('.', 'index.html')
+    # Stale fingerprinted assets stay a 404; other non-API routes get the main page (SPA behavior)
+    if request.path.startswith(ASSET_PREFIX):
+        return 'Not found', 404
+    return _asset_response('/') or ('Not found', 404)
 
 @app.errorhandler(500)
 def internal_error(error):
     if request.path.startswith('/api/'):
         return jsonify({'error': 'Internal server error'}), 500
-    return send_from_directory('.', 'index.html')
+    return _asset_response('/') or ('Internal server error', 500)
 
 @app.route('/api/health')
 def health_check():
     return jsonify({"status": "healthy", "message": "Prompt Analysis API is running"})
 
+@app.route('/api/cache/stats', methods=['GET'])
+def cache_stats():
+    """Get result cache counters"""
+    stats = {
+        'result_cache': RESULT_CACHE.stats(),
+        'coalescing': coalescing_stats(),
+        'near_duplicate': NEAR_DUP_INDEX.stats()
+    }
+    if SHARED_STORE is not None:
+        try:
+            stats['shared_store'] = SHARED_STORE.stats()
+        except Exception as e:
+            stats['shared_store'] = {'error': str(e)}
+    return jsonify(stats)
+
+@app.route('/api/metrics', methods=['GET'])
+def metrics():
+    """Prometheus metrics: per-stage latency, outcomes, parse failures and cache counters"""
+    cache = RESULT_CACHE.stats()
+    for field in ('entries', 'bytes', 'hits', 'misses', 'evictions'):
+        METRICS.set_gauge(f'analysis_cache_{field}', cache[field], tier='memory')
+    METRICS.set_gauge('prompt_analysis_coalescing_ratio', coalescing_stats()['coalescing_ratio'])
+    for style, ratio in truncation_rates().items():
+        METRICS.set_gauge('prompt_analysis_truncation_ratio', ratio, style=style)
+    for provider, ratio in parse_failure_rates().items():
+        METRICS.set_gauge('prompt_analysis_parse_failure_ratio', ratio, provider=provider)
+    try:
+        jobs = JOB_QUEUE.stats()
+        for field in ('depth', 'running', 'oldest_age_seconds'):
+            METRICS.set_gauge(f'job_queue_{field}', jobs[field])
+    except Exception as e:
+        logger.warning("Job queue stats unavailable: %s", e)
+    return Response(METRICS.render_prometheus(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/api/prompt/analyze', methods=['POST'])
 def analyze_prompt():
     """
@@ -38,8 +143,16 @@ def analyze_prompt():
         "provider": "groq", 
         "model": "llama-3.1-70b-versatile",
         "api_key": "your_api_key",
-        "style": "comprehensive"
+        "style": "comprehensive",
+        "cache": true,
+        "hedge": {"provider": "together", "model": "...", "api_key": "..."},
+        "approximate": false
     }
+    Set "cache": false or send "Cache-Control: no-cache" to skip the result cache.
+    "hedge" is optional; the response then reports which leg won.
+    With "approximate": true, a near-duplicate of a prompt analyzed with the
+    same API key gets that analysis at once (without its rewrite), with
+    X-Cache: NEAR-HIT and an "approximate" block.
     """
     try:
         # Get JSON data from request
@@ -47,162 +160,525 @@ def analyze_prompt():
         if not data:
             return jsonify({'error': 'No JSON data provided'}), 400
         
-        # Validate required fields
-        required_fields = ['prompt', 'api_key']
-        for field in required_fields:
-            if field not in data or not data[field]:
-                return jsonify({'error': f'Missing or empty required field: {field}'}), 400
-        
-        prompt_text = str(data['prompt']).strip()
-        api_key = str(data['api_key']).strip()
-        provider = data.get('provider', 'groq')
-        model = data.get('model', 'llama-3.3-70b-versatile')
-        style = data.get('style', 'comprehensive')
-        
-        # Validate API key format (basic check)
-        if len(api_key) < 10:
-            return jsonify({'error': 'API key appears to be invalid (too short)'}), 400
+        use_cache = data.get('cache', True) is not False and \
+            'no-cache' not in request.headers.get('Cache-Control', '').lower()
         
-        # Validate prompt length
-        if len(prompt_text) < 3:
-            return jsonify({'error': 'Prompt is too short. Please provide a meaningful prompt to analyze.'}), 400
+        with TRAFFIC_CAPTURE.request(data) as capture:
+            result, status, cache_status = _analyze_request(data, use_cache)
+            if capture is not None:
+                capture.update(status=status, cache=cache_status)
+        response = jsonify(result)
+        if cache_status:
+            response.headers['X-Cache'] = cache_status
+        if result.get('retry_after'):
+            response.headers['Retry-After'] = str(result['retry_after'])
+        return response, status
         
-        # Use default temperature and max_tokens
-        temperature = 0.7
-        max_tokens = 1000
+    except Exception as e:
+        logger.exception("Error in analyze_prompt")
+        return jsonify({'error': f'Internal server error: {str(e)}'}), 500
+
+@app.route('/api/prompt/analyze/batch', methods=['POST'])
+def analyze_prompt_batch():
+    """
+    Analyze many prompts concurrently
+    Expected JSON format:
+    {
+        "prompts": ["text to analyze", {"prompt": "another", "style": "quick"}],
+        "provider": "groq",
+        "model": "llama-3.3-70b-versatile",
+        "api_key": "your_api_key",
+        "style": "comprehensive"
+    }
+    Top-level fields are defaults that each item may override. Results keep
+    the order of "prompts"; each one carries its own status and either the
+    single-endpoint payload or an error.
+    """
+    try:
+        data = request.get_json()
+        if not data:
+            return jsonify({'error': 'No JSON data provided'}), 400
+
+        items, error = _batch_items(data, request.headers.get('Cache-Control', ''))
+        if error:
+            return jsonify(error[0]), error[1]
+
+        def run_item(item):
+            return _analyze_request(item, use_cache=item['cache'])
+
+        return jsonify(_batch_response(fan_out(items, run_item, _batch_provider)))
+
+    except Exception as e:
+        logger.exception("Error in analyze_prompt_batch")
+        return jsonify({'error': f'Internal server error: {str(e)}'}), 500
+
+@app.route('/api/prompt/analyze/stream', methods=['POST'])
+def analyze_prompt_stream():
+    """
+    Analyze a prompt and stream progress as Server-Sent Events
+    Accepts the same JSON as /api/prompt/analyze. Events:
+    - preliminary: a local heuristic analysis, sent at once while the provider works
+    - progress: {"chars": n} as the provider's output arrives
+    - field: {"name": "score", "value": 42} once a top-level field is parseable
+    - result: the same payload /api/prompt/analyze returns
+    - error: {"error": "...", "status": 500}
+    """
+    data = request.get_json(silent=True)
+    if not data:
+        return jsonify({'error': 'No JSON data provided'}), 400
+    
+    params, error = _validate_request(data)
+    if error:
+        return jsonify(error[0]), error[1]
+    
+    use_cache = ANALYSIS_CACHE_ENABLED and data.get('cache', True) is not False and \
+        'no-cache' not in request.headers.get('Cache-Control', '').lower() and \
+        provider_requires_api_key(params['provider'])
+    
+    def generate():
+        try:
+            cache_key = make_cache_key(params['prompt'], params['provider'], params['model'], params['style'],
+                                       params['temperature'], params['max_tokens'])
+            if use_cache:
+                cached, cache_status = lookup_cached_analysis(cache_key)
+                if cached is not None:
+                    body, status = _format_analysis(params, *cached)
+                    yield _sse_event('result', {**body, 'cache': cache_status})
+                    return
+                if params['approximate']:
+                    near = near_duplicate_analysis(params['prompt'], params['api_key'], params['temperature'],
+                                                   params['max_tokens'], params['provider'], params['model'],
+                                                   params['style'], cache_key)
+                    if near is not None:
+                        body, status = _format_analysis(params, *near)
+                        yield _sse_event('result', {**body, 'cache': 'NEAR-HIT'})
+                        return
+            
+            if provider_requires_api_key(params['provider']) and HEURISTIC_PRELIMINARY:
+                body, _ = _format_analysis(params, *heuristic_analysis(params['prompt'], params['style']))
+                yield _sse_event('preliminary', body)
+            
+            chars = reported = 0
+            for kind, payload in stream_prompt_analysis(
+                params['prompt'], params['api_key'], params['temperature'], params['max_tokens'],
+                params['provider'], params['model'], params['style']
+            ):
+                if kind == 'delta':
+                    chars += len(payload)
+                    # Roughly one progress event per dozen tokens
+                    if chars - reported >= 48:
+                        reported = chars
+                        yield _sse_event('progress', {'chars': chars})
+                elif kind == 'field':
+                    yield _sse_event('field', {'name': payload[0], 'value': payload[1]})
+                else:
+                    score, analysis_result = payload
+                    if use_cache:
+                        store_analysis(cache_key, score, analysis_result, params['prompt'], params['api_key'])
+                    body, status = _format_analysis(params, score, analysis_result)
+                    if status == 200:
+                        yield _sse_event('result', {**body, 'cache': 'MISS' if use_cache else 'BYPASS'})
+                    else:
+                        yield _sse_event('error', {**body, 'status': status})
+        except Exception as e:
+            logger.exception("Error in analyze_prompt_stream")
+            yield _sse_event('error', {'error': f'Internal server error: {str(e)}', 'status': 500})
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@app.route('/api/jobs', methods=['POST'])
+def submit_job():
+    """
+    Queue a prompt analysis and answer at once
+    Accepts the same JSON as /api/prompt/analyze and returns 202 with
+    {"job_id", "status", "deduplicated", "status_url"}. Submitting an
+    identical request while its job is pending, or its result is still
+    kept, returns that job instead of queuing another.
+    Poll GET /api/jobs/<job_id>; add ?wait=<seconds> to long-poll.
+    """
+    try:
+        data = request.get_json(silent=True)
+        if not data:
+            return jsonify({'error': 'No JSON data provided'}), 400
         
-        # Analyze the prompt using our app_util function with multi-provider support
-        score, analysis_result = prompt_analysis(
-            query=prompt_text,
-            api_key=api_key,
-            temp=temperature,
-            max_token=max_tokens,
-            provider=provider,
-            model=model,
-            style=style
-        )
+        params, error = _validate_request(data)
+        if error:
+            return jsonify(error[0]), error[1]
         
-        # Check if there was an error
-        if score == "Error":
-            # Provide more specific error messages based on common issues
-            error_msg = str(analysis_result)
-            if "authentication" in error_msg.lower() or "api key" in error_msg.lower():
-                return jsonify({'error': 'Invalid API key. Please check your Groq API key and try again.'}), 401
-            elif "rate limit" in error_msg.lower():
-                return jsonify({'error': 'Rate limit exceeded. Please wait and try again.'}), 429
-            elif "quota" in error_msg.lower():
-                return jsonify({'error': 'API quota exceeded. Please check your Groq account.'}), 403
-            else:
-                return jsonify({'error': f'Analysis failed: {error_msg}'}), 500
+        data = dict(data, cache=data.get('cache', True) is not False and
+                    'no-cache' not in request.headers.get('Cache-Control', '').lower())
+        identity = make_cache_key(params['prompt'], params['provider'], params['model'], params['style'],
+                                  params['temperature'], params['max_tokens'])
+        job_id, deduplicated = JOB_QUEUE.submit(data, identity)
+        job = JOB_QUEUE.get(job_id)
+        response = jsonify({
+            'job_id': job_id,
+            'status': job['status'],
+            'deduplicated': deduplicated,
+            'status_url': f'/api/jobs/{job_id}'
+        })
+        response.headers['Location'] = f'/api/jobs/{job_id}'
+        return response, 202
+    
+    except Exception as e:
+        logger.exception("Error in submit_job")
+        return jsonify({'error': f'Internal server error: {str(e)}'}), 500
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """
+    Status of a queued analysis; "result" holds the /api/prompt/analyze
+    payload once it has finished. ?wait=<seconds> holds the request open
+    until the job finishes or the wait (at most JOB_LONG_POLL_MAX) runs out.
+    """
+    try:
+        try:
+            wait = float(request.args.get('wait', 0))
+        except ValueError:
+            return jsonify({'error': 'wait must be a number of seconds'}), 400
         
-        # Extract comprehensive analysis data
-        if isinstance(analysis_result, dict):
-            # New comprehensive format
-            overall_score = analysis_result.get("overall_score", 75)
-            detailed_scores = analysis_result.get("detailed_scores", {})
-            strengths_list = analysis_result.get("strengths", ["Basic functionality"])
-            weaknesses_list = analysis_result.get("weaknesses", ["Needs improvement"])
-            improvements_list = analysis_result.get("improvements", ["Add more detail"])
-            new_prompt = analysis_result.get("new_prompt", prompt_text)
-            reasoning = analysis_result.get("reasoning", "Analysis completed")
-            
-            # Convert lists to formatted strings
-            strengths = "• " + "\n• ".join(strengths_list) if strengths_list else "Basic prompt structure identified"
-            weaknesses = "• " + "\n• ".join(weaknesses_list) if weaknesses_list else "Areas for improvement identified"
-            improvements = "• " + "\n• ".join(improvements_list) if improvements_list else "General enhancements suggested"
-            
-            # Create comprehensive scores structure
-            scores = {
-                'overall': overall_score,
-                'clarity': detailed_scores.get('clarity', overall_score - 5),
-                'context': detailed_scores.get('context', overall_score - 3),
-                'structure': detailed_scores.get('structure', overall_score - 4),
-                'role': detailed_scores.get('role', overall_score - 8),
-                'constraints': detailed_scores.get('constraints', overall_score - 12),
-                'advanced': detailed_scores.get('advanced', overall_score - 15),
-                # Legacy compatibility
-                'specificity': detailed_scores.get('clarity', overall_score - 5),
-                'effectiveness': detailed_scores.get('advanced', overall_score - 10)
-            }
-            
+        job = JOB_QUEUE.wait(job_id, wait) if wait > 0 else JOB_QUEUE.get(job_id)
+        if job is None:
+            return jsonify({'error': f'Job {job_id} not found'}), 404
+        response = jsonify(job)
+        if job['status'] not in FINISHED_STATUSES:
+            response.headers['Retry-After'] = '1'
+        return response
+    
+    except Exception as e:
+        logger.exception("Error in get_job")
+        return jsonify({'error': f'Internal server error: {str(e)}'}), 500
+
+@app.route('/api/jobs', methods=['GET'])
+def job_queue_stats():
+    """Queue depth, running jobs and the age of the oldest queued job"""
+    try:
+        return jsonify(JOB_QUEUE.stats())
+    except Exception as e:
+        return jsonify({'error': f'Failed to get job queue stats: {str(e)}'}), 500
+
+def _run_job(data):
+    """Job-queue runner: the same payload and status /api/prompt/analyze would return"""
+    body, status, cache_status = _analyze_request(data, use_cache=data.get('cache', True) is not False)
+    if cache_status:
+        body = dict(body, cache=cache_status)
+    return body, status
+
+def _sse_event(event, data):
+    """Format one Server-Sent Event"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def _analyze_request(data, use_cache=True):
+    """Validate one analysis request and shape its result
+
+    Returns (body, status_code, cache_status) so the single and batch
+    endpoints produce identical payloads.
+    """
+    params, error = _validate_request(data)
+    if error:
+        return error[0], error[1], None
+    
+    # Analyze the prompt using our app_util function with multi-provider support
+    score, analysis_result, cache_status = cached_prompt_analysis(
+        query=params['prompt'],
+        api_key=params['api_key'],
+        temp=params['temperature'],
+        max_token=params['max_tokens'],
+        provider=params['provider'],
+        model=params['model'],
+        style=params['style'],
+        use_cache=use_cache,
+        hedge=params['hedge'],
+        approximate=params['approximate']
+    )
+    
+    body, status = _format_analysis(params, score, analysis_result)
+    return body, status, cache_status if status == 200 else None
+
+async def _analyze_request_async(data, use_cache=True):
+    """_analyze_request for the async serving mode (see asgi.py)"""
+    params, error = _validate_request(data)
+    if error:
+        return error[0], error[1], None
+    
+    score, analysis_result, cache_status = await async_cached_prompt_analysis(
+        query=params['prompt'],
+        api_key=params['api_key'],
+        temp=params['temperature'],
+        max_token=params['max_tokens'],
+        provider=params['provider'],
+        model=params['model'],
+        style=params['style'],
+        use_cache=use_cache,
+        hedge=params['hedge'],
+        approximate=params['approximate']
+    )
+    
+    body, status = _format_analysis(params, score, analysis_result)
+    return body, status, cache_status if status == 200 else None
+
+def _batch_items(data, cache_control=''):
+    """Expand a batch request into per-item requests with the top-level defaults merged in
+
+    Returns (items, None), or (None, (error_body, status_code)). Each item's
+    "cache" is resolved to a bool.
+    """
+    prompts = data.get('prompts')
+    if not isinstance(prompts, list) or not prompts:
+        return None, ({'error': 'Missing or empty required field: prompts'}, 400)
+    if len(prompts) > BATCH_MAX_ITEMS:
+        return None, ({'error': f'Too many prompts: {len(prompts)} (maximum {BATCH_MAX_ITEMS})'}, 400)
+
+    defaults = {key: value for key, value in data.items() if key != 'prompts'}
+    use_cache = data.get('cache', True) is not False and 'no-cache' not in cache_control.lower()
+
+    items = []
+    for entry in prompts:
+        item = dict(defaults)
+        if isinstance(entry, dict):
+            item.update(entry)
         else:
-            # Legacy format fallback
-            try:
-                overall_score = int(score) if isinstance(score, (int, float)) else int(str(score).strip())
-                overall_score = max(1, min(100, overall_score))
-            except (ValueError, TypeError):
-                overall_score = 75
-            
-            new_prompt = analysis_result if isinstance(analysis_result, str) else prompt_text
-            
-            # Generate basic feedback
-            if overall_score >= 85:
-                strengths = "• Excellent prompt with clear structure\n• Specific instructions provided\n• Good context and detail level"
-                weaknesses = "• Very minor improvements possible\n• Could enhance precision in some areas"
-            elif overall_score >= 70:
-                strengths = "• Good prompt foundation\n• Clear intent and structure\n• Context generally well provided"
-                weaknesses = "• Could benefit from more specific instructions\n• Clearer constraints needed\n• Some areas need better clarification"
-            elif overall_score >= 50:
-                strengths = "• Basic prompt structure present\n• Some clear elements identified\n• General direction provided"
-                weaknesses = "• Needs improvement in specificity\n• Context and instruction clarity lacking\n• More detailed requirements needed"
-            else:
-                strengths = "• Has basic elements to build upon\n• Shows attempt at structure"
-                weaknesses = "• Requires significant improvement in clarity\n• Needs better specificity and context\n• Instructions should be much more detailed"
-            
-            improvements = "• Add more specific instructions\n• Provide better context\n• Improve overall structure"
-            reasoning = "Basic analysis completed"
-            
-            # Create scores structure
-            import random
-            random.seed(hash(prompt_text) % 1000)
-            base_variance = 5
-            scores = {
-                'overall': overall_score,
-                'clarity': max(1, min(100, overall_score + random.randint(-base_variance, base_variance))),
-                'context': max(1, min(100, overall_score + random.randint(-base_variance, base_variance))),
-                'structure': max(1, min(100, overall_score + random.randint(-base_variance, base_variance))),
-                'role': max(1, min(100, overall_score + random.randint(-base_variance*2, base_variance))),
-                'constraints': max(1, min(100, overall_score + random.randint(-base_variance*2, base_variance))),
-                'advanced': max(1, min(100, overall_score + random.randint(-base_variance*3, base_variance))),
-                'specificity': max(1, min(100, overall_score + random.randint(-base_variance, base_variance))),
-                'effectiveness': max(1, min(100, overall_score + random.randint(-base_variance, base_variance)))
-            }
+            item['prompt'] = entry
+        item['cache'] = use_cache and item.get('cache', True) is not False
+        items.append(item)
+    return items, None
+
+def _batch_provider(item):
+    """Provider whose concurrency limit a batch item counts against"""
+    provider = str(item.get('provider') or 'groq').lower().strip()
+    return provider if provider in PROVIDER_CONFIGS else ''
+
+def _batch_response(outcomes):
+    """Shape (body, status, cache_status) outcomes - or exceptions - into the batch payload"""
+    results = []
+    for index, outcome in enumerate(outcomes):
+        if isinstance(outcome, Exception):
+            body, status, cache_status = {'error': f'Internal server error: {str(outcome)}'}, 500, None
+        else:
+            body, status, cache_status = outcome
+        results.append({'index': index, 'status': status, 'cache': cache_status, **body})
+
+    succeeded = sum(1 for item in results if item['status'] == 200)
+    return {
+        'success': succeeded == len(results),
+        'total': len(results),
+        'succeeded': succeeded,
+        'failed': len(results) - succeeded,
+        'results': results
+    }
+
+def _validate_request(data):
+    """Check one analysis request
+
+    Returns (params, None) when valid, otherwise (None, (error_body, status_code)).
+    """
+    # Choice fields are looked up in dicts, so anything but a string is a 400, not a 500
+    for field in ('provider', 'model', 'style'):
+        if data.get(field) is not None and not isinstance(data[field], str):
+            return None, ({'error': f'{field} must be a string'}, 400)
+
+    # Validate required fields - the local provider needs no API key
+    needs_key = provider_requires_api_key(data.get('provider', 'groq'))
+    required_fields = ['prompt', 'api_key'] if needs_key else ['prompt']
+    for field in required_fields:
+        if field not in data or not data[field]:
+            return None, ({'error': f'Missing or empty required field: {field}'}, 400)
+    
+    prompt_text = str(data['prompt']).strip()
+    api_key = str(data.get('api_key') or '').strip()
+    
+    # Validate API key format (basic check)
+    if needs_key and len(api_key) < 10:
+        return None, ({'error': 'API key appears to be invalid (too short)'}, 400)
+    
+    # Validate prompt length
+    if len(prompt_text) < 3:
+        return None, ({'error': 'Prompt is too short. Please provide a meaningful prompt to analyze.'}, 400)
+    
+    # Optional hedge leg: {"provider": ..., "model": ..., "api_key": ...}
+    hedge = data.get('hedge')
+    if hedge is not None and not isinstance(hedge, dict):
+        return None, ({'error': 'hedge must be an object with provider, model and api_key'}, 400)
+    
+    return {
+        'prompt': prompt_text,
+        'api_key': api_key,
+        'provider': data.get('provider', 'groq'),
+        'model': data.get('model', 'llama-3.3-70b-versatile'),
+        'style': data.get('style', 'comprehensive'),
+        # Default temperature; max_tokens sized to the style and prompt length
+        'temperature': 0.7,
+        'max_tokens': output_token_budget(prompt_text, data.get('style', 'comprehensive'),
+                                          data.get('provider', 'groq'), data.get('model')),
+        'hedge': hedge or None,
+        # Near-duplicate answers are opt-in: they are another prompt's analysis
+        'approximate': data.get('approximate') is True
+    }, None
+
+def _retry_after(error_msg):
+    """Seconds from a "retry in Ns" hint in an analysis error, if present"""
+    match = re.search(r'retry in (\d+)s', error_msg)
+    return int(match.group(1)) if match else None
+
+def _format_analysis(params, score, analysis_result):
+    """Turn a prompt_analysis result into the API response body and status"""
+    prompt_text = params['prompt']
+    
+    # Check if there was an error
+    if score == "Error":
+        # Provide more specific error messages based on common issues
+        error_msg = str(analysis_result)
+        if "circuit open" in error_msg.lower():
+            return {
+                'error': f'Provider temporarily unavailable: {error_msg}',
+                'retry_after': _retry_after(error_msg) or 30
+            }, 503
+        elif "rate limit reached (client-side)" in error_msg.lower():
+            return {
+                'error': 'Rate limit exceeded. Please wait and try again.',
+                'retry_after': _retry_after(error_msg) or 1
+            }, 429
+        elif "authentication" in error_msg.lower() or "api key" in error_msg.lower():
+            return {'error': 'Invalid API key. Please check your Groq API key and try again.'}, 401
+        elif "rate limit" in error_msg.lower():
+            return {'error': 'Rate limit exceeded. Please wait and try again.'}, 429
+        elif "quota" in error_msg.lower():
+            return {'error': 'API quota exceeded. Please check your Groq account.'}, 403
+        else:
+            return {'error': f'Analysis failed: {error_msg}'}, 500
+    
+    # Extract comprehensive analysis data
+    if isinstance(analysis_result, dict):
+        # New comprehensive format
+        overall_score = analysis_result.get("overall_score", 75)
+        detailed_scores = analysis_result.get("detailed_scores", {})
+        strengths_list = analysis_result.get("strengths", ["Basic functionality"])
+        weaknesses_list = analysis_result.get("weaknesses", ["Needs improvement"])
+        improvements_list = analysis_result.get("improvements", ["Add more detail"])
+        new_prompt = analysis_result.get("new_prompt", prompt_text)
+        reasoning = analysis_result.get("reasoning", "Analysis completed")
         
-        # Ensure new_prompt is a string
-        if not isinstance(new_prompt, str):
-            new_prompt = str(new_prompt)
+        # Convert lists to formatted strings
+        strengths = "• " + "\n• ".join(strengths_list) if strengths_list else "Basic prompt structure identified"
+        weaknesses = "• " + "\n• ".join(weaknesses_list) if weaknesses_list else "Areas for improvement identified"
+        improvements = "• " + "\n• ".join(improvements_list) if improvements_list else "General enhancements suggested"
         
-        result = {
-            'success': True,
-            'scores': scores,
-            'feedback': {
-                'strengths': strengths,
-                'weaknesses': weaknesses
-            },
-            'improved_prompt': new_prompt,
-            'original_prompt': prompt_text,
-            'provider': provider,
-            'model': model,
-            'analysis_style': style
+        # Create comprehensive scores structure
+        scores = {
+            'overall': overall_score,
+            'clarity': detailed_scores.get('clarity', overall_score - 5),
+            'context': detailed_scores.get('context', overall_score - 3),
+            'structure': detailed_scores.get('structure', overall_score - 4),
+            'role': detailed_scores.get('role', overall_score - 8),
+            'constraints': detailed_scores.get('constraints', overall_score - 12),
+            'advanced': detailed_scores.get('advanced', overall_score - 15),
+            # Legacy compatibility
+            'specificity': detailed_scores.get('clarity', overall_score - 5),
+            'effectiveness': detailed_scores.get('advanced', overall_score - 10)
         }
         
-        return jsonify(result)
+    else:
+        # Legacy format fallback
+        try:
+            overall_score = int(score) if isinstance(score, (int, float)) else int(str(score).strip())
+            overall_score = max(1, min(100, overall_score))
+        except (ValueError, TypeError):
+            overall_score = 75
         
-    except Exception as e:
-        import traceback
-        error_details = traceback.format_exc()
-        print(f"Error in analyze_prompt: {error_details}")  # For debugging
-        return jsonify({'error': f'Internal server error: {str(e)}'}), 500
+        new_prompt = analysis_result if isinstance(analysis_result, str) else prompt_text
+        
+        # Generate basic feedback
+        if overall_score >= 85:
+            strengths = "• Excellent prompt with clear structure\n• Specific instructions provided\n• Good context and detail level"
+            weaknesses = "• Very minor improvements possible\n• Could enhance precision in some areas"
+        elif overall_score >= 70:
+            strengths = "• Good prompt foundation\n• Clear intent and structure\n• Context generally well provided"
+            weaknesses = "• Could benefit from more specific instructions\n• Clearer constraints needed\n• Some areas need better clarification"
+        elif overall_score >= 50:
+            strengths = "• Basic prompt structure present\n• Some clear elements identified\n• General direction provided"
+            weaknesses = "• Needs improvement in specificity\n• Context and instruction clarity lacking\n• More detailed requirements needed"
+        else:
+            strengths = "• Has basic elements to build upon\n• Shows attempt at structure"
+            weaknesses = "• Requires significant improvement in clarity\n• Needs better specificity and context\n• Instructions should be much more detailed"
+        
+        improvements = "• Add more specific instructions\n• Provide better context\n• Improve overall structure"
+        reasoning = "Basic analysis completed"
+        
+        # Create scores structure
+        import random
+        random.seed(hash(prompt_text) % 1000)
+        base_variance = 5
+        scores = {
+            'overall': overall_score,
+            'clarity': max(1, min(100, overall_score + random.randint(-base_variance, base_variance))),
+            'context': max(1, min(100, overall_score + random.randint(-base_variance, base_variance))),
+            'structure': max(1, min(100, overall_score + random.randint(-base_variance, base_variance))),
+            'role': max(1, min(100, overall_score + random.randint(-base_variance*2, base_variance))),
+            'constraints': max(1, min(100, overall_score + random.randint(-base_variance*2, base_variance))),
+            'advanced': max(1, min(100, overall_score + random.randint(-base_variance*3, base_variance))),
+            'specificity': max(1, min(100, overall_score + random.randint(-base_variance, base_variance))),
+            'effectiveness': max(1, min(100, overall_score + random.randint(-base_variance, base_variance)))
+        }
+    
+    # Ensure new_prompt is a string
+    if not isinstance(new_prompt, str):
+        new_prompt = str(new_prompt)
+    
+    result = {
+        'success': True,
+        'scores': scores,
+        'feedback': {
+            'strengths': strengths,
+            'weaknesses': weaknesses
+        },
+        'improved_prompt': new_prompt,
+        'original_prompt': prompt_text,
+        'provider': params['provider'],
+        'model': params['model'],
+        'analysis_style': params['style']
+    }
+    if isinstance(analysis_result, dict) and analysis_result.get('hedge'):
+        result['hedge'] = analysis_result['hedge']
+    if isinstance(analysis_result, dict) and analysis_result.get('served_by'):
+        result['served_by'] = analysis_result['served_by']
+    if isinstance(analysis_result, dict) and analysis_result.get('usage'):
+        result['usage'] = analysis_result['usage']
+    if isinstance(analysis_result, dict) and analysis_result.get('approximate'):
+        result['approximate'] = analysis_result['approximate']
+    if isinstance(analysis_result, dict) and analysis_result.get('truncation'):
+        result['truncation'] = analysis_result['truncation']
+    if isinstance(analysis_result, dict) and analysis_result.get('long_prompt'):
+        result['long_prompt'] = analysis_result['long_prompt']
+    
+    return result, 200
 
 @app.route('/')
 def serve_index():
     """Serve the main HTML file"""
-    return send_from_directory('.', 'index.html')
+    response = _asset_response('/')
+    if response is None:
+        abort(404)
+    return response
 
 @app.route('/<path:filename>')
 def serve_static(filename):
-    """Serve static files"""
-    return send_from_directory('.', filename)
+    """Serve built assets and allow-listed files; anything else in the tree is a 404"""
+    response = _asset_response('/' + filename)
+    if response is None:
+        abort(404)
+    return response
+
+def _asset_response(path):
+    """The built asset at path, compressed per Accept-Encoding and 304 on a matching ETag, or None"""
+    served = STATIC_ASSETS.respond(path, request.headers.get('Accept-Encoding'), request.headers.get('If-None-Match'))
+    if served is None:
+        return None
+    body, status, headers = served
+    return Response(body, status=status, headers=headers)
 
 @app.route('/api/providers', methods=['GET'])
 def get_providers():
@@ -216,12 +692,26 @@ def get_providers():
                 'id': provider_id,
                 'name': config['name'],
                 'models': config['models'],
-                'default_model': config['default_model']
+                'default_model': config['default_model'],
+                'requires_api_key': config.get('requires_api_key', True)
             })
         return jsonify({'providers': providers})
     except Exception as e:
         return jsonify({'error': f'Failed to get providers: {str(e)}'}), 500
 
+@app.route('/api/providers/health', methods=['GET'])
+def get_provider_health():
+    """Circuit breaker state per provider/model and the configured fallback chain"""
+    try:
+        from app_util import get_breaker_states
+        from resilience_util import FALLBACK_CHAIN
+        return jsonify({
+            'breakers': get_breaker_states(),
+            'fallback_chain': [f"{provider}:{model}" if model else provider for provider, model in FALLBACK_CHAIN]
+        })
+    except Exception as e:
+        return jsonify({'error': f'Failed to get provider health: {str(e)}'}), 500
+
 @app.route('/api/models/<provider>', methods=['GET'])
 def get_models(provider):
     """Get available models for a specific provider"""
@@ -251,5 +741,16 @@ if __name__ == '__main__':
     print("🔧 Make sure you have your Groq API key ready!")
     print(f"🔧 Running in {'development' if debug_mode else 'production'} mode")
     
-    app.run(host='0.0.0.0', port=port, debug=debug_mode)
+    if os.getenv('SERVER_MODE', 'sync') == 'async':
+        # Analyses run on one event loop instead of one thread each; see asgi.py
+        try:
+            import a2wsgi  # noqa: F401 - asgi.py serves the Flask routes through it
+            import uvicorn
+        except ImportError:
+            raise SystemExit("SERVER_MODE=async needs uvicorn and a2wsgi. Run: pip install uvicorn a2wsgi")
+        print("🔧 Serving analyses asynchronously (ASGI)")
+        uvicorn.run('asgi:app', host='0.0.0.0', port=port, log_level=os.getenv('LOG_LEVEL', 'info').lower())
+    else:
+        start_background_work()
+        app.run(host='0.0.0.0', port=port, debug=debug_mode)
 
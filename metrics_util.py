@@ -0,0 +1,314 @@
+import bisect
+import contextvars
+import logging
+import os
+import random
+import re
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+# Latency buckets in seconds, spanning cache hits to slow upstream calls
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60)
+
+METRIC_HELP = {
+    "prompt_analysis_seconds": ("histogram", "End-to-end prompt_analysis latency"),
+    "prompt_analysis_stage_seconds": ("histogram", "Latency of each analysis stage"),
+    "prompt_analysis_requests_total": ("counter", "Analyses by outcome"),
+    "prompt_analysis_parse_failures_total": ("counter", "Responses that needed a parse fallback"),
+    "prompt_analysis_math_corrected_total": ("counter", "Responses whose reported total was recomputed"),
+    "prompt_analysis_errors_total": ("counter", "Failed analyses by error class"),
+    "prompt_analysis_hedge_total": ("counter", "Hedged analyses by winning leg"),
+    "prompt_analysis_fallback_total": ("counter", "Fallback-chain legs run after a provider failure"),
+    "circuit_breaker_transitions_total": ("counter", "Circuit breaker state changes"),
+    "circuit_breaker_rejections_total": ("counter", "Calls refused by an open circuit breaker"),
+    "rate_limit_rejections_total": ("counter", "Calls refused by the client-side rate limiter"),
+    "prompt_analysis_singleflight_total": ("counter", "Analyses that led or joined an identical in-flight call"),
+    "prompt_analysis_coalescing_ratio": ("gauge", "Share of analyses served by joining an in-flight call"),
+    "prompt_analysis_tokens_total": ("counter", "Provider-reported tokens by kind (input, output, cached, cache_write)"),
+    "prompt_analysis_completions_total": ("counter", "Provider completions by style and finish (stop, or length when cut off)"),
+    "prompt_analysis_truncation_recovery_total": ("counter", "Truncated completions by recovery (repaired, continued, unrecovered)"),
+    "prompt_analysis_truncation_ratio": ("gauge", "Share of completions cut off at max_tokens, per style"),
+    "prompt_analysis_structured_total": ("counter", "Schema-constrained replies by outcome (valid, invalid and parsed as text, or rejected and retried as text)"),
+    "prompt_analysis_long_prompt_sections_total": ("counter", "Sections of long prompts by outcome (kept, rewritten, failed)"),
+    "prompt_analysis_parse_failure_ratio": ("gauge", "Share of successful provider replies that needed a parse fallback, per provider"),
+    "job_queue_jobs_total": ("counter", "Analysis jobs by outcome (queued, deduplicated, retried, succeeded, failed, lease_lost)"),
+    "job_queue_depth": ("gauge", "Analysis jobs waiting to run"),
+    "job_queue_running": ("gauge", "Analysis jobs leased to a worker"),
+    "job_queue_oldest_age_seconds": ("gauge", "Age of the oldest analysis job ready to run"),
+}
+
+class Histogram:
+    """Cumulative-bucket latency histogram"""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+class MetricsRegistry:
+    """Thread-safe counters, gauges and histograms keyed by name and labels"""
+
+    def __init__(self):
+        self._counters = {}
+        self._gauges = {}
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def set_gauge(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._gauges[key] = value
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def counter_value(self, name, **labels):
+        """Current value of one counter series (0 if never incremented)"""
+        with self._lock:
+            return self._counters.get((name, tuple(sorted(labels.items()))), 0)
+
+    def counter_sum(self, name, by, **labels):
+        """Counter name summed over every series matching labels, grouped by the value of label by"""
+        totals = {}
+        with self._lock:
+            for (series, series_labels), value in self._counters.items():
+                series_labels = dict(series_labels)
+                if series != name or by not in series_labels:
+                    continue
+                if all(series_labels.get(label) == wanted for label, wanted in labels.items()):
+                    totals[series_labels[by]] = totals.get(series_labels[by], 0) + value
+        return totals
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._gauges.clear()
+            self._histograms.clear()
+
+    def render_prometheus(self):
+        """Render every series in the Prometheus text exposition format"""
+        with self._lock:
+            counters = sorted(self._counters.items())
+            gauges = sorted(self._gauges.items())
+            histograms = sorted(self._histograms.items(), key=lambda item: item[0])
+            snapshots = [(key, h.buckets, list(h.counts), h.sum, h.count) for key, h in histograms]
+
+        lines = []
+        described = set()
+
+        def describe(name, default_type):
+            if name in described:
+                return
+            described.add(name)
+            metric_type, help_text = METRIC_HELP.get(name, (default_type, name.replace("_", " ")))
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {metric_type}")
+
+        for (name, labels), value in counters:
+            describe(name, "counter")
+            lines.append(f"{name}{_format_labels(labels)} {value}")
+        for (name, labels), value in gauges:
+            describe(name, "gauge")
+            lines.append(f"{name}{_format_labels(labels)} {value}")
+        for (name, labels), buckets, counts, total, count in snapshots:
+            describe(name, "histogram")
+            cumulative = 0
+            for bound, bucket_count in zip(buckets, counts):
+                cumulative += bucket_count
+                lines.append(f"{name}_bucket{_format_labels(labels + (('le', f'{bound:g}'),))} {cumulative}")
+            lines.append(f"{name}_bucket{_format_labels(labels + (('le', '+Inf'),))} {count}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {total:.6f}")
+            lines.append(f"{name}_count{_format_labels(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    escaped = []
+    for key, value in labels:
+        value = str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        escaped.append(f'{key}="{value}"')
+    return "{" + ",".join(escaped) + "}"
+
+METRICS = MetricsRegistry()
+
+class LatencyTracker:
+    """Sliding window of recent successful latencies per provider/model"""
+
+    def __init__(self, window=200):
+        self.window = window
+        self._samples = {}
+        self._lock = threading.Lock()
+
+    def record(self, provider, model, seconds):
+        with self._lock:
+            samples = self._samples.get((provider, model))
+            if samples is None:
+                samples = self._samples[(provider, model)] = deque(maxlen=self.window)
+            samples.append(seconds)
+
+    def percentile(self, provider, model, q, min_samples=1):
+        """q-th percentile (0-100) of the window, or None with too few samples"""
+        with self._lock:
+            samples = sorted(self._samples.get((provider, model), ()))
+        if len(samples) < max(1, min_samples):
+            return None
+        index = min(len(samples) - 1, int(round(q / 100 * (len(samples) - 1))))
+        return samples[index]
+
+UPSTREAM_LATENCY = LatencyTracker()
+
+# Provider/model labels for the analysis running in the current thread or task
+_analysis_labels = contextvars.ContextVar("analysis_labels", default=("unknown", "unknown"))
+
+@contextmanager
+def metrics_labels(provider, model):
+    """Attribute stage timings inside the block to provider/model"""
+    token = _analysis_labels.set((provider, model))
+    try:
+        yield
+    finally:
+        _analysis_labels.reset(token)
+
+@contextmanager
+def metrics_stage(stage, provider=None, model=None):
+    """Time a block as one analysis stage"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage, time.perf_counter() - start, provider, model)
+
+def observe_stage(stage, seconds, provider=None, model=None):
+    """Record a stage duration, defaulting labels to the current analysis"""
+    if provider is None or model is None:
+        current_provider, current_model = _analysis_labels.get()
+        provider = provider or current_provider
+        model = model or current_model
+    METRICS.observe("prompt_analysis_stage_seconds", seconds, stage=stage, provider=provider, model=model)
+
+def classify_error(message):
+    """Bucket a provider error message into a small set of classes"""
+    text = str(message).lower()
+    if "authentication" in text or "api key" in text or "401" in text:
+        return "auth"
+    if "rate limit" in text or "429" in text:
+        return "rate_limit"
+    if "quota" in text or "insufficient" in text:
+        return "quota"
+    if "timed out" in text or "timeout" in text:
+        return "timeout"
+    if "connection" in text or "resolve" in text or "network" in text:
+        return "connection"
+    if re.search(r"\b50[0-4]\b", text) or "server error" in text or "overloaded" in text or "unavailable" in text:
+        return "server_error"
+    if "not installed" in text:
+        return "not_installed"
+    if "unsupported provider" in text or "please provide" in text:
+        return "invalid_request"
+    return "other"
+
+def record_analysis(provider, model, score, analysis_result, seconds):
+    """Count the outcome of one prompt_analysis call"""
+    if score == "Error":
+        outcome = "error"
+        METRICS.inc("prompt_analysis_errors_total", provider=provider, model=model,
+                    error_class=classify_error(analysis_result))
+    elif isinstance(analysis_result, dict) and analysis_result.get("parse_fallback"):
+        outcome = "fallback"
+        METRICS.inc("prompt_analysis_parse_failures_total", provider=provider, model=model)
+    else:
+        outcome = "ok"
+    if isinstance(analysis_result, dict) and analysis_result.get("math_corrected"):
+        METRICS.inc("prompt_analysis_math_corrected_total", provider=provider, model=model)
+    METRICS.inc("prompt_analysis_requests_total", provider=provider, model=model, outcome=outcome)
+    METRICS.observe("prompt_analysis_seconds", seconds, provider=provider, model=model, outcome=outcome)
+    if outcome == "ok":
+        UPSTREAM_LATENCY.record(provider, model, seconds)
+
+def record_tokens(usage, provider=None, model=None):
+    """Count provider-reported token usage, defaulting labels to the current analysis"""
+    if provider is None or model is None:
+        current_provider, current_model = _analysis_labels.get()
+        provider = provider or current_provider
+        model = model or current_model
+    for kind in ("input", "output", "cached", "cache_write"):
+        tokens = usage.get(f"{kind}_tokens") or 0
+        if tokens:
+            METRICS.inc("prompt_analysis_tokens_total", tokens, provider=provider, model=model, kind=kind)
+
+ANALYSIS_STYLES = ("quick", "comprehensive", "detailed")
+
+def record_completion(style, truncated, recovery=None):
+    """Count one provider completion, and how a truncated one was recovered"""
+    # Unknown styles are analyzed as comprehensive; keep the label bounded too
+    style = style if style in ANALYSIS_STYLES else "comprehensive"
+    METRICS.inc("prompt_analysis_completions_total", style=style, finish="length" if truncated else "stop")
+    if truncated:
+        METRICS.inc("prompt_analysis_truncation_recovery_total", style=style, recovery=recovery)
+
+def truncation_rates():
+    """Share of completions cut off at max_tokens, per style (styles with no completions are left out)"""
+    rates = {}
+    for style in ANALYSIS_STYLES:
+        truncated = METRICS.counter_value("prompt_analysis_completions_total", style=style, finish="length")
+        total = truncated + METRICS.counter_value("prompt_analysis_completions_total", style=style, finish="stop")
+        if total:
+            rates[style] = round(truncated / total, 4)
+    return rates
+
+def record_structured(valid, provider=None, model=None):
+    """Count one schema-constrained reply, defaulting labels to the current analysis"""
+    _record_structured_outcome("valid" if valid else "invalid", provider, model)
+
+def record_structured_rejection(provider=None, model=None):
+    """Count one structured request the model refused, retried as free text"""
+    _record_structured_outcome("rejected", provider, model)
+
+def _record_structured_outcome(outcome, provider, model):
+    if provider is None or model is None:
+        current_provider, current_model = _analysis_labels.get()
+        provider = provider or current_provider
+        model = model or current_model
+    METRICS.inc("prompt_analysis_structured_total", provider=provider, model=model, outcome=outcome)
+
+def record_long_prompt(analysis_result):
+    """Count the sections of one map-reduce analysis by outcome"""
+    if isinstance(analysis_result, dict) and analysis_result.get("long_prompt"):
+        for section in analysis_result["long_prompt"]["sections"]:
+            METRICS.inc("prompt_analysis_long_prompt_sections_total", outcome=section["outcome"])
+
+def parse_failure_rates():
+    """Share of non-error analyses that needed a parse fallback, per provider"""
+    ok = METRICS.counter_sum("prompt_analysis_requests_total", "provider", outcome="ok")
+    fallback = METRICS.counter_sum("prompt_analysis_requests_total", "provider", outcome="fallback")
+    return {
+        provider: round(fallback.get(provider, 0) / (ok.get(provider, 0) + fallback.get(provider, 0)), 4)
+        for provider in set(ok) | set(fallback)
+    }
+
+# Logging - payload dumps are debug-level and sampled so they never flood stdout
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", 0.01))
+
+def log_sampled(logger, msg, *args, level=logging.DEBUG):
+    """Log at level for roughly LOG_SAMPLE_RATE of calls"""
+    if logger.isEnabledFor(level) and random.random() < LOG_SAMPLE_RATE:
+        logger.log(level, msg, *args)
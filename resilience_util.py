@@ -0,0 +1,170 @@
+import os
+import threading
+import time
+from collections import deque
+
+from metrics_util import METRICS, classify_error
+
+# Circuit breaker configuration
+BREAKER_ENABLED = os.getenv("BREAKER_ENABLED", "1") == "1"
+BREAKER_WINDOW = int(os.getenv("BREAKER_WINDOW", 20))
+BREAKER_MIN_CALLS = int(os.getenv("BREAKER_MIN_CALLS", 5))
+BREAKER_ERROR_RATE = float(os.getenv("BREAKER_ERROR_RATE", 0.5))
+BREAKER_SLOW_CALL_SECONDS = float(os.getenv("BREAKER_SLOW_CALL_SECONDS", 20))
+BREAKER_SLOW_CALL_RATE = float(os.getenv("BREAKER_SLOW_CALL_RATE", 0.8))
+BREAKER_OPEN_SECONDS = float(os.getenv("BREAKER_OPEN_SECONDS", 30))
+BREAKER_HALF_OPEN_PROBES = int(os.getenv("BREAKER_HALF_OPEN_PROBES", 1))
+
+# Ordered fallback chain for this deployment, e.g. "groq,together:Qwen/Qwen2.5-72B-Instruct-Turbo,openrouter"
+PROVIDER_FALLBACK_CHAIN = os.getenv("PROVIDER_FALLBACK_CHAIN", "")
+
+# Error classes that mean the caller's request or credentials are at fault,
+# not the provider - these neither trip breakers nor trigger fallback. A 429
+# (from the provider or our own limiter) is the caller's key running dry:
+# failing it over would spend the deployment's keys on one caller's traffic
+CLIENT_ERROR_CLASSES = ("auth", "quota", "rate_limit", "invalid_request")
+
+class CircuitBreaker:
+    """Closed / open / half-open breaker over a rolling window of calls
+
+    Trips open when, over at least min_calls recent calls, the failure rate
+    or the slow-call rate reaches its threshold. After open_seconds it lets
+    half_open_probes calls through; one clean probe closes it again and any
+    failed or slow probe re-opens it.
+    """
+
+    def __init__(self, name, window=BREAKER_WINDOW, min_calls=BREAKER_MIN_CALLS, error_rate=BREAKER_ERROR_RATE,
+                 slow_call_seconds=BREAKER_SLOW_CALL_SECONDS, slow_call_rate=BREAKER_SLOW_CALL_RATE,
+                 open_seconds=BREAKER_OPEN_SECONDS, half_open_probes=BREAKER_HALF_OPEN_PROBES):
+        self.name = name
+        self.min_calls = max(1, min_calls)
+        self.error_rate = error_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.slow_call_rate = slow_call_rate
+        self.open_seconds = open_seconds
+        self.half_open_probes = max(1, half_open_probes)
+        self.state = "closed"
+        self.opened_at = None
+        self.trips = 0
+        self._outcomes = deque(maxlen=max(1, window))  # (failed, slow) per call
+        self._probes = 0
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """Whether a call may go through now"""
+        with self._lock:
+            if self.state == "open":
+                if time.monotonic() - self.opened_at < self.open_seconds:
+                    return False
+                self._transition("half_open")
+                self._probes = 0
+            if self.state == "half_open":
+                if self._probes >= self.half_open_probes:
+                    return False
+                self._probes += 1
+            return True
+
+    def retry_after(self):
+        """Seconds until an open breaker will admit a probe"""
+        with self._lock:
+            if self.state != "open":
+                return 0
+            return max(0.0, self.open_seconds - (time.monotonic() - self.opened_at))
+
+    def record(self, failed, seconds):
+        """Record the outcome of a call admitted by allow()"""
+        slow = seconds >= self.slow_call_seconds
+        with self._lock:
+            if self.state == "half_open":
+                self._probes = max(0, self._probes - 1)
+                if failed or slow:
+                    self._open()
+                else:
+                    self._outcomes.clear()
+                    self._transition("closed")
+                return
+
+            self._outcomes.append((failed, slow))
+            calls = len(self._outcomes)
+            if self.state == "closed" and calls >= self.min_calls:
+                failures = sum(1 for f, _ in self._outcomes if f)
+                slow_calls = sum(1 for _, s in self._outcomes if s)
+                if failures / calls >= self.error_rate or slow_calls / calls >= self.slow_call_rate:
+                    self._open()
+
+    def release(self):
+        """Give back an admitted call that ended without a verdict (e.g. an abandoned stream)"""
+        with self._lock:
+            if self.state == "half_open":
+                self._probes = max(0, self._probes - 1)
+
+    def _open(self):
+        """Trip the breaker (lock held)"""
+        self.opened_at = time.monotonic()
+        self.trips += 1
+        self._outcomes.clear()
+        self._transition("open")
+
+    def _transition(self, state):
+        """Change state and count the transition (lock held)"""
+        if state != self.state:
+            self.state = state
+            provider, _, model = self.name.partition(":")
+            METRICS.inc("circuit_breaker_transitions_total", provider=provider, model=model, state=state)
+
+    def snapshot(self):
+        """State for the status endpoint"""
+        with self._lock:
+            calls = len(self._outcomes)
+            failures = sum(1 for f, _ in self._outcomes if f)
+            slow_calls = sum(1 for _, s in self._outcomes if s)
+            retry_after = 0.0
+            if self.state == "open":
+                retry_after = max(0.0, self.open_seconds - (time.monotonic() - self.opened_at))
+            return {
+                "state": self.state,
+                "window_calls": calls,
+                "error_rate": round(failures / calls, 3) if calls else 0.0,
+                "slow_call_rate": round(slow_calls / calls, 3) if calls else 0.0,
+                "trips": self.trips,
+                "retry_after": round(retry_after, 1)
+            }
+
+class BreakerRegistry:
+    """One breaker per provider/model"""
+
+    def __init__(self):
+        self._breakers = {}
+        self._lock = threading.Lock()
+
+    def get(self, provider, model):
+        name = f"{provider}:{model}"
+        with self._lock:
+            breaker = self._breakers.get(name)
+            if breaker is None:
+                breaker = self._breakers[name] = CircuitBreaker(name)
+        return breaker
+
+    def snapshot(self):
+        with self._lock:
+            breakers = list(self._breakers.items())
+        return {name: breaker.snapshot() for name, breaker in sorted(breakers)}
+
+BREAKERS = BreakerRegistry()
+
+def is_provider_failure(error_message):
+    """Whether an "Error" result is the provider's fault (and worth failing over)"""
+    return classify_error(error_message) not in CLIENT_ERROR_CLASSES
+
+def parse_fallback_chain(spec=PROVIDER_FALLBACK_CHAIN):
+    """Parse "groq,together:model" into [("groq", None), ("together", "model")]"""
+    chain = []
+    for entry in (spec or "").split(","):
+        entry = entry.strip()
+        if not entry:
+            continue
+        provider, _, model = entry.partition(":")
+        chain.append((provider.strip().lower(), model.strip() or None))
+    return chain
+
+FALLBACK_CHAIN = parse_fallback_chain()
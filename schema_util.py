@@ -0,0 +1,189 @@
+import json
+import os
+
+# Structured output - providers that can constrain their reply to JSON are
+# asked for the analysis schema below, and the reply is validated into a
+# StructuredAnalysis instead of being dug out of free text
+STRUCTURED_OUTPUT_ENABLED = os.getenv("STRUCTURED_OUTPUT_ENABLED", "1") == "1"
+
+# Sub-score fields and their maxima, as the analysis templates define them
+SUB_SCORES = {
+    "clarity_score": 25,
+    "context_score": 20,
+    "structure_score": 20,
+    "role_score": 15,
+    "constraints_score": 10,
+    "advanced_score": 10,
+}
+LIST_FIELDS = ("strengths", "weaknesses", "improvements")
+
+# Strict-mode compatible: every property required, nothing extra, and ranges
+# in descriptions rather than minimum/maximum, which strict mode rejects
+ANALYSIS_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "score": {"type": "integer", "description": "Overall score 1-100, the sum of the sub-scores"},
+        **{
+            field: {"type": "integer", "description": f"Integer 1-{maximum}"}
+            for field, maximum in SUB_SCORES.items()
+        },
+        **{field: {"type": "array", "items": {"type": "string"}} for field in LIST_FIELDS},
+        "new_prompt": {"type": "string", "description": "The complete improved prompt"},
+        "reasoning": {"type": "string", "description": "Why the changes improve the prompt"},
+    },
+    "required": ["score", *SUB_SCORES, *LIST_FIELDS, "new_prompt", "reasoning"],
+    "additionalProperties": False,
+}
+
+ANALYSIS_TOOL_NAME = "record_prompt_analysis"
+ANALYSIS_TOOL = {
+    "name": ANALYSIS_TOOL_NAME,
+    "description": "Record the evaluation and improved version of the analyzed prompt.",
+    "input_schema": ANALYSIS_SCHEMA,
+}
+
+# How each provider constrains its output: a strict JSON schema, JSON mode,
+# or (Anthropic) a forced tool call whose input follows the schema
+PROVIDER_STRUCTURED_MODES = {
+    "openai": "json_schema",
+    "openrouter": "json_schema",
+    "together": "json_object",
+    "mistral": "json_object",
+    "groq": "json_object",
+    "anthropic": "tool",
+}
+# Strict json_schema is sent only to these model families, matched by prefix
+# after any "vendor/" routing prefix; a provider's other models get its
+# fallback mode (JSON mode on OpenAI, free text across OpenRouter's catalogue)
+JSON_SCHEMA_MODELS = ("gpt-4o",) + tuple(
+    name.strip() for name in os.getenv("JSON_SCHEMA_MODELS", "").split(",") if name.strip()
+)
+JSON_SCHEMA_FALLBACK_MODES = {"openai": "json_object", "openrouter": None}
+# Models that predate JSON mode or are known not to honour it
+UNSTRUCTURED_MODELS = {"gpt-4", "deepseek-r1-distill-llama-70b"}
+# Groq's JSON mode does not stream, and streamed tool input is not text
+UNSTREAMED_PROVIDERS = {"groq", "anthropic"}
+# Request fields a provider names when it refuses structured output
+STRUCTURED_REQUEST_FIELDS = ("response_format", "json_schema", "json_object", "tool_choice")
+
+# provider/model pairs that answered a structured request with a 400; they
+# get free text from then on. Bounded, since model names come from requests.
+_rejected = set()
+_REJECTED_MAX = 1024
+
+class SchemaError(ValueError):
+    """A structured reply that does not match ANALYSIS_SCHEMA"""
+
+def supports_json_schema(model):
+    """Whether model is on the json_schema allow-list"""
+    name = str(model or "").rpartition("/")[2]
+    return name.startswith(JSON_SCHEMA_MODELS)
+
+def structured_mode(provider, model, stream=False):
+    """"json_schema", "json_object" or "tool" for provider/model, or None to use free text"""
+    if not STRUCTURED_OUTPUT_ENABLED or model in UNSTRUCTURED_MODELS or (provider, model) in _rejected:
+        return None
+    if stream and provider in UNSTREAMED_PROVIDERS:
+        return None
+    mode = PROVIDER_STRUCTURED_MODES.get(provider)
+    if mode == "json_schema" and not supports_json_schema(model):
+        return JSON_SCHEMA_FALLBACK_MODES.get(provider)
+    return mode
+
+def structured_request_params(provider, model, stream=False):
+    """Extra request fields asking provider/model for schema-shaped JSON ({} for free text)"""
+    mode = structured_mode(provider, model, stream)
+    if mode == "tool":
+        return {"tools": [ANALYSIS_TOOL], "tool_choice": {"type": "tool", "name": ANALYSIS_TOOL_NAME}}
+    if mode == "json_schema":
+        return {"response_format": {
+            "type": "json_schema",
+            "json_schema": {"name": "prompt_analysis", "strict": True, "schema": ANALYSIS_SCHEMA}
+        }}
+    if mode == "json_object":
+        response_format = {"type": "json_object"}
+        if provider == "together":
+            # Together constrains JSON mode to a schema passed alongside
+            response_format["schema"] = ANALYSIS_SCHEMA
+        return {"response_format": response_format}
+    return {}
+
+def rejects_structured_output(status, message):
+    """Whether an error (status code and message) is the model refusing the structured-output fields"""
+    text = str(message or "").lower()
+    return status == 400 and any(field in text for field in STRUCTURED_REQUEST_FIELDS)
+
+def note_structured_rejection(provider, model):
+    """Send provider/model free-text requests from now on"""
+    if len(_rejected) < _REJECTED_MAX:
+        _rejected.add((provider, model))
+
+def _integer(data, field, maximum):
+    value = data.get(field)
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or value != int(value):
+        raise SchemaError(f"{field} must be an integer, got {value!r}")
+    # Out-of-range scores are clamped rather than rejected - the rest of the
+    # analysis is still good
+    return min(max(int(value), 0), maximum)
+
+def _strings(data, field):
+    value = data.get(field)
+    if not isinstance(value, list) or not all(isinstance(item, str) for item in value):
+        raise SchemaError(f"{field} must be a list of strings")
+    return [item.strip() for item in value if item.strip()]
+
+class StructuredAnalysis:
+    """An analysis validated against ANALYSIS_SCHEMA"""
+
+    __slots__ = ("score", "sub_scores", "strengths", "weaknesses", "improvements", "new_prompt", "reasoning")
+
+    def __init__(self, score, sub_scores, strengths, weaknesses, improvements, new_prompt, reasoning):
+        self.score = score
+        self.sub_scores = sub_scores
+        self.strengths = strengths
+        self.weaknesses = weaknesses
+        self.improvements = improvements
+        self.new_prompt = new_prompt
+        self.reasoning = reasoning
+
+    @classmethod
+    def from_json(cls, text):
+        """Validate a JSON reply; raises SchemaError"""
+        try:
+            data = json.loads(text) if isinstance(text, str) else text
+        except ValueError as e:
+            raise SchemaError(f"Reply is not JSON: {e}") from None
+        return cls.from_dict(data)
+
+    @classmethod
+    def from_dict(cls, data):
+        """Validate decoded JSON; raises SchemaError"""
+        if not isinstance(data, dict):
+            raise SchemaError("Reply is not a JSON object")
+        new_prompt = data.get("new_prompt")
+        if not isinstance(new_prompt, str) or not new_prompt.strip():
+            raise SchemaError("new_prompt must be a non-empty string")
+        reasoning = data.get("reasoning")
+        if not isinstance(reasoning, str):
+            raise SchemaError("reasoning must be a string")
+        return cls(
+            score=_integer(data, "score", 100),
+            sub_scores={field: _integer(data, field, maximum) for field, maximum in SUB_SCORES.items()},
+            strengths=_strings(data, "strengths"),
+            weaknesses=_strings(data, "weaknesses"),
+            improvements=_strings(data, "improvements"),
+            new_prompt=new_prompt.strip(),
+            reasoning=reasoning.strip(),
+        )
+
+    def as_dict(self):
+        """The reply in the templates' field layout"""
+        return {
+            "score": self.score,
+            **self.sub_scores,
+            "strengths": self.strengths,
+            "weaknesses": self.weaknesses,
+            "improvements": self.improvements,
+            "new_prompt": self.new_prompt,
+            "reasoning": self.reasoning,
+        }
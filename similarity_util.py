@@ -0,0 +1,167 @@
+import os
+import re
+import threading
+from array import array
+from collections import OrderedDict
+
+# Near-duplicate reuse - a prompt that is nearly identical to one already
+# analyzed (same provider, model, style and settings) can be answered with
+# that analysis, flagged as approximate
+NEAR_DUP_ENABLED = os.getenv("NEAR_DUP_ENABLED", "1") == "1"
+NEAR_DUP_THRESHOLD = float(os.getenv("NEAR_DUP_THRESHOLD", 0.85))
+# About 1.2 KB of index per entry
+NEAR_DUP_MAX_ENTRIES = int(os.getenv("NEAR_DUP_MAX_ENTRIES", 50000))
+NEAR_DUP_SHINGLE_WORDS = int(os.getenv("NEAR_DUP_SHINGLE_WORDS", 2))
+
+# Signature layout: NUM_BINS one-permutation MinHash bins, banded for LSH
+NUM_BINS = 64
+BANDS = 8
+ROWS = NUM_BINS // BANDS
+
+_MASK64 = (1 << 64) - 1
+_BIN_BITS = NUM_BINS.bit_length() - 1
+_WORD = re.compile(r"\w+")
+
+def shingles(text, size=NEAR_DUP_SHINGLE_WORDS):
+    """Overlapping size-word shingles of the lower-cased text (the whole text if shorter)"""
+    words = _WORD.findall(str(text).lower())
+    if len(words) <= size:
+        return {" ".join(words)} if words else set()
+    return {" ".join(words[index:index + size]) for index in range(len(words) - size + 1)}
+
+def minhash_signature(text):
+    """One-permutation MinHash signature of text's shingles, NUM_BINS values
+
+    Each shingle is hashed once; the low bits pick a bin and the rest are
+    the value, and each bin keeps its minimum. Empty bins borrow from the
+    next filled bin (densification), so short texts still compare fairly.
+    This costs one hash per shingle instead of one per shingle and bin.
+    Hashes are process-local (str hash randomization), like the index.
+    """
+    bins = [None] * NUM_BINS
+    for shingle in shingles(text):
+        h = hash(shingle) & _MASK64
+        slot = h & (NUM_BINS - 1)
+        value = h >> _BIN_BITS
+        current = bins[slot]
+        if current is None or value < current:
+            bins[slot] = value
+    if all(value is None for value in bins):
+        return None
+    for slot in range(NUM_BINS):
+        if bins[slot] is None:
+            distance = 1
+            while bins[(slot + distance) % NUM_BINS] is None:
+                distance += 1
+            # Offset by distance so borrowed values only match the same borrowing
+            bins[slot] = (bins[(slot + distance) % NUM_BINS] + distance * 0x9E3779B97F4A7C15) & _MASK64
+    # 32 bits per bin keep the collision rate negligible and the signature small
+    return array("I", (value & 0xFFFFFFFF for value in bins))
+
+def estimate_similarity(left, right):
+    """Estimated Jaccard similarity of two signatures"""
+    return sum(1 for a, b in zip(left, right) if a == b) / NUM_BINS
+
+class NearDuplicateIndex:
+    """Thread-safe LSH index from MinHash signatures to cache keys
+
+    Each signature is split into BANDS bands of ROWS values; a prompt is a
+    candidate neighbour when any band matches exactly, and candidates are
+    confirmed by estimated similarity. Lookups touch BANDS dict slots and a
+    handful of candidates, so they cost the same at any index size. The
+    index is bounded and least recently added entries are dropped first.
+    """
+
+    def __init__(self, threshold=NEAR_DUP_THRESHOLD, max_entries=NEAR_DUP_MAX_ENTRIES):
+        self.threshold = float(threshold)
+        self.max_entries = max(1, int(max_entries))
+        self._entries = OrderedDict()  # cache key -> (signature, band hashes)
+        # band hash -> cache key, or a set of them once two share the band;
+        # most bands are unique, and a bare key is far smaller than a set
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self.lookups = 0
+        self.hits = 0
+
+    @staticmethod
+    def _band_hashes(namespace, signature):
+        return array("q", (hash((namespace, band, tuple(signature[band * ROWS:(band + 1) * ROWS])))
+                           for band in range(BANDS)))
+
+    def add(self, text, key, namespace=""):
+        """Index text under cache key; namespace keeps incompatible analyses apart"""
+        signature = minhash_signature(text)
+        if signature is None:
+            return
+        bands = self._band_hashes(namespace, signature)
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = (signature, bands)
+            for band in bands:
+                bucket = self._buckets.get(band)
+                if bucket is None:
+                    self._buckets[band] = key
+                elif isinstance(bucket, set):
+                    bucket.add(key)
+                elif bucket != key:
+                    self._buckets[band] = {bucket, key}
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def lookup(self, text, namespace="", exclude=None):
+        """Most similar indexed key at or above the threshold, as (key, similarity), or None"""
+        signature = minhash_signature(text)
+        if signature is None:
+            return None
+        bands = self._band_hashes(namespace, signature)
+        best = None
+        with self._lock:
+            self.lookups += 1
+            candidates = set()
+            for band in bands:
+                bucket = self._buckets.get(band)
+                if isinstance(bucket, set):
+                    candidates.update(bucket)
+                elif bucket is not None:
+                    candidates.add(bucket)
+            candidates.discard(exclude)
+            for key in candidates:
+                similarity = estimate_similarity(signature, self._entries[key][0])
+                if similarity >= self.threshold and (best is None or similarity > best[1]):
+                    best = (key, similarity)
+            if best:
+                self.hits += 1
+        return best
+
+    def discard(self, key):
+        """Forget key, e.g. once its cached analysis has expired"""
+        with self._lock:
+            self._remove(key)
+
+    def _remove(self, key):
+        """Drop key from the index (lock held)"""
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        for band in entry[1]:
+            bucket = self._buckets.get(band)
+            if isinstance(bucket, set):
+                bucket.discard(key)
+                if len(bucket) == 1:
+                    self._buckets[band] = next(iter(bucket))
+            elif bucket == key:
+                del self._buckets[band]
+
+    def stats(self):
+        with self._lock:
+            return {
+                "enabled": NEAR_DUP_ENABLED,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "threshold": self.threshold,
+                "lookups": self.lookups,
+                "hits": self.hits,
+                "hit_rate": round(self.hits / self.lookups, 4) if self.lookups else 0.0
+            }
+
+NEAR_DUP_INDEX = NearDuplicateIndex()
@@ -0,0 +1,11 @@
+import os
+import sys
+
+# Keep imports side-effect free: no shared store, no prewarm, no job threads
+os.environ.setdefault("ANALYSIS_STORE_ENABLED", "0")
+os.environ.setdefault("HTTP_PREWARM", "0")
+os.environ.setdefault("JOB_WORKERS", "0")
+os.environ.setdefault("NEAR_DUP_REFRESH", "0")
+os.environ.setdefault("LOG_LEVEL", "ERROR")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,106 @@
+import gzip
+import logging
+import re
+
+import pytest
+
+import asset_util
+from asset_util import AssetPipeline, ASSET_PREFIX
+
+CSS = "body {\n    color: red;\n}\n" + "".join(f".rule-{i} {{ margin: {i}px; }}\n" for i in range(60))
+JS = "// setup\nconst greeting = 'hello';\n" + "".join(f"console.log(greeting, {i});\n" for i in range(60))
+PAGE = (f"<html>\n  <head>\n    <style>{CSS}</style>\n  </head>\n"
+        f"  <body>\n    <script>{JS}</script>\n  </body>\n</html>\n")
+
+class FakeBrotli:
+    @staticmethod
+    def compress(body, quality=11):
+        return b"br:" + body
+
+@pytest.fixture(autouse=True)
+def fake_brotli(monkeypatch):
+    monkeypatch.setattr(asset_util, "_brotli", lambda: FakeBrotli)
+
+def make_pipeline(tmp_path, page=PAGE, allow_list=()):
+    (tmp_path / "index.html").write_text(page)
+    return AssetPipeline(root=str(tmp_path), allow_list=allow_list, reload=False)
+
+def asset_paths(pipeline, kind):
+    return [path for path in pipeline.build() if path.startswith(ASSET_PREFIX) and path.endswith(kind)]
+
+def test_inline_blocks_move_to_fingerprinted_files(tmp_path):
+    pipeline = make_pipeline(tmp_path)
+    [css_path], [js_path] = asset_paths(pipeline, ".css"), asset_paths(pipeline, ".js")
+    assert re.fullmatch(r"/assets/index\.[0-9a-f]{12}\.css", css_path)
+    page, status, headers = pipeline.respond("/")
+    assert status == 200 and headers["Cache-Control"] == "no-cache"
+    assert f'href="{css_path}"'.encode() in page and f'src="{js_path}"'.encode() in page
+    assert b"<style>" not in page
+    body, _, headers = pipeline.respond(css_path)
+    assert headers["Cache-Control"].endswith("immutable") and body.startswith(b"body{color: red}.rule-0{margin: 0px}")
+
+def test_fingerprint_follows_the_content(tmp_path):
+    [before] = asset_paths(make_pipeline(tmp_path), ".css")
+    [after] = asset_paths(make_pipeline(tmp_path, PAGE.replace("color: red", "color: blue")), ".css")
+    [again] = asset_paths(make_pipeline(tmp_path), ".css")
+    assert before != after and before == again
+
+def test_matching_etag_is_a_304(tmp_path):
+    pipeline = make_pipeline(tmp_path)
+    [css_path] = asset_paths(pipeline, ".css")
+    _, _, headers = pipeline.respond(css_path, "gzip")
+    body, status, _ = pipeline.respond(css_path, "gzip", headers["ETag"])
+    assert status == 304 and body == b""
+    assert pipeline.respond(css_path, "gzip", f'"other", W/{headers["ETag"]}')[1] == 304
+    assert pipeline.respond(css_path, "gzip", "*")[1] == 304
+    # The identity body is a different representation with its own tag
+    assert pipeline.respond(css_path, None, headers["ETag"])[1] == 200
+
+@pytest.mark.parametrize("accept_encoding, encoding", [
+    ("gzip, deflate, br", "br"),
+    ("gzip", "gzip"),
+    ("br;q=0, gzip", "gzip"),
+    ("gzip;q=0", "identity"),
+    (None, "identity"),
+])
+def test_encoding_negotiation(tmp_path, accept_encoding, encoding):
+    pipeline = make_pipeline(tmp_path)
+    [js_path] = asset_paths(pipeline, ".js")
+    body, status, headers = pipeline.respond(js_path, accept_encoding)
+    assert status == 200 and headers["Vary"] == "Accept-Encoding"
+    assert headers.get("Content-Encoding", "identity") == encoding
+    identity = pipeline.respond(js_path)[0]
+    if encoding == "gzip":
+        assert gzip.decompress(body) == identity
+    elif encoding == "br":
+        assert body == b"br:" + identity
+
+def test_small_bodies_are_not_compressed(tmp_path):
+    pipeline = make_pipeline(tmp_path, "<html><body>Hi</body></html>")
+    _, _, headers = pipeline.respond("/", "gzip, br")
+    assert "Content-Encoding" not in headers and "Vary" not in headers
+
+def test_missing_allow_listed_file_is_skipped(tmp_path, caplog):
+    (tmp_path / "robots.txt").write_text("User-agent: *\n")
+    pipeline = make_pipeline(tmp_path, allow_list=("robots.txt", "favicon.ico"))
+    with caplog.at_level(logging.WARNING, logger="asset_util"):
+        assert pipeline.respond("/")[1] == 200
+    assert "favicon.ico" in caplog.text
+    assert pipeline.respond("/robots.txt")[0] == b"User-agent: *\n"
+    assert pipeline.respond("/favicon.ico") is None
+
+def test_page_that_fails_to_build_is_served_unprocessed(tmp_path, monkeypatch):
+    def broken(html):
+        raise ValueError("unbalanced")
+
+    monkeypatch.setattr(asset_util, "minify_html", broken)
+    pipeline = make_pipeline(tmp_path)
+    body, status, headers = pipeline.respond("/", "gzip, br")
+    assert status == 200 and body == PAGE.encode() and "Content-Encoding" not in headers
+    assert not asset_paths(pipeline, ".css")
+
+def test_only_built_paths_are_served(tmp_path):
+    (tmp_path / "secret.py").write_text("KEY = 1")
+    pipeline = make_pipeline(tmp_path)
+    assert pipeline.respond("/secret.py") is None
+    assert pipeline.respond("/assets/index.000000000000.css") is None
@@ -0,0 +1,81 @@
+import argparse
+import json
+
+import pytest
+
+import bulk_analyze
+from bulk_analyze import analyze_record, retry_delay, run
+
+ANALYSIS = {"score": 70, "new_prompt": "Better"}
+
+def make_args(tmp_path, **overrides):
+    args = dict(input=str(tmp_path / "prompts.jsonl"), output=str(tmp_path / "results.jsonl"), format=None,
+                prompt_field=None, id_field=None, provider="local", model=None, style="quick", temperature=0.7,
+                api_key=None, concurrency="", default_concurrency=2, max_pending=None, no_fallback=True,
+                retries=2, retry_backoff=0.0, checkpoint=None, checkpoint_every=1, restart=False, limit=None,
+                no_count=False, progress_interval=3600.0)
+    args.update(overrides)
+    return argparse.Namespace(**args)
+
+def fake_analysis(replies):
+    """prompt_analysis stand-in answering each prompt from its queue of replies (the last one repeats)"""
+    calls = []
+
+    def prompt_analysis(prompt, *args, **kwargs):
+        calls.append(prompt)
+        queue = replies[prompt]
+        return queue.pop(0) if len(queue) > 1 else queue[0]
+
+    return prompt_analysis, calls
+
+def write_prompts(args, prompts):
+    with open(args.input, "w") as f:
+        for prompt in prompts:
+            f.write(json.dumps({"prompt": prompt}) + "\n")
+
+def read_results(args):
+    with open(args.output) as f:
+        return [json.loads(line) for line in f]
+
+def test_transient_errors_are_retried(monkeypatch, tmp_path):
+    prompt_analysis, calls = fake_analysis({"a": [("Error", "Groq API error: 503 Service Unavailable"),
+                                                  ("Error", "Groq API error: Request timed out"), (70, ANALYSIS)]})
+    monkeypatch.setattr(bulk_analyze, "prompt_analysis", prompt_analysis)
+    result = analyze_record(0, {"prompt": "a"}, make_args(tmp_path))
+    assert result["status"] == "ok" and result["attempts"] == 3 and len(calls) == 3
+
+def test_permanent_errors_are_not_retried(monkeypatch, tmp_path):
+    prompt_analysis, calls = fake_analysis({"a": [("Error", "Groq API error: Invalid API key")]})
+    monkeypatch.setattr(bulk_analyze, "prompt_analysis", prompt_analysis)
+    result = analyze_record(0, {"prompt": "a"}, make_args(tmp_path))
+    assert result["error_class"] == "auth" and len(calls) == 1
+
+def test_retry_waits_at_least_the_hinted_time():
+    assert retry_delay(0, 0.0, "Groq rate limit reached (client-side); retry in 7s") == 7
+    assert 2.0 <= retry_delay(2, 1.0, "Groq API error: timed out") <= 4.0
+
+def test_records_still_failing_transiently_run_again_on_resume(monkeypatch, tmp_path):
+    args = make_args(tmp_path)
+    write_prompts(args, ["a", "b", "c"])
+    prompt_analysis, _ = fake_analysis({"a": [(70, ANALYSIS)], "b": [("Error", "Groq rate limit exceeded (429)")],
+                                        "c": [("Error", "Groq API error: Invalid API key")]})
+    monkeypatch.setattr(bulk_analyze, "prompt_analysis", prompt_analysis)
+    summary = run(args)
+    assert summary["ok"] == 1 and summary["errors"] == 1 and summary["deferred"] == 1
+    assert sorted(result["index"] for result in read_results(args)) == [0, 2]
+
+    prompt_analysis, calls = fake_analysis({"b": [(60, ANALYSIS)]})
+    monkeypatch.setattr(bulk_analyze, "prompt_analysis", prompt_analysis)
+    summary = run(args)
+    assert calls == ["b"]
+    assert summary["ok"] == 2 and summary["errors"] == 1 and summary["deferred"] == 0
+    assert sorted(result["index"] for result in read_results(args)) == [0, 1, 2]
+
+@pytest.mark.parametrize("message, error_class", [
+    ("Mistral AI API error: 502 - Bad Gateway", "server_error"),
+    ("Anthropic API error: Overloaded", "server_error"),
+    ("Groq is temporarily unavailable (circuit open); retry in 30s", "server_error"),
+    ("Groq API error: Invalid API key", "auth"),
+])
+def test_error_classes(message, error_class):
+    assert bulk_analyze.classify_error(message) == error_class
@@ -0,0 +1,110 @@
+import pytest
+
+import cache_util
+from cache_util import ResultCache, SharedResultStore, is_cacheable, make_cache_key
+
+class FakeClock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(cache_util.time, "monotonic", clock)
+    monkeypatch.setattr(cache_util.time, "time", clock)
+    return clock
+
+def test_cache_key_ignores_whitespace_differences():
+    assert make_cache_key("Write  a\n poem ", "groq", "m") == make_cache_key("Write a poem", "groq", "m")
+
+def test_cache_key_scopes_every_parameter():
+    base = make_cache_key("Write a poem", "groq", "m", "comprehensive", 0.7, 1000)
+    variants = [
+        make_cache_key("Write a story", "groq", "m", "comprehensive", 0.7, 1000),
+        make_cache_key("Write a poem", "openai", "m", "comprehensive", 0.7, 1000),
+        make_cache_key("Write a poem", "groq", "other", "comprehensive", 0.7, 1000),
+        make_cache_key("Write a poem", "groq", "m", "quick", 0.7, 1000),
+        make_cache_key("Write a poem", "groq", "m", "comprehensive", 0.2, 1000),
+        make_cache_key("Write a poem", "groq", "m", "comprehensive", 0.7, 500),
+    ]
+    assert base not in variants
+    assert len(set(variants)) == len(variants)
+
+def test_cache_key_normalizes_provider_and_numbers():
+    assert make_cache_key("q", " GROQ ", "m", temp="0.70", max_token="1000") == \
+        make_cache_key("q", "groq", "m", temp=0.7, max_token=1000)
+
+def test_result_cache_expires_entries(clock):
+    cache = ResultCache(max_entries=10, max_bytes=10000, ttl=60)
+    cache.set("k", ["score", {"a": 1}])
+    clock.now += 59
+    assert cache.get("k") == ["score", {"a": 1}]
+    clock.now += 2
+    assert cache.get("k") is None
+    assert cache.stats()["entries"] == 0
+    assert (cache.stats()["hits"], cache.stats()["misses"]) == (1, 1)
+
+def test_result_cache_evicts_least_recently_used(clock):
+    cache = ResultCache(max_entries=2, max_bytes=10000, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1 and cache.get("c") == 3
+    assert cache.stats()["evictions"] == 1
+
+def test_result_cache_enforces_byte_budget(clock):
+    cache = ResultCache(max_entries=100, max_bytes=20, ttl=60)
+    cache.set("a", "x" * 10)
+    cache.set("b", "y" * 10)
+    stats = cache.stats()
+    assert stats["entries"] == 1 and stats["bytes"] <= 20
+    assert cache.get("b") == "y" * 10
+    # Larger than the whole budget: never stored
+    cache.set("big", "z" * 100)
+    assert cache.get("big") is None
+
+def test_result_cache_replacing_a_key_keeps_byte_count(clock):
+    cache = ResultCache(max_entries=10, max_bytes=10000, ttl=60)
+    cache.set("a", "x" * 10)
+    cache.set("a", "x" * 20)
+    assert cache.stats()["bytes"] == len('"' + "x" * 20 + '"')
+
+def test_shared_store_round_trip_and_ttl(tmp_path, clock):
+    store = SharedResultStore(str(tmp_path / "cache.db"), max_entries=10, max_bytes=100000, ttl=60)
+    store.set("k", (80, {"overall_score": 80}))
+    assert store.get("k") == (80, {"overall_score": 80})
+    clock.now += 61
+    assert store.get("k") is None
+    assert store.trim() == 1
+
+def test_shared_store_trims_oldest_first(tmp_path, clock):
+    store = SharedResultStore(str(tmp_path / "cache.db"), max_entries=3, max_bytes=100000, ttl=600)
+    for index in range(5):
+        clock.now += 1
+        store.set(f"k{index}", (index, {}))
+    store.trim()
+    assert store.stats()["entries"] == 3
+    assert [key for key, _ in store.recent(10)] == ["k4", "k3", "k2"]
+
+def test_shared_store_is_shared_between_instances(tmp_path, clock):
+    path = str(tmp_path / "cache.db")
+    SharedResultStore(path, ttl=60).set("k", (80, {"overall_score": 80}))
+    assert SharedResultStore(path, ttl=60).get("k") == (80, {"overall_score": 80})
+
+@pytest.mark.parametrize("score, result, expected", [
+    (80, {"overall_score": 80}, True),
+    ("Error", "boom", False),
+    (80, {"parse_fallback": True}, False),
+    (80, {"truncation_repaired": True}, False),
+    (80, {"served_by": {"provider": "openai"}}, False),
+    (80, {"long_prompt": {"failed": 1, "parse_fallbacks": 0}}, False),
+    (80, {"long_prompt": {"failed": 0, "parse_fallbacks": 2}}, False),
+    (80, {"long_prompt": {"failed": 0, "parse_fallbacks": 0}}, True),
+])
+def test_is_cacheable(score, result, expected):
+    assert is_cacheable(score, result) is expected
@@ -0,0 +1,96 @@
+import threading
+
+import pytest
+
+import app_util
+from app_util import ClientRegistry
+
+class FakeClient:
+    def __init__(self, name):
+        self.name = name
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(app_util.time, "monotonic", lambda: now[0])
+    return now
+
+def factory(name, built):
+    def build():
+        client = FakeClient(name)
+        built.append(client)
+        return client
+    return build
+
+def test_one_client_per_provider_and_key(clock):
+    registry, built = ClientRegistry(max_size=8, idle_ttl=60, close_grace=0), []
+    first = registry.get("groq", "key-a", factory("a", built))
+    assert registry.get("groq", "key-a", factory("again", built)) is first
+    assert registry.get("groq", "key-b", factory("b", built)) is not first
+    assert registry.get("openai", "key-a", factory("c", built)) is not first
+    assert registry.get("groq", "key-a", factory("d", built), base_url="http://mock/v1") is not first
+    assert [client.name for client in built] == ["a", "b", "c", "d"]
+    assert len(registry) == 4
+
+def test_api_keys_are_not_held_in_the_keys():
+    key = ClientRegistry.make_key("groq", "gsk_secret")
+    assert "gsk_secret" not in repr(key)
+
+def test_least_recently_used_client_is_evicted_and_closed(clock):
+    registry, built = ClientRegistry(max_size=2, idle_ttl=60, close_grace=0), []
+    a = registry.get("groq", "a", factory("a", built))
+    b = registry.get("groq", "b", factory("b", built))
+    registry.get("groq", "a", factory("unused", built))
+    registry.get("groq", "c", factory("c", built))
+    assert b.closed and not a.closed
+    assert registry.get("groq", "b", factory("b2", built)) is not b
+
+def test_idle_client_is_rotated_out_and_closed(clock):
+    registry, built = ClientRegistry(max_size=8, idle_ttl=60, close_grace=0), []
+    old = registry.get("groq", "a", factory("old", built))
+    clock[0] += 61
+    new = registry.get("groq", "a", factory("new", built))
+    assert new is not old
+    assert old.closed and not new.closed
+
+def test_evicted_client_is_closed_only_after_the_grace_period(clock):
+    registry, built = ClientRegistry(max_size=1, idle_ttl=3600, close_grace=600), []
+    a = registry.get("groq", "a", factory("a", built))
+    registry.get("groq", "b", factory("b", built))
+    assert not a.closed
+    clock[0] += 599
+    registry.get("groq", "b", factory("unused", built))
+    assert not a.closed
+    clock[0] += 1
+    registry.get("groq", "b", factory("unused", built))
+    assert a.closed
+
+def test_without_a_grace_period_clients_are_never_closed(clock):
+    registry, built = ClientRegistry(max_size=1, idle_ttl=60, close_grace=None), []
+    a = registry.get("groq", "a", factory("a", built))
+    registry.get("groq", "b", factory("b", built))
+    clock[0] += 10000
+    registry.get("groq", "c", factory("c", built))
+    assert not a.closed
+
+def test_concurrent_misses_share_one_client():
+    registry, built = ClientRegistry(max_size=8, idle_ttl=60, close_grace=0), []
+    start = threading.Barrier(8)
+    clients = []
+
+    def worker():
+        start.wait()
+        clients.append(registry.get("groq", "key", factory("x", built)))
+
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len({id(client) for client in clients}) == 1
+    assert [client for client in built if client is not clients[0]] == \
+        [client for client in built if client.closed]
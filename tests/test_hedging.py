@@ -0,0 +1,53 @@
+import time
+
+import pytest
+
+import app_util
+from app_util import hedge_served_by
+from cache_util import is_cacheable
+
+@pytest.fixture
+def legs(monkeypatch):
+    """prompt_analysis stand-in: the primary leg is slow, the secondary answers at once"""
+    calls = []
+
+    def fake_prompt_analysis(query, api_key, temp, max_token, provider, model, style, fallback=True):
+        calls.append((provider, model))
+        if len(calls) == 1:
+            time.sleep(0.3)
+        return 80, {"overall_score": 80, "new_prompt": f"from {provider}/{model}"}
+
+    monkeypatch.setattr(app_util, "prompt_analysis", fake_prompt_analysis)
+    monkeypatch.setattr(app_util, "get_hedge_delay", lambda provider, model: 0.01)
+    return calls
+
+def hedged(hedge):
+    return app_util._hedged_analysis("Write a poem", "key", 0.7, 1000, "groq", None, "comprehensive", hedge)
+
+def test_secondary_win_on_another_model_is_not_cacheable(legs):
+    score, result = hedged({"provider": "openai", "model": "gpt-4o-mini"})
+    assert result["hedge"]["winner"] == "secondary"
+    assert result["served_by"] == {"provider": "openai", "model": "gpt-4o-mini", "hedge": True}
+    assert not is_cacheable(score, result)
+
+def test_secondary_win_on_the_same_model_is_cacheable(legs):
+    default_model = app_util.PROVIDER_CONFIGS["groq"]["default_model"]
+    score, result = hedged({"model": default_model, "api_key": "other-key"})
+    assert result["hedge"]["winner"] == "secondary"
+    assert "served_by" not in result
+    assert is_cacheable(score, result)
+
+def test_primary_win_is_cacheable(legs, monkeypatch):
+    monkeypatch.setattr(app_util, "get_hedge_delay", lambda provider, model: 1.0)
+    score, result = hedged({"provider": "openai"})
+    assert result["hedge"] == dict(result["hedge"], winner="primary", hedged=False)
+    assert is_cacheable(score, result)
+
+@pytest.mark.parametrize("provider, model, hedge_provider, hedge_model, expected", [
+    ("groq", None, "groq", None, None),
+    ("GROQ", None, "groq", app_util.PROVIDER_CONFIGS["groq"]["default_model"], None),
+    ("groq", None, "openai", None, {"provider": "openai", "model": "gpt-4o-mini", "hedge": True}),
+    ("openai", "gpt-4o", "openai", "gpt-4o-mini", {"provider": "openai", "model": "gpt-4o-mini", "hedge": True}),
+])
+def test_hedge_served_by(provider, model, hedge_provider, hedge_model, expected):
+    assert hedge_served_by(provider, model, hedge_provider, hedge_model) == expected
@@ -0,0 +1,107 @@
+import pytest
+
+import job_util
+from job_util import JobQueue
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(job_util.time, "time", lambda: now[0])
+    return now
+
+@pytest.fixture
+def queue(tmp_path, clock):
+    return JobQueue(str(tmp_path / "jobs.db"), workers=0, max_attempts=3, lease_seconds=60, result_ttl=600)
+
+REQUEST = {"query": "Write a poem", "provider": "groq", "api_key": "secret-key"}
+
+def test_identical_submissions_share_a_job(queue):
+    job_id, deduplicated = queue.submit(REQUEST, "identity")
+    assert not deduplicated
+    assert queue.submit(dict(REQUEST), "identity") == (job_id, True)
+    assert queue.submit(dict(REQUEST, api_key="other-key"), "identity")[1] is False
+    assert queue.submit(REQUEST, "other-identity")[1] is False
+    assert queue.submit(dict(REQUEST, approximate=True), "identity")[1] is False
+
+def test_claim_leases_the_oldest_job_once(queue, clock):
+    first, _ = queue.submit(REQUEST, "a")
+    clock[0] += 1
+    second, _ = queue.submit(REQUEST, "b")
+    assert queue.claim() == (first, REQUEST, 1)
+    assert queue.claim() == (second, REQUEST, 1)
+    assert queue.claim() is None
+    assert queue.get(first)["status"] == "running"
+
+def test_success_finishes_and_redacts(queue):
+    job_id, _ = queue.submit(REQUEST, "a")
+    job_id, data, attempt = queue.claim()
+    assert queue.complete(job_id, {"score": 80}, 200, attempt)
+    job = queue.get(job_id)
+    assert job["status"] == "succeeded"
+    assert job["result"] == {"score": 80} and job["result_status"] == 200
+    assert queue._request(job_id)["api_key"] != "secret-key"
+    # A live result still deduplicates
+    assert queue.submit(REQUEST, "a") == (job_id, True)
+
+def test_retryable_failure_is_requeued_with_backoff(queue, clock, monkeypatch):
+    monkeypatch.setattr(job_util, "JOB_RETRY_BASE_DELAY", 2.0)
+    job_id, _ = queue.submit(REQUEST, "a")
+    _, _, attempt = queue.claim()
+    assert queue.complete(job_id, {"error": "Service unavailable"}, 503, attempt)
+    job = queue.get(job_id)
+    assert job["status"] == "queued" and job["retry_at"] == clock[0] + 2.0
+    assert job["error"] == "Service unavailable"
+    assert queue.claim() is None
+    clock[0] += 2.0
+    assert queue.claim() == (job_id, REQUEST, 2)
+    assert queue.complete(job_id, {"error": "Rate limited", "retry_after": 30}, 429, 2)
+    assert queue.get(job_id)["retry_at"] == clock[0] + 30
+
+def test_retries_stop_at_max_attempts(queue, clock):
+    job_id, _ = queue.submit(REQUEST, "a")
+    for attempt in (1, 2, 3):
+        clock[0] += 120
+        assert queue.claim() == (job_id, REQUEST, attempt)
+        assert queue.complete(job_id, {"error": "Bad gateway"}, 502, attempt)
+    job = queue.get(job_id)
+    assert job["status"] == "failed" and job["attempts"] == 3
+    assert job["result_status"] == 502
+
+def test_client_errors_are_not_retried(queue):
+    job_id, _ = queue.submit(REQUEST, "a")
+    _, _, attempt = queue.claim()
+    assert queue.complete(job_id, {"error": "Invalid API key"}, 401, attempt)
+    assert queue.get(job_id)["status"] == "failed"
+
+def test_expired_lease_is_reclaimed_and_the_late_result_discarded(queue, clock):
+    job_id, _ = queue.submit(REQUEST, "a")
+    assert queue.claim()[2] == 1
+    clock[0] += 30
+    assert queue.claim() is None
+    clock[0] += 31
+    assert queue.claim() == (job_id, REQUEST, 2)
+    assert not queue.complete(job_id, {"score": 10}, 200, 1)
+    assert queue.get(job_id)["status"] == "running"
+    assert queue.complete(job_id, {"score": 80}, 200, 2)
+    assert queue.get(job_id)["result"] == {"score": 80}
+    assert not queue.complete(job_id, {"score": 10}, 200, 2)
+
+def test_trim_removes_expired_results(queue, clock):
+    job_id, _ = queue.submit(REQUEST, "a")
+    queue.complete(job_id, {"score": 80}, 200, queue.claim()[2])
+    clock[0] += 599
+    assert queue.trim() == 0
+    clock[0] += 2
+    assert queue.trim() == 1
+    assert queue.get(job_id) is None
+    # The expired result no longer deduplicates
+    assert queue.submit(REQUEST, "a")[1] is False
+
+def test_stats(queue, clock):
+    queue.submit(REQUEST, "a")
+    queue.submit(REQUEST, "b")
+    queue.claim()
+    clock[0] += 5
+    stats = queue.stats()
+    assert (stats["depth"], stats["running"], stats["workers"]) == (1, 1, 0)
+    assert stats["oldest_age_seconds"] == 5.0
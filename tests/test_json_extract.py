@@ -0,0 +1,74 @@
+import json
+import time
+
+import pytest
+
+from app_util import _parse_response, extract_json_object
+
+REPLY = {"score": 40, "clarity_score": 7, "new_prompt": "Write {a} poem", "strengths": ["clear"]}
+
+@pytest.mark.parametrize("text", [
+    json.dumps(REPLY),
+    "Here is the analysis:\n" + json.dumps(REPLY) + "\nHope this helps {really}.",
+    "Note: {not json} and {\"also\": broken}\n```json\n" + json.dumps(REPLY, indent=2) + "\n```",
+    "Use {braces} freely. " + json.dumps(REPLY) + " trailing } brace",
+])
+def test_finds_the_object_among_prose(text):
+    assert extract_json_object(text) == (REPLY, False)
+
+def test_takes_the_first_object_not_the_widest_match():
+    text = '{"a": 1} and later {"b": 2}'
+    assert extract_json_object(text) == ({"a": 1}, False)
+
+def test_braces_inside_strings_do_not_unbalance_it():
+    text = 'x {"new_prompt": "use } and { and \\" quotes", "score": 3} y'
+    assert extract_json_object(text) == ({"new_prompt": 'use } and { and " quotes', "score": 3}, False)
+
+def test_repairs_truncated_output():
+    parsed, repaired = extract_json_object('{"score": 40, "strengths": ["clear", "sho')
+    assert repaired
+    assert parsed["score"] == 40 and parsed["strengths"][0] == "clear"
+
+def test_repairs_dangling_escape_and_comma():
+    parsed, repaired = extract_json_object('{"score": 40, "new_prompt": "line\\')
+    assert repaired and parsed["score"] == 40
+    parsed, repaired = extract_json_object('{"score": 40, "improvements": ["a",')
+    assert repaired and parsed == {"score": 40, "improvements": ["a"]}
+
+@pytest.mark.parametrize("text", ["", "no braces here", "} only", "[1, 2, 3]", '{"a": }'])
+def test_nothing_parseable(text):
+    assert extract_json_object(text) == (None, False)
+
+@pytest.mark.parametrize("text", [
+    "{[" * 8000 + "}",
+    '{"a": [' * 5000,
+    "{" * 20000,
+    "{\n" * 20000 + "}",
+    '{"a": 1 ' * 10000,
+    ("{x} " * 20000) + json.dumps(REPLY),
+])
+def test_adversarial_input_is_fast_and_safe(text):
+    started = time.perf_counter()
+    extract_json_object(text)
+    assert time.perf_counter() - started < 2.0
+
+def test_object_after_a_few_broken_candidates_is_found():
+    text = ('{"x": oops} ' * 5) + json.dumps(REPLY)
+    assert extract_json_object(text) == (REPLY, False)
+
+def test_decode_attempts_are_bounded():
+    # Past the failure budget the scan gives up rather than decoding every candidate
+    text = ('{"x": oops} ' * 2000) + json.dumps(REPLY)
+    assert extract_json_object(text) == (None, False)
+
+def test_unparseable_reply_falls_back_to_heuristic_score():
+    score, result = _parse_response("I think this prompt is fine, 8/10.", "Write a poem about the sea")
+    assert result["parse_fallback"] is True
+    assert isinstance(score, int) and score == result["overall_score"]
+    assert result["new_prompt"]
+
+def test_partial_reply_keeps_the_salvaged_rewrite():
+    reply = '{"score": 40, "new_prompt": "You are a poet.\\nWrite a \\"sonnet\\" about the sea.", "strengths": [oops]}'
+    _, result = _parse_response(reply, "Write a poem")
+    assert result["parse_fallback"] is True
+    assert result["new_prompt"] == 'You are a poet.\nWrite a "sonnet" about the sea.'
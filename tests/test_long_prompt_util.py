@@ -0,0 +1,139 @@
+import pytest
+
+import long_prompt_util
+from long_prompt_util import _pack, chunk_prompt, merge_section_analyses, section_query, split_sections
+from token_util import count_tokens
+
+PROMPT = """You are helping a support team.
+
+# Context
+Customers write in about billing.
+They are often upset.
+
+ROLE AND TONE
+Be calm and brief.
+
+Output format
+=============
+Reply in JSON.
+
+<rules>
+Never promise refunds.
+</rules>
+
+---
+RULES:
+Escalate legal threats.
+"""
+
+def test_split_sections_at_headings():
+    sections = split_sections(PROMPT)
+    assert "".join(text for _, text in sections) == PROMPT
+    assert [title for title, _ in sections] == [None, "Context", "ROLE AND TONE", "Output format", "rules", None,
+                                                "RULES"]
+
+def test_split_sections_without_headings():
+    assert split_sections("just one line\nand another\n") == [(None, "just one line\nand another\n")]
+
+def test_pack_joins_small_sections_up_to_the_limit():
+    sections = [(None, "a" * 38), (None, "b" * 38), (None, "c" * 38)]
+    assert _pack(sections, 20, None) == ["a" * 38 + "b" * 38, "c" * 38]
+
+def test_pack_splits_an_oversized_section():
+    paragraph = ("word " * 40).strip()
+    text = "\n\n".join([paragraph] * 6)
+    packed = _pack([(None, text)], 120, None)
+    assert len(packed) > 1
+    assert "".join(packed) == text
+    assert all(count_tokens(piece) <= 120 for piece in packed)
+
+def test_pack_splits_unbroken_text_by_characters():
+    packed = _pack([(None, "x" * 1000)], 50, None)
+    assert "".join(packed) == "x" * 1000
+    assert all(len(piece) <= 175 for piece in packed)
+
+def long_prompt(sections=20):
+    return "".join(f"## Part {index}\n" + "Some instructions for this part. " * 30 + "\n\n"
+                   for index in range(sections))
+
+def test_chunk_prompt_round_trips_and_titles_chunks():
+    text = long_prompt()
+    chunks = chunk_prompt(text, chunk_tokens=600, max_chunks=12)
+    assert "".join(chunk for _, chunk in chunks) == text
+    assert 1 < len(chunks) <= 12
+    assert chunks[0][0] == "Part 0"
+    assert all(title and title.startswith("Part ") for title, _ in chunks)
+
+def test_chunk_prompt_grows_chunks_to_respect_max_chunks():
+    text = long_prompt(40)
+    chunks = chunk_prompt(text, chunk_tokens=100, max_chunks=4)
+    assert len(chunks) <= 4
+    assert "".join(chunk for _, chunk in chunks) == text
+
+def test_section_query_places_the_section():
+    chunks = [("Intro", "hello\n"), (None, "world\n")]
+    assert section_query(chunks, 0).startswith("[Section 1 of 2 of a longer prompt: Intro.")
+    assert section_query(chunks, 1).endswith("]\n\nworld")
+
+def analysis(score, scores, new_prompt="", **extra):
+    return score, dict({
+        "overall_score": score,
+        "detailed_scores": dict(zip(long_prompt_util.DIMENSION_MERGE, scores)),
+        "strengths": ["Clear goal"],
+        "weaknesses": ["Vague"],
+        "improvements": ["Add examples"],
+        "new_prompt": new_prompt,
+    }, **extra)
+
+CHUNKS = [("Intro", "Intro text that is fairly long. " * 10 + "\n\n"), ("Rules", "Short rules.\n")]
+
+def test_merge_combines_dimensions_by_rule():
+    results = [analysis(60, [10, 5, 10, 2, 5, 1]), analysis(40, [4, 15, 4, 12, 3, 6])]
+    score, merged = merge_section_analyses(CHUNKS, results)
+    scores = merged["detailed_scores"]
+    assert (scores["context"], scores["role"], scores["constraints"], scores["advanced"]) == (15, 12, 5, 6)
+    # Means are weighted by section length, so the long intro dominates
+    assert 9 <= scores["clarity"] <= 10 and 9 <= scores["structure"] <= 10
+    assert score == merged["overall_score"] == sum(scores.values())
+
+def test_merge_rewrites_only_weak_sections(monkeypatch):
+    monkeypatch.setattr(long_prompt_util, "LONG_PROMPT_REWRITE_BELOW", 50)
+    results = [analysis(60, [10] * 6, new_prompt="Rewritten intro"),
+               analysis(40, [5] * 6, new_prompt="[Section 2 of 2 of a longer prompt: Rules.]\n\nBetter rules.")]
+    _, merged = merge_section_analyses(CHUNKS, results)
+    assert merged["new_prompt"] == CHUNKS[0][1] + "Better rules.\n"
+    assert [section["outcome"] for section in merged["long_prompt"]["sections"]] == ["kept", "rewritten"]
+    assert merged["long_prompt"]["rewritten"] == 1
+
+def test_merge_pools_findings_weakest_first():
+    results = [analysis(60, [10] * 6), analysis(40, [5] * 6)]
+    _, merged = merge_section_analyses(CHUNKS, results)
+    assert merged["weaknesses"] == ["Rules: Vague", "Intro: Vague"]
+    assert merged["strengths"] == ["Clear goal"]
+
+def test_merge_keeps_a_failed_section_verbatim():
+    results = [("Error", "Request timed out"), analysis(40, [5] * 6, new_prompt="Better rules.")]
+    _, merged = merge_section_analyses(CHUNKS, results)
+    assert merged["new_prompt"].startswith(CHUNKS[0][1])
+    assert merged["long_prompt"]["failed"] == 1
+    assert merged["long_prompt"]["sections"][0]["outcome"] == "failed"
+
+def test_merge_counts_parse_fallbacks():
+    results = [analysis(60, [10] * 6, parse_fallback=True), analysis(40, [5] * 6)]
+    _, merged = merge_section_analyses(CHUNKS, results)
+    assert merged["long_prompt"]["parse_fallbacks"] == 1
+    assert "parse_fallback" not in merged
+
+def test_merge_with_every_section_failed_returns_the_error():
+    results = [("Error", "Request timed out"), ("Error", "Connection error")]
+    assert merge_section_analyses(CHUNKS, results) == ("Error", "Request timed out")
+
+def test_merge_with_an_exception_result():
+    results = [RuntimeError("boom"), RuntimeError("bang")]
+    assert merge_section_analyses(CHUNKS, results) == ("Error", "Long prompt analysis failed: boom")
+
+@pytest.mark.parametrize("rewrite", ["", "Intro text that is fairly long. " * 10])
+def test_merge_ignores_empty_or_unchanged_rewrites(rewrite):
+    results = [analysis(10, [1] * 6, new_prompt=rewrite), analysis(10, [1] * 6)]
+    _, merged = merge_section_analyses(CHUNKS, results)
+    assert merged["new_prompt"] == CHUNKS[0][1] + CHUNKS[1][1]
@@ -0,0 +1,151 @@
+import pytest
+
+import app_util
+from app_util import RateLimiter, TokenBucket, _parse_reset
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(app_util.time, "monotonic", lambda: now[0])
+    return now
+
+def test_bucket_refills_at_capacity_per_minute(clock):
+    bucket = TokenBucket(60)
+    bucket.take(60)
+    assert bucket.wait_time(1) == pytest.approx(1.0)
+    bucket.refill(clock[0] + 30)
+    assert bucket.level == pytest.approx(30)
+    bucket.refill(clock[0] + 600)
+    assert bucket.level == 60
+
+def test_bucket_can_go_negative_for_reservations(clock):
+    bucket = TokenBucket(60)
+    bucket.take(60)
+    bucket.take(30)
+    assert bucket.level == -30
+    assert bucket.wait_time(1) == pytest.approx(31.0)
+
+def test_oversized_request_waits_for_a_full_bucket(clock):
+    bucket = TokenBucket(100)
+    assert bucket.wait_time(500) == 0
+    bucket.take(500)
+    assert bucket.level == 0
+    assert bucket.wait_time(500) == pytest.approx(60.0)
+
+def test_resize_caps_level(clock):
+    bucket = TokenBucket(100)
+    bucket.resize(10)
+    assert (bucket.capacity, bucket.level) == (10, 10)
+    assert bucket.rate == pytest.approx(10 / 60)
+
+def test_reserve_admits_then_refuses(clock):
+    limiter = RateLimiter(default_rpm=2, default_tpm=100000)
+    assert limiter.reserve("groq", "key", 10, max_wait=0) == (True, 0.0)
+    assert limiter.reserve("groq", "key", 10, max_wait=0) == (True, 0.0)
+    admitted, wait = limiter.reserve("groq", "key", 10, max_wait=0)
+    assert not admitted and wait == pytest.approx(30.0)
+    # A refusal reserves nothing
+    clock[0] += 30
+    assert limiter.reserve("groq", "key", 10, max_wait=0) == (True, 0.0)
+
+def test_reserve_within_max_wait_queues_behind(clock):
+    limiter = RateLimiter(default_rpm=60, default_tpm=600)
+    assert limiter.reserve("groq", "key", 600, max_wait=0) == (True, 0.0)
+    admitted, wait = limiter.reserve("groq", "key", 5, max_wait=1)
+    assert admitted and wait == pytest.approx(0.5)
+    admitted, wait = limiter.reserve("groq", "key", 5, max_wait=1)
+    assert admitted and wait == pytest.approx(1.0)
+
+def test_buckets_are_per_provider_and_key(clock):
+    limiter = RateLimiter(rpm_limits={"groq": 1}, default_rpm=5, default_tpm=100000)
+    assert limiter.reserve("groq", "a", 1, max_wait=0)[0]
+    assert not limiter.reserve("groq", "a", 1, max_wait=0)[0]
+    assert limiter.reserve("groq", "b", 1, max_wait=0)[0]
+    assert limiter.reserve("openai", "a", 1, max_wait=0)[0]
+
+def test_key_registry_is_bounded(clock):
+    limiter = RateLimiter(default_rpm=1, default_tpm=100000, max_keys=2)
+    for key in ("a", "b", "c"):
+        limiter.reserve("groq", key, 1, max_wait=0)
+    # "a" was evicted, so it starts again with a full bucket
+    assert limiter.reserve("groq", "a", 1, max_wait=0)[0]
+    assert not limiter.reserve("groq", "c", 1, max_wait=0)[0]
+
+def test_headers_tighten_the_buckets(clock):
+    limiter = RateLimiter(default_rpm=100, default_tpm=100000)
+    limiter.observe_headers("groq", "key", {
+        "x-ratelimit-limit-requests": "14400",
+        "x-ratelimit-reset-requests": "2m59.56s",
+        "x-ratelimit-limit-tokens": "6000",
+        "x-ratelimit-remaining-tokens": "100",
+        "x-ratelimit-reset-tokens": "7.66s",
+    })
+    # A per-day request limit is not adopted; the per-minute token limit is
+    admitted, wait = limiter.reserve("groq", "key", 200, max_wait=0)
+    assert not admitted and wait == pytest.approx(1.0)
+
+def test_exhausted_remaining_blocks_until_reset(clock):
+    limiter = RateLimiter(default_rpm=100, default_tpm=100000)
+    limiter.observe_headers("groq", "key", {"x-ratelimit-remaining-requests": "0",
+                                            "x-ratelimit-reset-requests": "5s"})
+    admitted, wait = limiter.reserve("groq", "key", 1, max_wait=0)
+    assert not admitted and wait == pytest.approx(5.0)
+
+def test_retry_after_blocks_the_key(clock):
+    limiter = RateLimiter(default_rpm=100, default_tpm=100000)
+    limiter.observe_headers("groq", "key", {"retry-after": "12"})
+    admitted, wait = limiter.reserve("groq", "key", 1, max_wait=2)
+    assert not admitted and wait == pytest.approx(12.0)
+    clock[0] += 12
+    assert limiter.reserve("groq", "key", 1, max_wait=0) == (True, 0.0)
+
+def test_unknown_limits_never_throttle(clock):
+    limiter = RateLimiter(default_rpm=None, default_tpm=None)
+    for _ in range(1000):
+        assert limiter.reserve("groq", "key", 5000, max_wait=0) == (True, 0.0)
+
+def test_limits_are_learned_from_headers(clock):
+    limiter = RateLimiter(default_rpm=None, default_tpm=None)
+    limiter.observe_headers("openai", "key", {
+        "x-ratelimit-limit-requests": "2",
+        "x-ratelimit-remaining-requests": "1",
+        "x-ratelimit-reset-requests": "30s",
+    })
+    assert limiter.reserve("openai", "key", 10, max_wait=0) == (True, 0.0)
+    admitted, wait = limiter.reserve("openai", "key", 10, max_wait=0)
+    assert not admitted and wait == pytest.approx(30.0)
+    # Other keys have learned nothing yet
+    assert limiter.reserve("openai", "other", 10, max_wait=0) == (True, 0.0)
+
+def test_per_day_limits_do_not_become_per_minute_caps(clock):
+    limiter = RateLimiter(default_rpm=None, default_tpm=None)
+    limiter.observe_headers("groq", "key", {
+        "x-ratelimit-limit-requests": "14400",
+        "x-ratelimit-remaining-requests": "14000",
+        "x-ratelimit-reset-requests": "2m59.56s",
+    })
+    for _ in range(500):
+        assert limiter.reserve("groq", "key", 10, max_wait=0) == (True, 0.0)
+
+def test_configured_provider_limit(clock):
+    limiter = RateLimiter(rpm_limits={"groq": 1}, default_rpm=None, default_tpm=None)
+    assert limiter.reserve("groq", "key", 1, max_wait=0)[0]
+    assert not limiter.reserve("groq", "key", 1, max_wait=0)[0]
+    assert limiter.reserve("openai", "key", 1, max_wait=0)[0]
+    assert limiter.reserve("openai", "key", 1, max_wait=0)[0]
+
+@pytest.mark.parametrize("value, expected", [
+    ("12", 12.0),
+    ("7.66s", 7.66),
+    ("6m0s", 360.0),
+    ("1h2m", 3720.0),
+    ("120ms", 0.12),
+    ("-3", 0.0),
+    ("", None),
+    (None, None),
+    ("soon", None),
+    ("2000-01-01T00:00:00Z", 0.0),
+])
+def test_parse_reset(value, expected):
+    result = _parse_reset(value)
+    assert result == (pytest.approx(expected) if expected is not None else None)
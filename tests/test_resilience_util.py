@@ -0,0 +1,103 @@
+import pytest
+
+import resilience_util
+from resilience_util import CircuitBreaker, is_provider_failure, parse_fallback_chain
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(resilience_util.time, "monotonic", lambda: now[0])
+    return now
+
+def make_breaker(**overrides):
+    options = dict(window=10, min_calls=4, error_rate=0.5, slow_call_seconds=5, slow_call_rate=0.8,
+                   open_seconds=30, half_open_probes=1)
+    options.update(overrides)
+    return CircuitBreaker("groq:test-model", **options)
+
+def trip(breaker):
+    for _ in range(breaker.min_calls):
+        assert breaker.allow()
+        breaker.record(True, 0.1)
+
+def test_stays_closed_below_min_calls(clock):
+    breaker = make_breaker()
+    for _ in range(3):
+        breaker.record(True, 0.1)
+    assert breaker.state == "closed"
+
+def test_opens_at_error_rate(clock):
+    breaker = make_breaker()
+    for failed in (False, True, False, True):
+        breaker.record(failed, 0.1)
+    assert breaker.state == "open"
+    assert breaker.trips == 1
+    assert not breaker.allow()
+    assert breaker.retry_after() == 30
+
+def test_healthy_traffic_keeps_it_closed(clock):
+    breaker = make_breaker()
+    for failed in (False, False, True, False, False, False):
+        breaker.record(failed, 0.1)
+    assert breaker.state == "closed"
+
+def test_slow_calls_trip_it(clock):
+    breaker = make_breaker()
+    for _ in range(4):
+        breaker.record(False, 6)
+    assert breaker.state == "open"
+
+def test_half_open_admits_limited_probes(clock):
+    breaker = make_breaker()
+    trip(breaker)
+    clock[0] += 29
+    assert not breaker.allow()
+    clock[0] += 1
+    assert breaker.allow()
+    assert breaker.state == "half_open"
+    assert not breaker.allow()
+
+def test_clean_probe_closes_it(clock):
+    breaker = make_breaker()
+    trip(breaker)
+    clock[0] += 30
+    assert breaker.allow()
+    breaker.record(False, 0.1)
+    assert breaker.state == "closed"
+    assert breaker.snapshot()["window_calls"] == 0
+
+@pytest.mark.parametrize("failed, seconds", [(True, 0.1), (False, 6)])
+def test_bad_probe_reopens_it(clock, failed, seconds):
+    breaker = make_breaker()
+    trip(breaker)
+    clock[0] += 30
+    assert breaker.allow()
+    breaker.record(failed, seconds)
+    assert breaker.state == "open"
+    assert breaker.trips == 2
+    assert breaker.retry_after() == 30
+
+def test_released_probe_frees_its_slot(clock):
+    breaker = make_breaker()
+    trip(breaker)
+    clock[0] += 30
+    assert breaker.allow()
+    breaker.release()
+    assert breaker.allow()
+
+@pytest.mark.parametrize("message, expected", [
+    ("Groq API error: Error code: 503 - service unavailable", True),
+    ("Request timed out", True),
+    ("Connection error", True),
+    ("Error code: 429 - Rate limit reached for model", False),
+    ("Error code: 401 - Invalid API key", False),
+    ("You exceeded your current quota", False),
+    ("Please provide an API key", False),
+])
+def test_fallback_classification(message, expected):
+    assert is_provider_failure(message) is expected
+
+def test_parse_fallback_chain():
+    assert parse_fallback_chain(" Groq , together:meta-llama/x ,, openai: ") == \
+        [("groq", None), ("together", "meta-llama/x"), ("openai", None)]
+    assert parse_fallback_chain("") == []
@@ -0,0 +1,87 @@
+import asyncio
+
+import pytest
+
+import schema_util
+from app_util import structured_call
+from async_util import _structured_call
+from schema_util import rejects_structured_output, structured_mode, structured_request_params
+
+REFUSAL = "Invalid parameter: 'response_format' of type 'json_schema' is not supported with this model."
+
+class FakeResponse:
+    def __init__(self, status_code, text=""):
+        self.status_code = status_code
+        self.text = text
+
+class BadRequest(Exception):
+    status_code = 400
+
+@pytest.fixture(autouse=True)
+def no_rejections(monkeypatch):
+    monkeypatch.setattr(schema_util, "_rejected", set())
+
+def test_json_schema_only_for_allow_listed_models():
+    assert structured_mode("openai", "gpt-4o-mini") == "json_schema"
+    assert structured_mode("openrouter", "openai/gpt-4o") == "json_schema"
+    assert structured_mode("openai", "gpt-3.5-turbo") == "json_object"
+    assert structured_mode("openrouter", "meta-llama/llama-3.3-70b-instruct") is None
+    assert structured_request_params("openrouter", "mistralai/mixtral-8x7b") == {}
+
+def test_other_providers_keep_their_mode():
+    assert structured_mode("groq", "llama-3.3-70b-versatile") == "json_object"
+    assert structured_mode("anthropic", "claude-3-5-haiku-latest") == "tool"
+    assert structured_mode("groq", "llama-3.3-70b-versatile", stream=True) is None
+
+def test_refusal_is_recognised_only_as_a_400_naming_the_fields():
+    assert rejects_structured_output(400, REFUSAL)
+    assert not rejects_structured_output(400, "max_tokens is too large")
+    assert not rejects_structured_output(500, REFUSAL)
+
+def test_refused_response_is_retried_once_as_text():
+    calls = []
+
+    def post(**structured):
+        calls.append(structured)
+        return FakeResponse(400, REFUSAL) if structured else FakeResponse(200)
+
+    response, structured = structured_call("openai", "gpt-4o", post)
+    assert response.status_code == 200 and structured == {}
+    assert "response_format" in calls[0] and calls[1] == {}
+    # Later requests for the model skip the doomed structured attempt
+    assert structured_request_params("openai", "gpt-4o") == {}
+
+def test_refused_sdk_call_is_retried_once_as_text():
+    calls = []
+
+    def create(**structured):
+        calls.append(structured)
+        if structured:
+            raise BadRequest(f"Error code: 400 - {REFUSAL}")
+        return "ok"
+
+    assert structured_call("groq", "llama-3.3-70b-versatile", create) == ("ok", {})
+    assert len(calls) == 2
+
+def test_other_failures_are_not_retried():
+    calls = []
+
+    def post(**structured):
+        calls.append(structured)
+        return FakeResponse(400, "max_tokens is too large")
+
+    response, structured = structured_call("openai", "gpt-4o", post)
+    assert response.status_code == 400 and structured and len(calls) == 1
+
+    def create(**structured):
+        raise BadRequest("context length exceeded")
+
+    with pytest.raises(BadRequest):
+        structured_call("openai", "gpt-4o", create)
+
+def test_async_refusal_is_retried_once_as_text():
+    async def post(**structured):
+        return FakeResponse(400, REFUSAL) if structured else FakeResponse(200)
+
+    response, structured = asyncio.run(_structured_call("openai", "gpt-4o", post))
+    assert response.status_code == 200 and structured == {}
@@ -0,0 +1,56 @@
+from similarity_util import NearDuplicateIndex, estimate_similarity, minhash_signature, shingles
+
+PROMPT = ("You are a senior data engineer. Review the following SQL query for performance problems, "
+          "explain each issue you find, and propose an optimized version with comments.")
+
+def test_shingles_ignore_case_whitespace_and_punctuation():
+    assert shingles("Hello,   World!") == {"hello world"}
+    assert shingles("one two three") == {"one two", "two three"}
+    assert shingles("...") == set()
+
+def test_signature_of_a_text_matches_itself():
+    signature = minhash_signature(PROMPT)
+    assert len(signature) == 64
+    assert estimate_similarity(signature, minhash_signature(PROMPT)) == 1.0
+    assert minhash_signature("  !!  ") is None
+
+def test_whitespace_and_punctuation_variants_hit():
+    index = NearDuplicateIndex(threshold=0.85)
+    index.add(PROMPT, "key-1")
+    variant = "  " + PROMPT.upper().replace(", ", " ; ").replace(" ", "\n  ") + "!!!"
+    assert index.lookup(variant) == ("key-1", 1.0)
+
+def test_unrelated_prompt_misses():
+    index = NearDuplicateIndex(threshold=0.85)
+    index.add(PROMPT, "key-1")
+    assert index.lookup("Write a cheerful birthday poem for my grandmother who loves gardening and cats.") is None
+    assert index.stats()["lookups"] == 1 and index.stats()["hits"] == 0
+
+def test_namespaces_and_exclusions_are_respected():
+    index = NearDuplicateIndex(threshold=0.85)
+    index.add(PROMPT, "key-1", namespace="caller-a")
+    assert index.lookup(PROMPT, namespace="caller-b") is None
+    assert index.lookup(PROMPT, namespace="caller-a") == ("key-1", 1.0)
+    assert index.lookup(PROMPT, namespace="caller-a", exclude="key-1") is None
+
+def test_entries_are_evicted_at_capacity():
+    index = NearDuplicateIndex(threshold=0.85, max_entries=2)
+    prompts = [f"Prompt number {word}: summarize the quarterly {word} report for the {word} team"
+               for word in ("alpha", "bravo", "charlie")]
+    for number, prompt in enumerate(prompts):
+        index.add(prompt, f"key-{number}")
+    assert index.stats()["entries"] == 2
+    assert index.lookup(prompts[0]) is None
+    assert index.lookup(prompts[1]) == ("key-1", 1.0)
+    assert index.lookup(prompts[2]) == ("key-2", 1.0)
+
+def test_discard_and_re_add_leave_no_stale_buckets():
+    index = NearDuplicateIndex(threshold=0.85)
+    index.add(PROMPT, "key-1")
+    index.add(PROMPT, "key-2")
+    index.discard("key-1")
+    assert index.lookup(PROMPT) == ("key-2", 1.0)
+    index.add(PROMPT, "key-2")
+    index.discard("key-2")
+    assert index.lookup(PROMPT) is None
+    assert index._buckets == {}
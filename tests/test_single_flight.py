@@ -0,0 +1,118 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from cache_util import AsyncSingleFlight, SingleFlight
+
+CALLERS = 8
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.001)
+
+def run_concurrently(flight, producer):
+    """Call flight.do from CALLERS threads, releasing the producer once all have joined"""
+    release = threading.Event()
+    outcomes = [None] * CALLERS
+
+    def gated():
+        release.wait(5)
+        return producer()
+
+    def caller(index):
+        try:
+            outcomes[index] = ("ok", flight.do("key", gated))
+        except Exception as e:
+            outcomes[index] = ("error", e)
+
+    threads = [threading.Thread(target=caller, args=(index,)) for index in range(CALLERS)]
+    for thread in threads:
+        thread.start()
+    wait_for(lambda: flight.followers == CALLERS - 1)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+    return outcomes
+
+def test_concurrent_callers_share_one_call():
+    flight, calls = SingleFlight(), []
+
+    def producer():
+        calls.append(1)
+        return {"score": 80}
+
+    outcomes = run_concurrently(flight, producer)
+    assert len(calls) == 1
+    results = [value for kind, value in outcomes if kind == "ok"]
+    assert len(results) == CALLERS
+    assert all(result is results[0][0] for result, _ in results)
+    assert sorted(shared for _, shared in results) == [False] + [True] * (CALLERS - 1)
+    assert flight.stats() == {"in_flight": 0, "leaders": 1, "followers": CALLERS - 1,
+                              "coalescing_ratio": round((CALLERS - 1) / CALLERS, 4)}
+
+def test_every_waiter_sees_the_exception():
+    flight, calls = SingleFlight(), []
+
+    def producer():
+        calls.append(1)
+        raise RuntimeError("upstream down")
+
+    outcomes = run_concurrently(flight, producer)
+    assert len(calls) == 1
+    assert [kind for kind, _ in outcomes] == ["error"] * CALLERS
+    assert all(str(error) == "upstream down" for _, error in outcomes)
+
+def test_nothing_is_kept_after_the_call():
+    flight = SingleFlight()
+    assert flight.do("key", lambda: 1) == (1, False)
+    assert flight.do("key", lambda: 2) == (2, False)
+    assert flight.stats()["in_flight"] == 0
+
+def test_different_keys_do_not_coalesce():
+    flight = SingleFlight()
+    assert flight.do("a", lambda: "a") == ("a", False)
+    assert flight.do("b", lambda: "b") == ("b", False)
+    assert flight.followers == 0
+
+def test_async_callers_share_one_call():
+    flight, calls = AsyncSingleFlight(), []
+
+    async def producer():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return {"score": 80}
+
+    async def main():
+        return await asyncio.gather(*(flight.do("key", producer) for _ in range(CALLERS)))
+
+    results = asyncio.run(main())
+    assert len(calls) == 1
+    assert all(result is results[0][0] for result, _ in results)
+    assert [shared for _, shared in results] == [False] + [True] * (CALLERS - 1)
+
+def test_async_waiters_see_the_exception_and_survive_a_cancelled_caller():
+    flight, calls = AsyncSingleFlight(), []
+
+    async def producer():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        raise RuntimeError("upstream down")
+
+    async def main():
+        leader = asyncio.ensure_future(flight.do("key", producer))
+        await asyncio.sleep(0)
+        followers = [asyncio.ensure_future(flight.do("key", producer)) for _ in range(CALLERS - 1)]
+        leader.cancel()
+        return await asyncio.gather(*followers, return_exceptions=True)
+
+    outcomes = asyncio.run(main())
+    assert len(calls) == 1
+    assert all(isinstance(outcome, RuntimeError) for outcome in outcomes)
+
+@pytest.mark.parametrize("flight", [SingleFlight(), AsyncSingleFlight()])
+def test_stats_start_empty(flight):
+    assert flight.stats()["coalescing_ratio"] == 0.0
@@ -0,0 +1,49 @@
+import pytest
+
+import token_util
+from token_util import count_tokens, output_token_budget
+
+def test_count_tokens_by_tokenizer_family():
+    assert count_tokens("a" * 400, "openai") == 100
+    assert count_tokens("a" * 350, "anthropic") == 100
+    assert count_tokens("a" * 380) == 100
+    # Five ASCII characters at 4 per token, plus one token per non-ASCII character
+    assert count_tokens("héllo 日本", "openai") == 5
+    assert count_tokens(None) == 0
+
+def test_budget_is_the_style_base_plus_room_for_the_rewrite():
+    # comprehensive: 900 + 1.5 * 100 tokens = 1050, rounded up to the 256 step
+    assert output_token_budget("a" * 400, "comprehensive", "openai") == 1280
+    assert output_token_budget("short", "quick", "openai") == 512
+    assert output_token_budget("short", "detailed", "openai") == 2048
+
+def test_unknown_style_uses_the_comprehensive_base():
+    assert output_token_budget("short", "nonsense") == output_token_budget("short", "comprehensive")
+
+def test_budget_is_capped_for_the_model_and_overall():
+    long_prompt = "a" * 40000
+    assert output_token_budget(long_prompt, "comprehensive", "openai", "gpt-4o") == token_util.MAX_OUTPUT_TOKENS
+    assert output_token_budget(long_prompt, "comprehensive", "openai", "gpt-4-turbo") == 4096
+
+def test_near_identical_prompts_share_a_budget():
+    assert output_token_budget("a" * 400, provider="openai") == output_token_budget("a" * 420, provider="openai")
+
+def test_flat_budget_when_disabled(monkeypatch):
+    monkeypatch.setattr(token_util, "ADAPTIVE_MAX_TOKENS", False)
+    assert output_token_budget("a" * 40000, "detailed") == token_util.DEFAULT_MAX_TOKENS
+
+@pytest.mark.parametrize("field, value", [("model", ["a"]), ("provider", {"name": "groq"}), ("style", 3)])
+def test_non_string_choice_fields_are_rejected(field, value):
+    from main import _validate_request
+    data = {"prompt": "Write a poem about the sea", "api_key": "gsk_0123456789", field: value}
+    params, error = _validate_request(data)
+    assert params is None
+    assert error == ({"error": f"{field} must be a string"}, 400)
+
+def test_unhashable_model_is_a_400_over_http():
+    from main import app
+    response = app.test_client().post("/api/prompt/analyze", json={
+        "prompt": "Write a poem about the sea", "api_key": "gsk_0123456789", "model": ["a"]
+    })
+    assert response.status_code == 400
+    assert response.get_json() == {"error": "model must be a string"}
@@ -0,0 +1,57 @@
+import json
+
+import pytest
+
+import app_util
+from app_util import _complete_analysis, join_continuation
+
+REPLY = {"score": 40, "clarity_score": 8, "context_score": 7, "structure_score": 7, "role_score": 6,
+         "constraints_score": 6, "advanced_score": 6,
+         "new_prompt": "You are an expert poet. Write a 14-line sonnet about the sea, in iambic pentameter.",
+         "strengths": ["clear"], "weaknesses": ["vague"], "improvements": ["add context"],
+         "reasoning": "The prompt names a form but gives no audience or constraints."}
+TEXT = json.dumps(REPLY)
+QUERY = "Write a poem"
+USAGE = {"prompt_tokens": 100, "completion_tokens": 50}
+
+def test_complete_reply_is_not_tagged():
+    score, result = _complete_analysis(QUERY, "comprehensive", TEXT, USAGE, "stop")
+    assert score == 40 and "truncation" not in result
+    assert result["usage"]["output_tokens"] == 50
+
+def test_cut_after_the_essential_fields_is_repaired_without_a_call():
+    partial = TEXT[:TEXT.index('"reasoning"') + 16]
+    continuation = pytest.fail  # must not be called
+    score, result = _complete_analysis(QUERY, "comprehensive", partial, USAGE, "length", continuation)
+    assert result["truncation"] == "repaired"
+    assert score == 40 and result["new_prompt"] == REPLY["new_prompt"]
+
+def test_cut_before_the_rewrite_is_continued():
+    cut = TEXT.index('"new_prompt"') + 30
+    calls = []
+
+    def continuation(partial):
+        calls.append(partial)
+        return join_continuation(partial, TEXT[cut:]), {"prompt_tokens": 120, "completion_tokens": 40}
+
+    _, result = _complete_analysis(QUERY, "comprehensive", TEXT[:cut], USAGE, "length", continuation)
+    assert calls == [TEXT[:cut]]
+    assert result["truncation"] == "continued"
+    assert result["new_prompt"] == REPLY["new_prompt"]
+    assert result["usage"]["input_tokens"] == 220 and result["usage"]["output_tokens"] == 90
+
+def test_model_that_starts_over_replaces_the_partial():
+    assert join_continuation('{"score": 4', "\n" + TEXT) == "\n" + TEXT
+    assert join_continuation('{"score": 4', '0, "x": 1}') == '{"score": 40, "x": 1}'
+
+def test_failed_continuation_is_unrecovered():
+    def continuation(partial):
+        raise RuntimeError("upstream down")
+
+    _, result = _complete_analysis(QUERY, "comprehensive", TEXT[:40], USAGE, "max_tokens", continuation)
+    assert result["truncation"] == "unrecovered"
+
+def test_continuation_can_be_disabled(monkeypatch):
+    monkeypatch.setattr(app_util, "TRUNCATION_CONTINUE", False)
+    _, result = _complete_analysis(QUERY, "comprehensive", TEXT[:40], USAGE, "length", pytest.fail)
+    assert result["truncation"] == "unrecovered"
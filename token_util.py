@@ -0,0 +1,64 @@
+import math
+import os
+import re
+
+from batch_util import parse_concurrency_limits
+
+# Adaptive output budgets - max_tokens is sized per request from the style's
+# expected output plus room for the rewritten prompt, instead of a flat 1000
+ADAPTIVE_MAX_TOKENS = os.getenv("ADAPTIVE_MAX_TOKENS", "1") == "1"
+DEFAULT_MAX_TOKENS = int(os.getenv("DEFAULT_MAX_TOKENS", 1000))
+
+# Expected analysis length per style, before the rewrite: "detailed" adds
+# reasoning, methodology, use case and scalability essays to the JSON
+STYLE_OUTPUT_TOKENS = {"quick": 400, "comprehensive": 900, "detailed": 2000}
+STYLE_OUTPUT_TOKENS.update(parse_concurrency_limits(os.getenv("ANALYSIS_OUTPUT_TOKENS", "")))
+# The rewritten prompt usually runs longer than the original
+REWRITE_FACTOR = float(os.getenv("ANALYSIS_REWRITE_FACTOR", 1.5))
+# Budgets are rounded up to this step, so near-identical prompts share cache
+# and near-duplicate namespaces (both include max_tokens)
+BUDGET_STEP = 256
+MAX_OUTPUT_TOKENS = int(os.getenv("ANALYSIS_MAX_OUTPUT_TOKENS", 8192))
+
+# Models whose completions are capped below MAX_OUTPUT_TOKENS
+MODEL_OUTPUT_LIMITS = {
+    "gpt-4": 4096,
+    "gpt-4-turbo": 4096,
+    "gpt-3.5-turbo": 4096,
+    "claude-3-opus-20240229": 4096,
+    "claude-3-sonnet-20240229": 4096,
+    "claude-3-haiku-20240307": 4096,
+    "gemma2-9b-it": 4096,
+}
+
+# Average characters per token of English text for each provider's tokenizer
+# family: tiktoken (OpenAI) and Llama 3 (Groq, Together) vocabularies are
+# larger than Claude's and Mistral's, so they pack more text per token
+CHARS_PER_TOKEN = {
+    "openai": 4.0,
+    "groq": 4.0,
+    "together": 4.0,
+    "openrouter": 3.8,
+    "anthropic": 3.5,
+    "mistral": 3.5,
+}
+_NON_ASCII = re.compile(r"[^\x00-\x7f]")
+
+def count_tokens(text, provider=None):
+    """Estimated token count of text for provider's tokenizer family
+
+    Non-ASCII characters (accents, CJK, emoji) cost about a token each in
+    all of these vocabularies, so they are counted separately.
+    """
+    text = str(text or "")
+    non_ascii = len(_NON_ASCII.findall(text))
+    return math.ceil((len(text) - non_ascii) / CHARS_PER_TOKEN.get(provider, 3.8)) + non_ascii
+
+def output_token_budget(query, style="comprehensive", provider=None, model=None):
+    """max_tokens for analyzing query: the style's base plus room for the rewrite, capped for the model"""
+    if not ADAPTIVE_MAX_TOKENS:
+        return DEFAULT_MAX_TOKENS
+    base = STYLE_OUTPUT_TOKENS.get(style, STYLE_OUTPUT_TOKENS["comprehensive"])
+    budget = base + REWRITE_FACTOR * count_tokens(query, provider)
+    budget = math.ceil(budget / BUDGET_STEP) * BUDGET_STEP
+    return min(budget, MODEL_OUTPUT_LIMITS.get(model, MAX_OUTPUT_TOKENS), MAX_OUTPUT_TOKENS)